@@ -1,3 +1,5 @@
+import functools
+
 import numpy as np
 
 def kappa_simple(k,RH, n = None, inverse = False):
@@ -54,7 +56,169 @@ def kappa_simple(k,RH, n = None, inverse = False):
     # adjust index of refraction
     if not inverse:
         if n:
-            nw = 1.33
-            n_mix = lambda n,gf: (n + ((gf-1)*nw))/gf
-            return out, n_mix(n,out)
-    return out
\ No newline at end of file
+            return out, mix_index_of_refraction(n, out)
+    return out
+
+
+def mix_index_of_refraction(n, gf):
+    """Index of refraction of a particle with index of refraction n after it grew by the growth factor gf by
+    taking up water."""
+    nw = 1.33
+    n_mix = lambda n,gf: (n + ((gf-1)*nw))/gf
+    return n_mix(n, gf)
+
+
+# properties of water used in the Kelvin term
+_molar_mass_water = 0.018015  # kg/mol
+_density_water = 997.  # kg/m^3
+_gas_constant = 8.314462  # J/(mol K)
+
+
+def _kelvin_diameter(T):
+    """Kelvin diameter A = 4 sigma M_w / (R T rho_w) of water in nm, with the temperature dependent surface tension
+    of water (T in K)."""
+    surface_tension = 0.0761 - 1.55e-4 * (T - 273.15)
+    return 4 * surface_tension * _molar_mass_water / (_gas_constant * T * _density_water) * 1e9
+
+
+def _solve_kappa_koehler(k, S, d_dry, T, max_iter=100, tol=1e-12):
+    """Vectorized Newton iteration (safeguarded by bisection) for the equilibrium growth factor. All arguments are
+    arrays of the same shape. The unknown is y = ln(gf^3 - 1), for which the kappa-Koehler equation
+
+        ln(S) = y - ln(exp(y) + k) + A / (d_dry * (1 + exp(y))^(1/3))
+
+    has exactly one solution if S < 1."""
+    gf = np.ones(S.shape)
+    grows = (k > 0) & (S > 0)
+    k, S, d_dry, T = k[grows], S[grows], d_dry[grows], T[grows]
+    kelvin = _kelvin_diameter(T) / d_dry
+    log_S = np.log(S)
+
+    # without the Kelvin term the solution is x = k S / (1 - S) (kappa_simple); the curvature makes it smaller
+    hi = np.log(k * S / (1 - S))
+    lo = np.log(k) + log_S - kelvin - 1
+    y = hi.copy()
+    for i in range(max_iter):
+        x = np.exp(y)
+        f = y - np.log(x + k) + kelvin * (1 + x) ** (-1 / 3.) - log_S
+        df = k / (x + k) - kelvin * x * (1 + x) ** (-4 / 3.) / 3.
+        lo = np.where(f < 0, y, lo)
+        hi = np.where(f < 0, hi, y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y_new = y - f / df
+        bisect = ~((y_new > lo) & (y_new < hi))
+        y_new[bisect] = ((lo + hi) / 2)[bisect]
+        step = np.abs(y_new - y)
+        y = y_new
+        if not np.any(step > tol):
+            break
+    gf[grows] = (1 + np.exp(y)) ** (1 / 3.)
+    return gf
+
+
+# axes of the tabulated solutions: log10 of the dry diameter (nm) and log10(1 - RH/100)
+_table_log_d_dry = np.linspace(0, 5, 251)
+_table_log_1_minus_S = np.linspace(-4, 0, 401)
+
+
+@functools.lru_cache(maxsize=64)
+def _get_kappa_koehler_table(k, T):
+    """Growth factors on the grid _table_log_d_dry x _table_log_1_minus_S for one combination of kappa and
+    temperature (cached)."""
+    log_d_dry, log_1_minus_S = np.meshgrid(_table_log_d_dry, _table_log_1_minus_S, indexing='ij')
+    S = 1 - 10 ** log_1_minus_S
+    gf = _solve_kappa_koehler(np.full(S.shape, k), S, 10 ** log_d_dry, np.full(S.shape, T))
+    gf.flags.writeable = False
+    return gf
+
+
+def _interpolate_table(table, log_d_dry, log_1_minus_S):
+    """Bilinear interpolation of a table returned by _get_kappa_koehler_table (the axes are equally spaced)"""
+    weights = []
+    for axis, value in ((_table_log_d_dry, log_d_dry), (_table_log_1_minus_S, log_1_minus_S)):
+        position = (value - axis[0]) / (axis[1] - axis[0])
+        idx = np.clip(np.floor(position).astype(int), 0, axis.shape[0] - 2)
+        weights.append((idx, position - idx))
+    (i, wi), (j, wj) = weights
+    return ((1 - wi) * ((1 - wj) * table[i, j] + wj * table[i, j + 1])
+            + wi * ((1 - wj) * table[i + 1, j] + wj * table[i + 1, j + 1]))
+
+
+def kappa_koehler(k, RH, d_dry, T=298.15, n=None, tabulated=True):
+    r"""Returns the equilibrium growth factor as a function of the dry diameter, kappa, RH, and temperature.
+    Unlike kappa_simple this includes the curvature (Kelvin) effect, which reduces the growth of small particles.
+
+    Petters, M. D., & Kreidenweis, S. M. (2007). A single parameter representation of hygroscopic
+    growth and cloud condensation nucleus activity, 1961–1971. doi:10.5194/acp-7-1961-2007
+
+    latex expression: $\frac{RH}{100} = \frac{D^3 - D_d^3}{D^3 - D_d^3(1 - \kappa)} \exp\left(\frac{4 \sigma_w M_w}{R T \rho_w D}\right)$
+
+    The equation is solved by a vectorized Newton iteration. If tabulated is True, the solutions for each
+    combination of kappa and T are tabulated once over dry diameter (1 nm to 100 um) and RH (up to 99.99 %) and
+    interpolated (relative error < 1e-4), which is much faster for long time series. Points outside the table are
+    solved directly.
+
+    Arguments
+    ---------
+    k: float or array
+        kappa value between 0 and 1.4
+    RH: float or array
+        Relative humidity -> between 0 and 100 (excluding 100)
+    d_dry: float or array
+        dry diameter in nm
+    T: float or array, optional
+        temperature in K
+    n: float, optional
+        index of refraction of the dry particle
+    tabulated: bool, optional
+
+    k, RH, d_dry, and T are broadcast against each other, e.g. RH[:, np.newaxis] and d_dry give an array of shape
+    (no_of_RH_values, no_of_diameters).
+
+    Returns
+    -------
+    array: The growth factor of the particles.
+    if n is given a further array is returned which gives the new refractiv index of the grown particles
+    """
+    k, RH, d_dry, T = np.broadcast_arrays(*[np.asarray(i, dtype=float) for i in (k, RH, d_dry, T)])
+    if np.any(k > 1.4) or np.any(k < 0):
+        txt = '''The kappa value has to be between 0 and 1.4.'''
+        raise ValueError(txt)
+    if np.any(RH >= 100) or np.any(RH < 0):
+        txt = """RH has to be between 0 and 100 (excluding 100)"""
+        raise ValueError(txt)
+    if np.any(d_dry <= 0):
+        raise ValueError('The dry diameter has to be larger than 0.')
+
+    shape = RH.shape
+    k, RH, d_dry, T = [i.ravel() for i in (k, RH, d_dry, T)]
+    S = RH / 100.
+    gf = np.full(S.shape, np.nan)
+    valid = np.isfinite(k) & np.isfinite(S) & np.isfinite(d_dry) & np.isfinite(T)
+    direct = valid.copy()
+
+    if tabulated:
+        log_d_dry = np.log10(d_dry)
+        with np.errstate(divide='ignore'):
+            log_1_minus_S = np.log10(1 - S)
+        in_table = (valid & (log_d_dry >= _table_log_d_dry[0]) & (log_d_dry <= _table_log_d_dry[-1])
+                    & (log_1_minus_S >= _table_log_1_minus_S[0]))
+        k_unique, k_inverse = np.unique(k[in_table], return_inverse=True)
+        T_unique, T_inverse = np.unique(T[in_table], return_inverse=True)
+        pairs, inverse = np.unique(k_inverse * T_unique.shape[0] + T_inverse, return_inverse=True)
+        # tabulating only pays off if the combinations are repeated
+        if pairs.shape[0] * _table_log_d_dry.shape[0] * _table_log_1_minus_S.shape[0] < in_table.sum():
+            points = np.where(in_table)[0]
+            for e, (i, j) in enumerate(zip(*np.divmod(pairs, T_unique.shape[0]))):
+                which = points[inverse == e]
+                table = _get_kappa_koehler_table(k_unique[i], T_unique[j])
+                gf[which] = _interpolate_table(table, log_d_dry[which], log_1_minus_S[which])
+            direct &= ~in_table
+
+    gf[direct] = _solve_kappa_koehler(k[direct], S[direct], d_dry[direct], T[direct])
+    gf = gf.reshape(shape)
+
+    # adjust index of refraction
+    if n:
+        return gf, mix_index_of_refraction(n, gf)
+    return gf
@@ -0,0 +1,228 @@
+import hashlib
+import weakref
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from atmPy.for_removal.mie import mie_aux
+
+# distribution types which can be converted into each other
+dist_types = ('dNdDp', 'dNdlogDp', 'dSdDp', 'dSdlogDp', 'dVdDp', 'dVdlogDp', 'numberConcentration')
+
+# all BinAxis instances which are currently in use, keyed by the hash of the bin edges
+_axes = weakref.WeakValueDictionary()
+
+# number of overlap matrices each BinAxis keeps (see get_overlap_matrix)
+overlap_cache_size = 64
+
+
+class BinAxis(object):
+    """ Immutable diameter axis of a size distribution.
+
+    Holds the bin edges and everything that is derived from them: centers, widths, log-widths, the column names of the
+    DataFrame, and the factors which convert dNdDp into the other distribution types. Instances are shared by
+    reference between all size distributions with the same bins (use get instead of instantiating the class), so
+    comparing the bins of two distributions is a comparison of two hashes.
+
+    Parameters
+    ----------
+    edges: array-like
+        bin edges in nm
+
+    Attributes
+    ----------
+    edges, centers, widths, log_widths: read-only arrays
+    factors: read-only array of shape (len(dist_types), no_of_bins)
+        factors[i] converts dNdDp into the distribution type dist_types[i]
+    """
+
+    def __init__(self, edges):
+        edges = np.array(edges, dtype=float)
+        if edges.ndim != 1 or edges.shape[0] < 2:
+            raise ValueError('The bin edges have to be a 1-D array with at least two values.')
+        self.edges = edges
+        self.centers = (edges[1:] + edges[:-1]) / 2.
+        self.widths = edges[1:] - edges[:-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.log_widths = np.log10(edges[1:] / edges[:-1])
+
+        normal2log = self.centers * np.log(10.)
+        surface = np.pi * self.centers ** 2
+        volume = np.pi / 6. * self.centers ** 3
+        ones = np.ones(self.centers.shape)
+        self.factors = np.array([ones, normal2log,
+                                 surface, surface * normal2log,
+                                 volume, volume * normal2log,
+                                 self.widths])
+
+        for array in (self.edges, self.centers, self.widths, self.log_widths, self.factors):
+            array.flags.writeable = False
+
+        bins_st = edges.astype(int).astype(str)
+        self.column_names = pd.Index([bins_st[e] + '-' + bins_st[e + 1] for e in range(len(bins_st) - 1)])
+        self._key = hashlib.sha1(edges.tobytes()).digest()
+        self._conversion_factors = {}
+        # overlap matrices from this axis, keyed by the key of the target axis, the scale, and log
+        self._overlap_matrices = mie_aux.Cache(size=overlap_cache_size)
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __eq__(self, other):
+        if not isinstance(other, BinAxis):
+            return NotImplemented
+        return self is other or self._key == other._key
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __len__(self):
+        return self.centers.shape[0]
+
+    def __repr__(self):
+        return 'BinAxis(%i bins, %s - %s nm)' % (len(self), self.edges[0], self.edges[-1])
+
+    # immutable, so copies are the instance itself; unpickled instances are shared too
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return get, (self.edges,)
+
+    def get_factor(self, dist_type):
+        """Factor which converts dNdDp into dist_type"""
+        if dist_type not in dist_types:
+            raise ValueError('%s is not an option' % dist_type)
+        return self.factors[dist_types.index(dist_type)]
+
+    def get_conversion_factor(self, dist_type_from, dist_type_to):
+        """Factor which converts a distribution of type dist_type_from into dist_type_to (cached).
+
+        Returns
+        -------
+        read-only array of length no_of_bins
+        """
+        key = (dist_type_from, dist_type_to)
+        factor = self._conversion_factors.get(key)
+        if factor is None:
+            factor = self.get_factor(dist_type_to) / self.get_factor(dist_type_from)
+            factor.flags.writeable = False
+            self._conversion_factors[key] = factor
+        return factor
+
+
+def get(edges):
+    """Returns the BinAxis instance for the given bin edges. Distributions with equal bins share the same instance.
+
+    Parameters
+    ----------
+    edges: array-like or BinAxis instance
+
+    Returns
+    -------
+    BinAxis instance
+    """
+    if isinstance(edges, BinAxis):
+        return edges
+    edges = np.asarray(edges, dtype=float)
+    key = hashlib.sha1(np.ascontiguousarray(edges).tobytes()).digest()
+    axis = _axes.get(key)
+    if axis is None:
+        axis = BinAxis(edges)
+        _axes[key] = axis
+    return axis
+
+
+def get_overlap_matrix(axis_from, axis_to, scale=1., log=False):
+    """ Sparse matrix which redistributes the content of the bins of axis_from onto the bins of axis_to, after the
+    edges of axis_from were multiplied with scale (e.g. a growth factor). Element (j, i) is the fraction of bin i which
+    lies in bin j, assuming the particles are distributed uniformly in diameter (in log diameter if log is True)
+    within each bin. Content outside of axis_to is lost.
+
+    The scale is rounded to 10 significant digits. The last overlap_cache_size matrices are cached by axis_from (so
+    they are freed with it), do not change them.
+
+    Parameters
+    ----------
+    axis_from, axis_to: BinAxis instances
+    scale: float, optional
+    log: bool, optional
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix of shape (len(axis_to), len(axis_from)). Multiply it with the number concentration
+    (numberConcentration), or the surface or volume in each bin.
+    """
+    scale = float('%.10g' % scale)
+    key = (axis_to._key, scale, bool(log))
+    try:
+        return axis_from._overlap_matrices[key]
+    except KeyError:
+        pass
+
+    edges_from = axis_from.edges * scale
+    edges_to = axis_to.edges
+    if log:
+        if edges_from[0] <= 0 or edges_to[0] <= 0:
+            raise ValueError('The bin edges have to be larger than 0 for a logarithmic overlap.')
+        edges_from = np.log10(edges_from)
+        edges_to = np.log10(edges_to)
+    source, target, fraction = _get_overlaps(edges_from[:-1], edges_from[1:], edges_to)
+    matrix = sparse.csr_matrix((fraction, (target, source)), shape=(len(axis_to), len(axis_from)))
+    axis_from._overlap_matrices[key] = matrix
+    return matrix
+
+
+def _get_overlaps(lower, upper, edges):
+    """Overlaps of the bins (lower, upper) (flat arrays) with the bins defined by edges.
+
+    Returns
+    -------
+    source, target, fraction: arrays
+        the bin lower[source] - upper[source] overlaps with bin target, fraction is the overlap relative to its width
+    """
+    no_of_bins = edges.shape[0] - 1
+    # range of target bins each bin overlaps with
+    first = np.maximum(np.searchsorted(edges, lower, side='right') - 1, 0)
+    last = np.minimum(np.searchsorted(edges, upper, side='left') - 1, no_of_bins - 1)
+    counts = np.maximum(last - first + 1, 0)
+    source = np.repeat(np.arange(lower.shape[0]), counts)
+    offsets = np.cumsum(counts) - counts
+    target = first[source] + np.arange(source.shape[0]) - offsets[source]
+
+    overlap = np.minimum(upper[source], edges[target + 1]) - np.maximum(lower[source], edges[target])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = overlap / (upper - lower)[source]
+    keep = fraction > 0
+    return source[keep], target[keep], fraction[keep]
+
+
+def redistribute(values, edges_from, axis_to):
+    """ Redistributes the content of bins which differ from line to line (e.g. grown by a size dependent growth
+    factor) onto the bins of axis_to, see get_overlap_matrix. All lines are done at once.
+
+    Parameters
+    ----------
+    values: array of shape (no_of_lines, no_of_bins)
+        number concentration (numberConcentration) in each bin
+    edges_from: array of shape (no_of_lines, no_of_bins + 1)
+        bin edges of each line
+    axis_to: BinAxis instance
+
+    Returns
+    -------
+    array of shape (no_of_lines, len(axis_to))
+    """
+    no_of_lines, no_of_bins = values.shape
+    source, target, fraction = _get_overlaps(edges_from[:, :-1].ravel(), edges_from[:, 1:].ravel(), axis_to.edges)
+    line = source // no_of_bins
+    out = np.bincount(line * len(axis_to) + target, weights=fraction * values.ravel()[source],
+                      minlength=no_of_lines * len(axis_to))
+    return out.reshape(no_of_lines, len(axis_to))
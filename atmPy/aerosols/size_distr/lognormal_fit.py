@@ -0,0 +1,377 @@
+from concurrent import futures
+
+import numpy as np
+
+
+def multi_gauss(x, params):
+    """ Sum of normal distributions for many rows at once.
+
+    Parameters
+    ----------
+    x: array of shape (no_of_bins,)
+    params: array of shape (no_of_rows, 3 * no_of_modes)
+        amplitude, position, and sigma of each mode, see math_functions.gauss
+
+    Returns
+    -------
+    array of shape (no_of_rows, no_of_bins)
+    """
+    amp, pos, sigma = _split(params)
+    return (amp * np.exp(-(x - pos) ** 2 / (2. * sigma ** 2))).sum(axis=1)
+
+
+def _split(params):
+    """amplitudes, positions, and sigmas, each of shape (no_of_rows, no_of_modes, 1)"""
+    return params[:, 0::3, np.newaxis], params[:, 1::3, np.newaxis], params[:, 2::3, np.newaxis]
+
+
+def _jacobian(x, params):
+    """Derivatives of multi_gauss with respect to the parameters, shape (no_of_rows, no_of_bins, no_of_params)"""
+    amp, pos, sigma = _split(params)
+    dx = x - pos
+    e = np.exp(-dx ** 2 / (2. * sigma ** 2))
+    d_amp = e
+    d_pos = amp * e * dx / sigma ** 2
+    d_sigma = d_pos * dx / sigma
+    jac = np.stack((d_amp, d_pos, d_sigma), axis=2)
+    return jac.reshape(params.shape[0], params.shape[1], x.shape[0]).transpose(0, 2, 1)
+
+
+def get_moment_guess(x, y):
+    """ Initial guess of a single normal distribution for each row from the moments of the row.
+
+    Parameters
+    ----------
+    x: array of shape (no_of_bins,)
+    y: array of shape (no_of_rows, no_of_bins)
+        nan values are ignored
+
+    Returns
+    -------
+    array of shape (no_of_rows, 3): amplitude (maximum of the row), position (mean), and sigma (standard deviation).
+    Rows without positive values are nan.
+    """
+    y = np.atleast_2d(y)
+    weights = np.where(np.isfinite(y) & (y > 0), y, 0)
+    norm = weights.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pos = (weights * x).sum(axis=1) / norm
+        var = (weights * (x - pos[:, np.newaxis]) ** 2).sum(axis=1) / norm
+    sigma = np.sqrt(var)
+    # a single populated bin has no width, use the width of the bin
+    sigma = np.where(sigma > 0, sigma, np.abs(np.diff(x)).mean() / 2. if x.shape[0] > 1 else 1.)
+    amp = weights.max(axis=1)
+    guess = np.array([amp, pos, sigma]).transpose()
+    guess[norm <= 0] = np.nan
+    return guess
+
+
+def levenberg_marquardt(x, y, p0, max_iter=200, tol=1e-10):
+    """ Fits a sum of normal distributions (see multi_gauss) to each row of y. All rows are fitted simultaneously; each
+    row has its own damping parameter and convergence state.
+
+    Parameters
+    ----------
+    x: array of shape (no_of_bins,)
+    y: array of shape (no_of_rows, no_of_bins)
+        nan values are ignored
+    p0: array of shape (no_of_rows, 3 * no_of_modes)
+        initial guess. Rows with nan values or with fewer valid data points than parameters are not fitted.
+    max_iter: int, optional
+    tol: float, optional
+        a row is converged when the relative change of the sum of squared residuals or of the parameters drops below
+        tol.
+
+    Returns
+    -------
+    params: array of shape (no_of_rows, 3 * no_of_modes); sigmas are positive
+    converged: bool array of shape (no_of_rows,)
+    cost: array of shape (no_of_rows,), sum of squared residuals
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    params = np.array(p0, dtype=float, ndmin=2)
+    no_of_rows, no_of_params = params.shape
+
+    valid_data = np.isfinite(y)
+    weights = valid_data.astype(float)
+    y = np.where(valid_data, y, 0)
+
+    converged = np.zeros(no_of_rows, dtype=bool)
+    cost = np.full(no_of_rows, np.nan)
+    damping = np.full(no_of_rows, 1e-3)
+    active = np.where(np.all(np.isfinite(params), axis=1) & (valid_data.sum(axis=1) >= no_of_params))[0]
+
+    residual = (multi_gauss(x, params[active]) - y[active]) * weights[active]
+    cost[active] = (residual ** 2).sum(axis=1)
+    eye = np.eye(no_of_params)
+
+    for i in range(max_iter):
+        if active.shape[0] == 0:
+            break
+        p = params[active]
+        w = weights[active]
+        jac = _jacobian(x, p) * w[:, :, np.newaxis]
+        jac_t = jac.transpose(0, 2, 1)
+        jtj = np.matmul(jac_t, jac)
+        jtr = np.matmul(jac_t, residual[:, :, np.newaxis])[:, :, 0]
+
+        diag = jtj.diagonal(axis1=1, axis2=2)
+        scale = diag.max(axis=1)[:, np.newaxis, np.newaxis]
+        lhs = jtj + damping[active, np.newaxis, np.newaxis] * (diag[:, :, np.newaxis] * eye) + 1e-15 * scale * eye
+        with np.errstate(all='ignore'):
+            try:
+                delta = np.linalg.solve(lhs, -jtr[:, :, np.newaxis])[:, :, 0]
+            except np.linalg.LinAlgError:
+                delta = np.einsum('rij,rj->ri', np.linalg.pinv(lhs), -jtr)
+
+            p_new = p + delta
+            residual_new = (multi_gauss(x, p_new) - y[active]) * w
+            cost_new = (residual_new ** 2).sum(axis=1)
+            cost_old = cost[active]
+            better = cost_new < cost_old
+            rel_cost = (cost_old - cost_new) / np.where(cost_old > 0, cost_old, 1)
+            rel_step = np.sqrt((delta ** 2).sum(axis=1) / np.maximum((p ** 2).sum(axis=1), 1e-300))
+
+        accepted = active[better]
+        params[accepted] = p_new[better]
+        cost[accepted] = cost_new[better]
+        residual[better] = residual_new[better]
+        damping[accepted] /= 10.
+        damping[active[~better]] *= 10.
+
+        # no improvement possible even for tiny steps -> the row sits in a minimum
+        done = (better & ((rel_cost < tol) | (rel_step < tol))) | (damping[active] > 1e12) | (cost_new == 0)
+        converged[active[done]] = True
+        active = active[~done]
+        residual = residual[~done]
+
+    params[:, 2::3] = np.abs(params[:, 2::3])
+    return params, converged, cost
+
+
+def fit_normal(x, y, p0=None, max_iter=200, tol=1e-10, chunksize=10000):
+    """ Fits a single normal distribution to each row of y, see levenberg_marquardt.
+
+    Parameters
+    ----------
+    x: array of shape (no_of_bins,)
+    y: array of shape (no_of_rows, no_of_bins)
+    p0: array-like of length 3 or shape (no_of_rows, 3), optional
+        initial guess (amplitude, position, sigma). If None the moments of each row are used (see get_moment_guess).
+    chunksize: int, optional
+        number of rows which are fitted simultaneously (limits the memory usage)
+
+    Returns
+    -------
+    params: array of shape (no_of_rows, 3), nan for rows which could not be fitted
+    converged: bool array of shape (no_of_rows,)
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    if p0 is None:
+        p0 = get_moment_guess(x, y)
+    else:
+        p0 = np.broadcast_to(np.asarray(p0, dtype=float), (y.shape[0], 3))
+
+    params = np.full((y.shape[0], 3), np.nan)
+    converged = np.zeros(y.shape[0], dtype=bool)
+    for start in range(0, y.shape[0], chunksize):
+        rows = slice(start, start + chunksize)
+        params[rows], converged[rows], cost = levenberg_marquardt(x, y[rows], p0[rows], max_iter=max_iter, tol=tol)
+    params[~converged] = np.nan
+    return params, converged
+
+
+def get_mode_guess(x, y, no_of_modes):
+    """ Initial guess of no_of_modes normal distributions for each row. The modes are placed at equally spaced
+    quantiles of the row, their sigma is the standard deviation of the row divided by no_of_modes.
+
+    Returns
+    -------
+    array of shape (no_of_rows, 3 * no_of_modes)
+    """
+    y = np.atleast_2d(y)
+    guess = get_moment_guess(x, y)
+    if no_of_modes == 1:
+        return guess
+    weights = np.where(np.isfinite(y) & (y > 0), y, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cdf = weights.cumsum(axis=1) / weights.sum(axis=1)[:, np.newaxis]
+    quantiles = (np.arange(no_of_modes) + 0.5) / no_of_modes
+    idx = (cdf[:, np.newaxis, :] < quantiles[np.newaxis, :, np.newaxis]).sum(axis=2)
+    idx = np.minimum(idx, x.shape[0] - 1)
+
+    params = np.empty((y.shape[0], 3 * no_of_modes))
+    params[:, 0::3] = np.take_along_axis(weights, idx, axis=1)
+    params[:, 1::3] = x[idx]
+    params[:, 2::3] = guess[:, 2:3] / no_of_modes
+    params[np.isnan(guess[:, 0])] = np.nan
+    return params
+
+
+def _add_mode(x, y, params):
+    """Initial guess with one more mode than params: the new mode is placed at the largest residual of params. Its
+    sigma is the standard deviation of the row divided by the number of modes, as in get_mode_guess; the sigma of the
+    previous fit is no good guess, since a single mode fitted to several modes is much too wide."""
+    residual = np.where(np.isfinite(y), y, 0)
+    # rows whose fit failed keep y as residual, their guess is nan anyway
+    fitted = np.all(np.isfinite(params), axis=1)
+    residual[fitted] -= multi_gauss(x, params[fitted])
+    idx = residual.argmax(axis=1)
+    amp = np.take_along_axis(residual, idx[:, np.newaxis], axis=1)[:, 0]
+    sigma = get_moment_guess(x, y)[:, 2] / (params.shape[1] // 3 + 1)
+    new = np.array([amp, x[idx], sigma]).transpose()
+    new[amp <= 0] = np.nan
+    p0 = np.concatenate((params, new), axis=1)
+    p0[np.any(np.isnan(params), axis=1)] = np.nan
+    return p0
+
+
+def _fit_best(x, y, guesses, max_iter, tol):
+    """Fits each row from each of the guesses (arrays of shape (no_of_rows, no_of_params)) and keeps the valid result
+    with the lowest cost (inf where no result is valid)"""
+    params = np.full(guesses[0].shape, np.nan)
+    cost = np.full(y.shape[0], np.inf)
+    for p0 in guesses:
+        rows = np.where(np.all(np.isfinite(p0), axis=1))[0]
+        if rows.shape[0] == 0:
+            continue
+        params_g, converged, cost_g = levenberg_marquardt(x, y[rows], p0[rows], max_iter=max_iter, tol=tol)
+        better = converged & _is_valid(x, params_g) & (cost_g < cost[rows])
+        params[rows[better]] = params_g[better]
+        cost[rows[better]] = cost_g[better]
+    return params, np.isfinite(cost), cost
+
+
+def _is_valid(x, params):
+    """Rows of params in which all modes have a positive amplitude, are wider than half a bin, and lie within x"""
+    min_sigma = np.abs(np.diff(x)).min() / 2. if x.shape[0] > 1 else 0
+    amp, pos, sigma = params[:, 0::3], params[:, 1::3], params[:, 2::3]
+    with np.errstate(invalid='ignore'):
+        valid = (amp > 0) & (sigma > min_sigma) & (pos >= x.min()) & (pos <= x.max())
+    return np.all(valid, axis=1)
+
+
+def get_information_criterion(cost, no_of_points, no_of_params, criterion='bic'):
+    """ Information criterion of a least squares fit (normally distributed residuals)
+
+    Parameters
+    ----------
+    cost: array
+        sum of squared residuals
+    no_of_points: array
+    criterion: str, optional
+        'bic' (Bayesian) or 'aic' (Akaike)
+    """
+    no_of_points = np.asarray(no_of_points, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        likelihood = no_of_points * np.log(np.maximum(cost, 1e-300) / no_of_points)
+        if criterion == 'bic':
+            penalty = no_of_params * np.log(no_of_points)
+        elif criterion == 'aic':
+            penalty = 2. * no_of_params
+        else:
+            raise ValueError("criterion has to be 'bic' or 'aic', not %s" % criterion)
+    return likelihood + penalty
+
+
+def _fit_modes_chunk(x, y, max_modes, min_modes, criterion, warm_start, max_iter, tol):
+    """fit_modes for one chunk of rows"""
+    no_of_rows = y.shape[0]
+    no_of_points = np.isfinite(y).sum(axis=1)
+    best_params = np.full((no_of_rows, 3 * max_modes), np.nan)
+    best_modes = np.zeros(no_of_rows, dtype=int)
+    best_ic = np.full(no_of_rows, np.inf)
+
+    previous = None
+    for no_of_modes in range(1, max_modes + 1):
+        guesses = [get_mode_guess(x, y, no_of_modes)]
+        if previous is not None:
+            # add a mode where the previous fit has the largest residual
+            guesses.append(_add_mode(x, y, previous))
+        params, valid, cost = _fit_best(x, y, guesses, max_iter, tol)
+        if warm_start and no_of_rows > 1:
+            # start each row from the solution of the previous row, keep it where it is better
+            p0 = np.roll(params, 1, axis=0)
+            p0[0] = np.nan
+            params_ws, valid_ws, cost_ws = _fit_best(x, y, [p0], max_iter, tol)
+            better = valid_ws & (cost_ws < cost)
+            params[better] = params_ws[better]
+            cost[better] = cost_ws[better]
+            valid |= better
+
+        previous = np.where(valid[:, np.newaxis], params, np.nan)
+        if no_of_modes < min_modes:
+            continue
+        ic = get_information_criterion(cost, no_of_points, 3 * no_of_modes, criterion=criterion)
+        better = valid & (ic < best_ic)
+        best_ic[better] = ic[better]
+        best_modes[better] = no_of_modes
+        best_params[better] = np.nan
+        best_params[better, :3 * no_of_modes] = params[better]
+
+    # sort the modes by position
+    order = np.argsort(np.where(np.isnan(best_params[:, 1::3]), np.inf, best_params[:, 1::3]), axis=1)
+    order = (3 * order[:, :, np.newaxis] + np.arange(3)).reshape(no_of_rows, -1)
+    best_params = np.take_along_axis(best_params, order, axis=1)
+    best_ic[best_modes == 0] = np.nan
+    return best_params, best_modes, best_ic
+
+
+def fit_modes(x, y, max_modes=4, min_modes=1, criterion='bic', warm_start=True, max_iter=100, tol=1e-7,
+              chunksize=5000, workers=1):
+    """ Fits a sum of 1 to max_modes normal distributions to each row of y and selects the number of modes by an
+    information criterion.
+
+    For each number of modes all rows are fitted simultaneously (see levenberg_marquardt), starting from two initial
+    guesses: the quantiles of the row (see get_mode_guess) and the fit with one mode less plus a mode at its largest
+    residual. If warm_start is True each row is also fitted starting from the solution of the previous row, which
+    helps with time series and vertical profiles of slowly changing distributions. Of these fits the one with the
+    lowest cost is kept. Solutions with negative amplitudes, modes narrower than half a bin, or modes outside x are
+    discarded.
+
+    Parameters
+    ----------
+    x: array of shape (no_of_bins,)
+    y: array of shape (no_of_rows, no_of_bins)
+        nan values are ignored
+    max_modes, min_modes: int, optional
+    criterion: str, optional
+        'bic' or 'aic', see get_information_criterion
+    warm_start: bool, optional
+    chunksize: int, optional
+        number of rows which are fitted simultaneously. With warm_start the chunks overlap by max_modes rows, so the
+        result is the same for any chunksize and number of workers.
+    workers: int, optional
+        number of processes the chunks are distributed over. None: number of CPUs.
+
+    Returns
+    -------
+    params: array of shape (no_of_rows, 3 * max_modes)
+        amplitude, position, and sigma of each mode sorted by position, nan for unused modes
+    no_of_modes: int array of shape (no_of_rows,), 0 if no fit was possible
+    ic: array of shape (no_of_rows,), information criterion of the selected fit
+    """
+    if not 1 <= min_modes <= max_modes:
+        raise ValueError('1 <= min_modes <= max_modes is required')
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    x = np.asarray(x, dtype=float)
+    # with warm_start a row depends on up to max_modes previous rows (one per number of modes), the chunks overlap by
+    # that many rows, so the result does not depend on chunksize and workers
+    overlap = max_modes if warm_start else 0
+    chunks = [slice(max(start - overlap, 0), start + chunksize) for start in range(0, y.shape[0], chunksize)]
+    args = (max_modes, min_modes, criterion, warm_start, max_iter, tol)
+
+    if workers == 1 or len(chunks) < 2:
+        results = [_fit_modes_chunk(x, y[chunk], *args) for chunk in chunks]
+    else:
+        with futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [pool.submit(_fit_modes_chunk, x, y[chunk], *args) for chunk in chunks]
+            results = [job.result() for job in jobs]
+
+    if not results:
+        return np.empty((0, 3 * max_modes)), np.empty(0, dtype=int), np.empty(0)
+    # drop the overlapping rows
+    results = [[i[e * chunksize - chunk.start:] for i in result] for e, (chunk, result) in
+               enumerate(zip(chunks, results))]
+    params, no_of_modes, ic = [np.concatenate(i) for i in zip(*results)]
+    return params, no_of_modes, ic
@@ -0,0 +1,548 @@
+import numpy as np
+
+from atmPy.for_removal.mie import mie_batch, mie_cache
+
+# ext: extinction, sca: scattering, abs: absorption, g: asymmetry parameter, asf: angular scattering function
+products_all = ('ext', 'sca', 'abs', 'g', 'asf')
+
+
+def _check_products(products):
+    products = tuple(products)
+    for p in products:
+        if p not in products_all:
+            raise ValueError('%s is not a valid product. Choose from %s.' % (p, products_all))
+    return products
+
+
+def _get_mie_angles(noOfAngles, angles, products):
+    """noOfAngles and angles for the Mie calculation, no amplitudes are calculated if 'asf' is not requested"""
+    if 'asf' not in products:
+        return 0, None
+    return noOfAngles, angles
+
+
+class OpticalKernel(object):
+    """ Precomputed optical properties of a set of size bins at one wavelength.
+
+    Extinction, scattering, absorption and the angular scattering function of an ensemble of particles are linear in
+    the number concentration. This class performs the Mie calculation once for the bin centers and stores per-bin
+    coefficient vectors and an angle-by-bin matrix. The optical properties of any number of size distributions (rows)
+    on the same bins are then obtained by a few matrix products (see evaluate).
+
+    Parameters
+    ----------
+    bincenters: array
+        diameters in nm
+    wavelength: float
+        wavelength in nm
+    n: complex
+        index of refraction
+    noOfAngles: int, optional.
+        Number of scattering angles to be calculated (between 0 and pi/2).
+    angles: array-like, optional.
+        Scattering angles (rad) at which the angular scattering function is calculated. If given, noOfAngles is ignored.
+    mie: mie_batch.MieBatch instance, optional
+        if the Mie calculation for the bin centers was already done elsewhere (e.g. SpectralOpticalKernel)
+    products: tuple, optional.
+        optical properties returned by evaluate, any of 'ext', 'sca', 'abs', 'g' (asymmetry parameter), and 'asf'
+        (angular scattering function). The extinction is always returned. Only if 'asf' is requested the scattering
+        amplitudes are calculated, which is by far the most expensive part.
+
+    Attributes
+    ----------
+    extinction, scattering, absorption: arrays of shape (no_of_bins,)
+        coefficient (m^-1) caused by one particle per cm^3 in the particular bin
+    angles: array
+        scattering angles in the interval [0, 2pi) (or the requested angles), empty if 'asf' is not in products
+    angular_scatt_func: array of shape (no_of_angles, no_of_bins)
+        angular scattering function (m^-1 sr^-1) caused by one particle per cm^3 in the particular bin
+    """
+
+    def __init__(self, bincenters, wavelength, n, noOfAngles=100, mie=None, products=products_all, angles=None):
+        self.bincenters = np.asarray(bincenters, dtype=float)
+        self.wavelength = wavelength
+        self.index_of_refraction = n
+        self.noOfAngles = noOfAngles
+        self.products = _check_products(products)
+
+        if mie is None:
+            diam = self.bincenters / 1000.
+            x = np.pi * diam / (wavelength / 1000.)
+            noOfAngles_mie, angles_mie = _get_mie_angles(noOfAngles, angles, self.products)
+            mie = mie_cache.mie(x, n, noOfAngles_mie, diameter=diam, angles=angles_mie)
+        self.mie = mie
+
+        # um^2 -> m^2 and cm^-3 -> m^-3
+        conversion = 1e-12 * 1e6
+        self.extinction = mie.cext * conversion
+        self.scattering = mie.csca * conversion
+        self.absorption = (mie.cext - mie.csca) * conversion
+
+        if 'asf' in self.products:
+            angles, asf = mie.get_angular_scatt_func()
+            self.angles = angles
+            self.angular_scatt_func = asf.transpose() * conversion
+        else:
+            self.angles = np.zeros(0)
+            self.angular_scatt_func = np.zeros((0, self.bincenters.shape[0]))
+
+        # The asymmetry parameter of the ensemble is the scattering weighted mean of the particles asymmetry
+        # parameters, the numerator and denominator are linear in the number concentration.
+        self._asymmetry_numerator = self.scattering * mie.gsca
+
+    def evaluate(self, numberconcentration):
+        """ Optical properties for all rows of a size distribution.
+
+        Parameters
+        ----------
+        numberconcentration: array of shape (no_of_rows, no_of_bins) or SizeDist instance
+            number concentration in cm^-3 in each bin. A SizeDist instance is converted to number concentration first.
+
+        Returns
+        -------
+        dict of dense arrays:
+            extCoeff_perrow_perbin: (no_of_rows, no_of_bins)
+            extCoeff_perrow, scattCoeff_perrow, absCoeff_perrow, asymmetry_param: (no_of_rows,)
+            angular_scatt_func: (no_of_angles, no_of_rows)
+        """
+        if hasattr(numberconcentration, 'convert2numberconcentration'):
+            numberconcentration = numberconcentration.convert2numberconcentration().data.values
+        cn = np.atleast_2d(np.asarray(numberconcentration, dtype=float))
+
+        out = {}
+        out['extCoeff_perrow_perbin'] = cn * self.extinction
+        out['extCoeff_perrow'] = cn.dot(self.extinction)
+        if 'sca' in self.products or 'g' in self.products:
+            scattering = cn.dot(self.scattering)
+        if 'sca' in self.products:
+            out['scattCoeff_perrow'] = scattering
+        if 'abs' in self.products:
+            out['absCoeff_perrow'] = cn.dot(self.absorption)
+        if 'asf' in self.products:
+            out['angular_scatt_func'] = self.angular_scatt_func.dot(cn.transpose())
+        if 'g' in self.products:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out['asymmetry_param'] = cn.dot(self._asymmetry_numerator) / scattering
+        return out
+
+
+def get_kernel(bincenters, wavelength, n, noOfAngles=100, products=products_all, angles=None,
+               mixing_state='homogeneous', n_core=None, core_fraction=None):
+    """ OpticalKernel for different mixing states of two materials (e.g. black carbon and a non absorbing coating).
+
+    Parameters
+    ----------
+    bincenters, wavelength, n, noOfAngles, products, angles:
+        see OpticalKernel. n is the index of refraction of the particles in case of 'homogeneous', of the shell in
+        case of 'core_shell', and of the non-core particles in case of 'external'.
+    mixing_state: str, optional.
+        'homogeneous': all particles consist of one material with the index of refraction n.
+        'core_shell': each particle consists of a core (n_core) which makes up the volume fraction core_fraction of
+            the particle, and a shell (n).
+        'external': the number fraction core_fraction of the particles in each bin consists of the core material
+            (n_core), the rest has the index of refraction n.
+    n_core: complex, optional.
+        index of refraction of the core material
+    core_fraction: float, optional.
+        volume fraction of the core ('core_shell') or number fraction of core particles ('external')
+
+    Returns
+    -------
+    OpticalKernel instance
+    """
+    if mixing_state == 'homogeneous':
+        return OpticalKernel(bincenters, wavelength, n, noOfAngles=noOfAngles, products=products, angles=angles)
+
+    if mixing_state not in ('core_shell', 'external'):
+        raise ValueError("mixing_state has to be 'homogeneous', 'core_shell', or 'external', not %s" % mixing_state)
+    if n_core is None or core_fraction is None:
+        raise ValueError('n_core and core_fraction have to be given for mixing_state %s' % mixing_state)
+    if not 0 <= core_fraction <= 1:
+        raise ValueError('core_fraction has to be between 0 and 1')
+
+    if mixing_state == 'core_shell':
+        products = _check_products(products)
+        noOfAngles_mie, angles_mie = _get_mie_angles(noOfAngles, angles, products)
+        diam = np.asarray(bincenters, dtype=float) / 1000.
+        y = np.pi * diam / (wavelength / 1000.)
+        x = y * core_fraction ** (1. / 3.)
+        mie = mie_cache.coated_mie(x, y, n_core, n, noOfAngles_mie, diameter=diam, angles=angles_mie)
+        return OpticalKernel(bincenters, wavelength, n, noOfAngles=noOfAngles, mie=mie, products=products)
+
+    # external mixture: all optical properties are linear combinations of the two kernels
+    kernel = OpticalKernel(bincenters, wavelength, n, noOfAngles=noOfAngles, products=products, angles=angles)
+    kernel_core = OpticalKernel(bincenters, wavelength, n_core, noOfAngles=noOfAngles, products=products,
+                                angles=angles)
+    for attr in ('extinction', 'scattering', 'absorption', 'angular_scatt_func', '_asymmetry_numerator'):
+        setattr(kernel, attr, (1 - core_fraction) * getattr(kernel, attr) + core_fraction * getattr(kernel_core, attr))
+    return kernel
+
+
+class SpectralOpticalKernel(object):
+    """ Optical kernels (see OpticalKernel) of a set of size bins for multiple wavelengths.
+
+    The Mie calculation for all wavelengths and bins is done in a single batch. Evaluating the kernel for a size
+    distribution converts the number concentration once and gives the properties at all wavelengths.
+
+    Parameters
+    ----------
+    bincenters: array
+        diameters in nm
+    wavelengths: array-like
+        wavelengths in nm
+    n: complex
+        index of refraction
+    noOfAngles: int, optional.
+    workers: int, optional.
+        number of processes for the Mie calculation (see mie_parallel.MieExecutor). None: number of CPUs.
+    chunksize: int, optional.
+        number of particles per process pool job
+    products: tuple, optional.
+        see OpticalKernel
+    angles: array-like, optional.
+        see OpticalKernel
+
+    Attributes
+    ----------
+    kernels: list of OpticalKernel instances, one per wavelength
+    extinction: array of shape (no_of_wavelengths, no_of_bins)
+    """
+
+    def __init__(self, bincenters, wavelengths, n, noOfAngles=100, workers=1, chunksize=None, products=products_all,
+                 angles=None):
+        self.bincenters = np.asarray(bincenters, dtype=float)
+        self.wavelengths = np.atleast_1d(np.asarray(wavelengths, dtype=float))
+        self.index_of_refraction = n
+        self.products = _check_products(products)
+        noOfAngles_mie, angles_mie = _get_mie_angles(noOfAngles, angles, self.products)
+
+        diam = self.bincenters / 1000.
+        x = np.pi * diam[np.newaxis, :] / (self.wavelengths[:, np.newaxis] / 1000.)
+        mie = mie_cache.mie(x.ravel(), n, noOfAngles_mie, diameter=np.tile(diam, self.wavelengths.shape[0]),
+                            workers=workers, chunksize=chunksize, angles=angles_mie)
+
+        nob = self.bincenters.shape[0]
+        self.kernels = []
+        for e, wl in enumerate(self.wavelengths):
+            mie_wl = mie.select(slice(e * nob, (e + 1) * nob))
+            self.kernels.append(OpticalKernel(self.bincenters, wl, n, noOfAngles=noOfAngles, mie=mie_wl,
+                                              products=self.products))
+
+        self.extinction = np.array([k.extinction for k in self.kernels])
+        self.scattering = np.array([k.scattering for k in self.kernels])
+        self.absorption = np.array([k.absorption for k in self.kernels])
+
+    def evaluate(self, numberconcentration):
+        """ Optical properties for all rows and wavelengths.
+
+        Parameters
+        ----------
+        numberconcentration: array of shape (no_of_rows, no_of_bins) or SizeDist instance
+
+        Returns
+        -------
+        list of dicts (see OpticalKernel.evaluate), one for each wavelength
+        """
+        if hasattr(numberconcentration, 'convert2numberconcentration'):
+            numberconcentration = numberconcentration.convert2numberconcentration().data.values
+        cn = np.atleast_2d(np.asarray(numberconcentration, dtype=float))
+        return [k.evaluate(cn) for k in self.kernels]
+
+    def get_extinction(self, numberconcentration):
+        """Extinction coefficient (m^-1) of each row at each wavelength, array of shape (no_of_rows,
+        no_of_wavelengths)"""
+        cn = np.atleast_2d(np.asarray(numberconcentration, dtype=float))
+        return cn.dot(self.extinction.transpose())
+
+
+class RefractiveIndexGridKernel(object):
+    """ Optical kernels on a grid of refractive indices.
+
+    Used when each row of a size distribution has its own index of refraction (e.g. after
+    SizeDist.apply_hygro_growth with how='shift_data'). The Mie calculation is done once for all grid nodes and bins in
+    a single batch. The optical properties of a row are bilinearly interpolated (in the real and imaginary part of the
+    refractive index) between the kernels of the neighbouring grid nodes. Since all optical properties are linear in
+    the number concentration this amounts to evaluating the node kernels with weighted number concentrations.
+
+    Parameters
+    ----------
+    bincenters: array
+        diameters in nm
+    wavelength: float
+        wavelength in nm
+    n_real: array-like
+        grid of the real part of the refractive index (ascending)
+    n_imag: array-like, optional
+        grid of the imaginary part of the refractive index (ascending). Default is [0].
+    noOfAngles: int, optional.
+    workers, chunksize: int, optional.
+        see SpectralOpticalKernel
+    products, angles: optional.
+        see OpticalKernel
+
+    Attributes
+    ----------
+    kernels: 2D list of OpticalKernel instances, shape (len(n_real), len(n_imag))
+    error_estimate: dict
+        maximum relative interpolation error of extinction and scattering found in the grid cells (estimated at the
+        cell centers), see get_error_estimate
+    """
+
+    def __init__(self, bincenters, wavelength, n_real, n_imag=None, noOfAngles=100, workers=1, chunksize=None,
+                 products=products_all, angles=None):
+        self.bincenters = np.asarray(bincenters, dtype=float)
+        self.wavelength = wavelength
+        self.noOfAngles = noOfAngles
+        self.products = _check_products(products)
+        self.n_real = np.atleast_1d(np.asarray(n_real, dtype=float))
+        if n_imag is None:
+            n_imag = [0.]
+        self.n_imag = np.atleast_1d(np.asarray(n_imag, dtype=float))
+        self.__error_estimate = None
+
+        nodes = self.n_real[:, np.newaxis] + 1j * self.n_imag[np.newaxis, :]
+        nob = self.bincenters.shape[0]
+        diam = self.bincenters / 1000.
+        x = np.pi * diam / (wavelength / 1000.)
+        noOfAngles_mie, angles_mie = _get_mie_angles(noOfAngles, angles, self.products)
+        mie = mie_cache.mie(np.tile(x, nodes.size), np.repeat(nodes.ravel(), nob), noOfAngles_mie,
+                            diameter=np.tile(diam, nodes.size), workers=workers, chunksize=chunksize, angles=angles_mie)
+
+        self.kernels = []
+        for i, nr in enumerate(self.n_real):
+            row = []
+            for j, ni in enumerate(self.n_imag):
+                e = i * self.n_imag.shape[0] + j
+                row.append(OpticalKernel(self.bincenters, wavelength, nodes[i, j], noOfAngles=noOfAngles,
+                                         mie=mie.select(slice(e * nob, (e + 1) * nob)), products=self.products))
+            self.kernels.append(row)
+        self.angles = self.kernels[0][0].angles
+
+    @staticmethod
+    def _locate(grid, values, name):
+        if grid.shape[0] == 1:
+            if np.any(values != grid[0]):
+                raise ValueError('The %s part of the refractive index is not covered by the grid.' % name)
+            return np.zeros(values.shape, dtype=int), np.zeros(values.shape)
+        tol = 1e-12 * np.abs(grid).max()
+        if np.any(values < grid[0] - tol) or np.any(values > grid[-1] + tol):
+            txt = 'The %s part of the refractive index (%s, %s) is outside the grid (%s, %s).' % (
+                name, values.min(), values.max(), grid[0], grid[-1])
+            raise ValueError(txt)
+        idx = np.clip(np.searchsorted(grid, values) - 1, 0, grid.shape[0] - 2)
+        t = np.clip((values - grid[idx]) / (grid[idx + 1] - grid[idx]), 0, 1)
+        return idx, t
+
+    def get_weights(self, n):
+        """ Grid nodes and bilinear interpolation weights for each refractive index in n
+
+        Returns
+        -------
+        dict with (i_real, i_imag) as keys and the weight of each row as value (only nodes with nonzero weight)
+        """
+        n = np.atleast_1d(np.asarray(n, dtype=np.complex128))
+        ir, tr = self._locate(self.n_real, n.real, 'real')
+        ii, ti = self._locate(self.n_imag, n.imag, 'imaginary')
+        weights = {}
+        for dr, wr in ((0, 1 - tr), (1, tr)):
+            for di, wi in ((0, 1 - ti), (1, ti)):
+                w = wr * wi
+                if dr and self.n_real.shape[0] == 1 or di and self.n_imag.shape[0] == 1:
+                    continue
+                nodes_r = ir + dr
+                nodes_i = ii + di
+                for node in set(zip(nodes_r[w > 0], nodes_i[w > 0])):
+                    where = (nodes_r == node[0]) & (nodes_i == node[1])
+                    weights.setdefault(node, np.zeros(n.shape))
+                    weights[node][where] += w[where]
+        return weights
+
+    def evaluate(self, numberconcentration, n):
+        """ Optical properties for all rows, each with its own refractive index.
+
+        Parameters
+        ----------
+        numberconcentration: array of shape (no_of_rows, no_of_bins)
+        n: array-like of shape (no_of_rows,)
+            refractive index of each row
+
+        Returns
+        -------
+        dict of dense arrays, see OpticalKernel.evaluate
+        """
+        cn = np.atleast_2d(np.asarray(numberconcentration, dtype=float))
+        rows = cn.shape[0]
+        out = {'extCoeff_perrow_perbin': np.zeros(cn.shape),
+               'extCoeff_perrow': np.zeros(rows)}
+        scattering = np.zeros(rows)
+        absorption = np.zeros(rows)
+        asf = np.zeros((self.angles.shape[0], rows))
+        asym_num = np.zeros(rows)
+        for node, w in self.get_weights(n).items():
+            kernel = self.kernels[node[0]][node[1]]
+            where = np.nonzero(w)[0]
+            cn_w = cn[where] * w[where, np.newaxis]
+            out['extCoeff_perrow_perbin'][where] += cn_w * kernel.extinction
+            out['extCoeff_perrow'][where] += cn_w.dot(kernel.extinction)
+            scattering[where] += cn_w.dot(kernel.scattering)
+            if 'abs' in self.products:
+                absorption[where] += cn_w.dot(kernel.absorption)
+            if 'asf' in self.products:
+                asf[:, where] += kernel.angular_scatt_func.dot(cn_w.transpose())
+            if 'g' in self.products:
+                asym_num[where] += cn_w.dot(kernel._asymmetry_numerator)
+        if 'sca' in self.products:
+            out['scattCoeff_perrow'] = scattering
+        if 'abs' in self.products:
+            out['absCoeff_perrow'] = absorption
+        if 'asf' in self.products:
+            out['angular_scatt_func'] = asf
+        if 'g' in self.products:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out['asymmetry_param'] = asym_num / scattering
+        return out
+
+    @property
+    def error_estimate(self):
+        if self.__error_estimate is None:
+            self.__error_estimate = self.get_error_estimate()
+        return self.__error_estimate
+
+    def get_error_estimate(self):
+        """ Estimates the interpolation error by comparing the interpolated extinction and scattering cross sections at
+        the center of each grid cell to an exact calculation.
+
+        Returns
+        -------
+        dict: maximum relative error (with respect to the largest value within the bins) of extinction and scattering
+        """
+        if self.n_real.shape[0] > 1:
+            nr = (self.n_real[1:] + self.n_real[:-1]) / 2.
+        else:
+            nr = self.n_real
+        if self.n_imag.shape[0] > 1:
+            ni = (self.n_imag[1:] + self.n_imag[:-1]) / 2.
+        else:
+            ni = self.n_imag
+        centers = (nr[:, np.newaxis] + 1j * ni[np.newaxis, :]).ravel()
+
+        nob = self.bincenters.shape[0]
+        diam = self.bincenters / 1000.
+        x = np.pi * diam / (self.wavelength / 1000.)
+        exact = mie_batch.MieBatch(np.tile(x, centers.size), np.repeat(centers, nob), 0,
+                                   diameter=np.tile(diam, centers.size))
+        conversion = 1e-12 * 1e6
+        ext_exact = exact.cext.reshape(centers.size, nob) * conversion
+        sca_exact = exact.csca.reshape(centers.size, nob) * conversion
+
+        ext_interp = np.zeros(ext_exact.shape)
+        sca_interp = np.zeros(sca_exact.shape)
+        for node, w in self.get_weights(centers).items():
+            kernel = self.kernels[node[0]][node[1]]
+            ext_interp += w[:, np.newaxis] * kernel.extinction
+            sca_interp += w[:, np.newaxis] * kernel.scattering
+
+        error = {}
+        error['extinction'] = (np.abs(ext_interp - ext_exact).max(axis=1) / ext_exact.max(axis=1)).max()
+        error['scattering'] = (np.abs(sca_interp - sca_exact).max(axis=1) / sca_exact.max(axis=1)).max()
+        return error
+
+
+def evaluate_row_dependent_n(bincenters, wavelength, n, numberconcentration, noOfAngles=100, n_grid=None,
+                             products=products_all, angles=None):
+    """ Optical properties of size distributions where each row has its own refractive index.
+
+    Parameters
+    ----------
+    bincenters: array
+        diameters in nm
+    wavelength: float
+        wavelength in nm
+    n: array-like of shape (no_of_rows,)
+    numberconcentration: array of shape (no_of_rows, no_of_bins)
+    noOfAngles: int, optional.
+    n_grid: None, int, or tuple, optional.
+        None: rows which share the same refractive index are grouped and the exact kernel is calculated for each group.
+        int: a RefractiveIndexGridKernel is used with this number of grid points spanning the range of the real (and, if
+            it varies, imaginary) part of n.
+        tuple: (real grid, imaginary grid) of the RefractiveIndexGridKernel.
+    products, angles: optional.
+        see OpticalKernel
+
+    Returns
+    -------
+    dict of dense arrays (see OpticalKernel.evaluate), scattering angles, and kernel (the RefractiveIndexGridKernel if
+    n_grid was given, else None)
+    """
+    n = np.asarray(n, dtype=np.complex128).ravel()
+    cn = np.atleast_2d(np.asarray(numberconcentration, dtype=float))
+
+    if n_grid is None:
+        unique_n, inverse = np.unique(n, return_inverse=True)
+        out = None
+        for e, n_group in enumerate(unique_n):
+            where = np.nonzero(inverse == e)[0]
+            kernel = OpticalKernel(bincenters, wavelength, n_group, noOfAngles=noOfAngles, products=products,
+                                   angles=angles)
+            res = kernel.evaluate(cn[where])
+            if out is None:
+                out = {}
+                for key in res.keys():
+                    if key == 'angular_scatt_func':
+                        out[key] = np.zeros((kernel.angles.shape[0], cn.shape[0]))
+                    else:
+                        out[key] = np.zeros((cn.shape[0],) + res[key].shape[1:])
+            for key in res.keys():
+                if key == 'angular_scatt_func':
+                    out[key][:, where] = res[key]
+                else:
+                    out[key][where] = res[key]
+        return out, kernel.angles, None
+
+    if isinstance(n_grid, int):
+        n_real = np.linspace(n.real.min(), n.real.max(), n_grid)
+        if n.imag.min() == n.imag.max():
+            n_imag = n.imag[:1]
+        else:
+            n_imag = np.linspace(n.imag.min(), n.imag.max(), n_grid)
+    else:
+        n_real, n_imag = n_grid
+    kernel = RefractiveIndexGridKernel(bincenters, wavelength, n_real, n_imag, noOfAngles=noOfAngles,
+                                       products=products, angles=angles)
+    return kernel.evaluate(cn, n), kernel.angles, kernel
+
+
+def fit_angstrom_exponent(wavelengths, aod):
+    """ Least-squares fit of log10(aod) versus log10(wavelength) for many rows at once.
+
+    Gives the same results as scipy.stats.linregress applied to each row separately.
+
+    Parameters
+    ----------
+    wavelengths: array of shape (no_of_wavelengths,)
+    aod: array of shape (no_of_rows, no_of_wavelengths) or (no_of_wavelengths,)
+
+    Returns
+    -------
+    angstrom exponent (-slope), intercept, correlation coefficient, standard error of the slope; arrays of shape
+    (no_of_rows,)
+    """
+    x = np.log10(np.asarray(wavelengths, dtype=float))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        y = np.log10(np.atleast_2d(np.asarray(aod, dtype=float)))
+
+        xm = x.mean()
+        ym = y.mean(axis=1)
+        dx = x - xm
+        dy = y - ym[:, np.newaxis]
+        ssxm = (dx ** 2).mean()
+        ssym = (dy ** 2).mean(axis=1)
+        ssxym = (dy * dx).mean(axis=1)
+
+        slope = ssxym / ssxm
+        intercept = ym - slope * xm
+        r = ssxym / np.sqrt(ssxm * ssym)
+        r = np.clip(r, -1., 1.)
+        df = x.shape[0] - 2
+        std_err = np.sqrt((1 - r ** 2) * ssym / ssxm / df)
+    return -slope, intercept, r, std_err
@@ -1,18 +1,18 @@
 import datetime
 import warnings
-from copy import deepcopy
+from copy import copy as shallow_copy, deepcopy
 
 import numpy as np
 import pandas as pd
 import pylab as plt
 import scipy.optimize as optimization
 from matplotlib.colors import LogNorm
-from scipy import integrate
-from scipy import stats
+from scipy import integrate, sparse
 
 from atmPy.atmos import vertical_profile, timeseries
 from atmPy.aerosols import hygroscopic_growth as hg
-from atmPy.for_removal.mie import bhmie
+from atmPy.aerosols.size_distr import bin_axis, lognormal_fit, optical_kernel
+from atmPy.for_removal.mie import mie_cache
 from atmPy.tools import pandas_tools
 from atmPy.tools import plt_tools, math_functions, array_tools
 
@@ -123,6 +123,208 @@ def read_hdf(f_name, keep_open = False, populate_namespace = False):
         hdf.close()
         return out
 
+
+def _get_time_stamps(index):
+    """Index as int64 nanoseconds"""
+    return np.asarray(index.values).astype('datetime64[ns]').view('i8')
+
+
+def _match_times(index_from, index_to, tolerance):
+    """For each element of index_to the position of the closest element of index_from, -1 if there is none within
+    tolerance (nanoseconds). One pass of searchsorted over the sorted time stamps."""
+    times = _get_time_stamps(index_from)
+    order = None
+    if not np.all(times[1:] >= times[:-1]):
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+    target = _get_time_stamps(index_to)
+    match = np.full(target.shape[0], -1, dtype=np.int64)
+    if times.shape[0] == 0:
+        return match
+
+    right = np.clip(np.searchsorted(times, target), 0, times.shape[0] - 1)
+    left = np.maximum(right - 1, 0)
+    closest = np.where(np.abs(times[left] - target) <= np.abs(times[right] - target), left, right)
+    within = np.abs(times[closest] - target) <= tolerance
+    match[within] = closest[within] if order is None else order[closest[within]]
+    return match
+
+
+def _average(values, starts=None, how='mean', ddof=1):
+    """ NaN-aware average, standard deviation, and number of valid values in each bin of consecutive groups of lines,
+    computed for all groups at once (products with a sparse matrix which assigns the lines to the groups).
+
+    Parameters
+    ----------
+    values: array of shape (no_of_lines, no_of_bins)
+    starts: int array, optional
+        first line of each group (increasing, groups may be empty). Default: one group with all lines.
+    how: str, optional
+        'mean' or 'median'
+    ddof: int, optional
+        delta degrees of freedom of the standard deviation
+
+    Returns
+    -------
+    average, std, count: arrays of shape (no_of_groups, no_of_bins)
+        average and std are nan where count is 0 (std also where count <= ddof)
+    """
+    if how not in ('mean', 'median'):
+        raise ValueError("how has to be 'mean' or 'median', not %s" % how)
+    no_of_lines = values.shape[0]
+    if starts is None:
+        starts = np.zeros(1, dtype=int)
+    starts = np.asarray(starts, dtype=int)
+    lengths = np.diff(np.append(starts, no_of_lines))
+    group = np.repeat(np.arange(starts.shape[0]), lengths)
+    groups = sparse.csr_matrix((np.ones(no_of_lines), (group, np.arange(no_of_lines))),
+                               shape=(starts.shape[0], no_of_lines))
+
+    valid = np.isfinite(values)
+    all_valid = valid.all()
+    zeroed = values if all_valid else np.where(valid, values, 0)
+    count = np.rint(groups.dot(valid.astype(float))).astype(int)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = groups.dot(zeroed) / count
+        deviation = zeroed - mean[group]
+        if not all_valid:
+            deviation[~valid] = 0
+        np.square(deviation, out=deviation)
+        std = np.sqrt(groups.dot(deviation) / (count - ddof))
+    std[count <= ddof] = np.nan
+
+    if how == 'mean':
+        average = mean
+    else:
+        # groups padded with nan to the length of the longest group
+        filled = lengths > 0
+        average = np.full(mean.shape, np.nan)
+        if np.any(filled):
+            positions = starts[filled][:, np.newaxis] + np.arange(lengths.max())
+            padded = values[np.minimum(positions, no_of_lines - 1)]
+            padded[positions >= (starts + lengths)[filled][:, np.newaxis]] = np.nan
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                average[filled] = np.nanmedian(padded, axis=1)
+    average[count == 0] = np.nan
+    return average, std, count
+
+
+def _get_layer_edges(altitude, layer_thickness):
+    """Edges of the layers of the given thickness (m) which cover the altitude range"""
+    start_h = round(altitude.min() / layer_thickness) * layer_thickness
+    end_h = round(altitude.max() / layer_thickness) * layer_thickness
+    return np.arange(start_h, end_h, layer_thickness)
+
+
+def _get_layer(altitude, layer_edges):
+    """Layer of each altitude, -1 if it is outside of the layers or on a layer edge"""
+    no_of_layers = max(layer_edges.shape[0] - 1, 0)
+    layer = np.searchsorted(layer_edges, altitude, side='left') - 1
+    layer[(layer < 0) | (layer >= no_of_layers) | np.isin(altitude, layer_edges)] = -1
+    return layer
+
+
+def _get_layer_time_ranges(times, altitude, layer_edges):
+    """First and last time (int64 nanoseconds) the altitude is within each layer. Layers which are not visited get
+    an empty range."""
+    no_of_layers = max(layer_edges.shape[0] - 1, 0)
+    layer = _get_layer(altitude, layer_edges)
+    inside = layer >= 0
+    first = np.full(no_of_layers, np.iinfo(np.int64).max)
+    last = np.full(no_of_layers, np.iinfo(np.int64).min)
+    np.minimum.at(first, layer[inside], times[inside])
+    np.maximum.at(last, layer[inside], times[inside])
+    return first, last
+
+
+def merge(dists, bins=None, index=None, weights=None, tolerance=None, distributionType='dNdlogDp', log=True,
+          chunksize=10000):
+    """ Merges the size distributions of several instruments (e.g. SMPS, UHSAS, POPS) into one SizeDist_TS.
+
+    In time each line of the result gets the closest line of each instrument (within tolerance). In diameter each
+    instrument is rebinned onto bins (conserving the number, see SizeDist.rebin). Where instruments overlap the
+    values are blended, weighted with weights and with the fraction of each new bin covered by the instrument's size
+    range; nan values are ignored. The result is built in chunks of lines, so only the result and one chunk of each
+    instrument are in memory.
+
+    Parameters
+    ----------
+    dists: list of SizeDist_TS instances
+    bins: array, optional
+        bin edges of the result. Default: from the smallest to the largest diameter of all instruments, logarithmically
+        spaced with the finest resolution of all instruments.
+    index: pandas DatetimeIndex, optional
+        times of the result. Default: all times of all instruments.
+    weights: list of floats or arrays, optional
+        weight of each instrument, either one value or one value per bin of the result. Default: equal weights.
+    tolerance: list of str or pandas Timedelta, optional
+        maximum time difference for each instrument. Default: the median time step of the instrument.
+    distributionType: str, optional
+    log: bool, optional.
+        If True the particles are assumed to be distributed uniformly in log diameter within a bin.
+    chunksize: int, optional
+
+    Returns
+    -------
+    SizeDist_TS instance. Lines and bins without data from any instrument are nan.
+    """
+    dists = list(dists)
+    if bins is None:
+        start = min([dist.bins[0] for dist in dists])
+        end = max([dist.bins[-1] for dist in dists])
+        step = min([np.log10(dist.bins[1:] / dist.bins[:-1]).min() for dist in dists])
+        bins = np.logspace(np.log10(start), np.log10(end), int(np.ceil(np.log10(end / start) / step)) + 1)
+    binaxis = bin_axis.get(bins)
+    edges = np.log10(binaxis.edges) if log else binaxis.edges
+
+    if index is None:
+        index = pd.DatetimeIndex(np.unique(np.concatenate([_get_time_stamps(dist.index) for dist in dists])))
+    if weights is None:
+        weights = [1.] * len(dists)
+    if tolerance is None:
+        tolerance = [None] * len(dists)
+
+    instruments = []
+    for dist, weight, tol in zip(dists, weights, tolerance):
+        if tol is None:
+            times = np.sort(_get_time_stamps(dist.index))
+            tol = np.median(np.diff(times)) if times.shape[0] > 1 else 0
+        else:
+            tol = pd.Timedelta(tol).value
+        # fraction of each new bin which lies within the size range of the instrument
+        lower, upper = (np.log10(dist.bins[[0, -1]]) if log else dist.bins[[0, -1]])
+        coverage = (np.minimum(edges[1:], upper) - np.maximum(edges[:-1], lower)) / (edges[1:] - edges[:-1])
+        coverage = np.clip(coverage, 0, 1)
+        weight = np.broadcast_to(np.asarray(weight, dtype=float), coverage.shape)
+        to_number = dist.binaxis.get_conversion_factor(dist.distributionType, 'numberConcentration')
+        matrix = bin_axis.get_overlap_matrix(dist.binaxis, binaxis, 1., log)
+        instruments.append((dist, _match_times(dist.index, index, tol), to_number, matrix, coverage, weight))
+
+    from_number = binaxis.get_conversion_factor('numberConcentration', distributionType)
+    values = np.full((index.shape[0], len(binaxis)), np.nan)
+    for start in range(0, index.shape[0], chunksize):
+        chunk = slice(start, start + chunksize)
+        total = np.zeros((values[chunk].shape[0], len(binaxis)))
+        total_weight = np.zeros(total.shape)
+        for dist, match, to_number, matrix, coverage, weight in instruments:
+            lines = np.where(match[chunk] >= 0)[0]
+            if lines.shape[0] == 0:
+                continue
+            number = dist.values[match[chunk][lines]] * to_number
+            rebinned = matrix.dot(number.transpose()).transpose() * from_number
+            # the rebinned values of partially covered bins only contain the covered part, so they are weighted with
+            # weight and divided by the sum of weight * coverage; nan values (also spread by the rebinning) are ignored
+            valid = np.isfinite(rebinned) & (coverage > 0)
+            total[lines] += np.where(valid, rebinned * weight, 0)
+            total_weight[lines] += np.where(valid, coverage * weight, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values[chunk] = np.where(total_weight > 0, total / total_weight, np.nan)
+
+    dist = SizeDist_TS(None, binaxis.edges, distributionType, fixGaps=False)
+    dist._set_values(values, index)
+    return dist
+
 def get_label(distType):
     """ Return the appropriate label for a particular distribution type
     """
@@ -149,7 +351,9 @@ def get_label(distType):
 
 # Todo: Docstring is wrong
 # Todo: implement into the Layer Series
-def _calculate_optical_properties(sd, wavelength, n, aod=False, noOfAngles=100):
+def _calculate_optical_properties(sd, wavelength, n, aod=False, noOfAngles=100, n_grid=None,
+                                  products=optical_kernel.products_all, angles=None, mixing_state='homogeneous',
+                                  n_core=None, core_fraction=None):
     """
     !!!Tis Docstring need fixn
     Calculates the extinction crossection, AOD, phase function, and asymmetry Parameter for each layer.
@@ -165,88 +369,77 @@ def _calculate_optical_properties(sd, wavelength, n, aod=False, noOfAngles=100):
     noOfAngles: int, optional.
         Number of scattering angles to be calculated. This mostly effects calculations which depend on the phase
         function.
+    n_grid: None, int, or tuple, optional.
+        Only used if n is a DataFrame with an index of refraction for each row. None: rows which share an index of
+        refraction are calculated together. int or (real grid, imaginary grid): the optical properties are interpolated
+        on a grid of refractive indices (see optical_kernel.RefractiveIndexGridKernel). The estimated interpolation
+        error is returned as 'n_grid_error'.
+    products: tuple, optional.
+        Optical properties to be calculated, any of 'ext', 'sca', 'abs', 'g' (asymmetry parameter), and 'asf' (angular
+        scattering function). The extinction (and AOD) is always calculated. Leaving out 'asf' avoids the calculation
+        of the scattering amplitudes and is much faster.
+    angles: array-like, optional.
+        Scattering angles (rad) at which the angular scattering function is calculated. If None noOfAngles equally
+        spaced angles are used.
+    mixing_state: str, optional.
+        'homogeneous', 'core_shell', or 'external', see optical_kernel.get_kernel. For the latter two n_core (index of
+        refraction of the core material, e.g. black carbon) and core_fraction (volume fraction of the core or number
+        fraction of core particles) have to be given.
 
     Returns
     -------
     OpticalProperty instance
 
     """
-    out = {}
-    out['n'] = n
-    out['wavelength'] = wavelength
     sdls = sd.convert2numberconcentration()
-    index = sdls.data.index
 
     if isinstance(n, pd.DataFrame):
         n_multi = True
     else:
         n_multi = False
 
-    if not n_multi:
-        mie, angular_scatt_func = _perform_Miecalculations(np.array(sdls.bincenters / 1000.), wavelength / 1000., n,
-                                                       noOfAngles=noOfAngles)
-
-    if aod:
-        AOD_layer = np.zeros((len(sdls.layercenters)))
-
-    extCoeffPerLayer = np.zeros((len(sdls.data.index.values), len(sdls.bincenters)))
-    angular_scatt_func_effective = pd.DataFrame()
-    asymmetry_parameter_LS = np.zeros((len(sdls.data.index.values)))
-
-    # print('\n oben mie.extinction_crossection: %s \n'%(mie.extinction_crossection))
-
-    for i, lc in enumerate(sdls.data.index.values):
-        laydata = sdls.data.iloc[i].values
-        # print('laydata: ',laydata.shape)
-        # print(laydata)
-        if n_multi:
-            mie, angular_scatt_func = _perform_Miecalculations(np.array(sdls.bincenters / 1000.), wavelength / 1000., n.iloc[i].values[0],
-                                                       noOfAngles=noOfAngles)
-        extinction_coefficient = _get_coefficients(mie.extinction_crossection, laydata)
-
-        # print('\n oben ext_coef %s \n'%extinction_coefficient)
-
-
-        # print('mie.extinction_crossection ', mie.extinction_crossection.shape)
-        # print('extinction_coefficient: ', extinction_coefficient.shape)
-        # scattering_coefficient = _get_coefficients(mie.scattering_crossection, laydata)
-
-        if aod:
-            layerThickness = sdls.layerbounderies[i][1] - sdls.layerbounderies[i][0]
-            AOD_perBin = extinction_coefficient * layerThickness
-            AOD_layer[i] = AOD_perBin.values.sum()
-
-        extCoeffPerLayer[i] = extinction_coefficient
+    if n_multi and mixing_state != 'homogeneous':
+        raise ValueError('A row dependent index of refraction is only supported for homogeneous particles.')
 
+    if not n_multi:
+        kernel = optical_kernel.get_kernel(sdls.bincenters, wavelength, n, noOfAngles=noOfAngles, products=products,
+                                           angles=angles, mixing_state=mixing_state, n_core=n_core,
+                                           core_fraction=core_fraction)
+        opt = kernel.evaluate(sdls.values)
+        angles = kernel.angles
+    else:
+        opt, angles, kernel = optical_kernel.evaluate_row_dependent_n(sdls.bincenters, wavelength, n.values[:, 0],
+                                                                      sdls.values, noOfAngles=noOfAngles,
+                                                                      n_grid=n_grid, products=products, angles=angles)
 
-        # return laydata, mie.scattering_crossection
+    out = _assemble_optical_properties(sdls, opt, angles, wavelength, n, aod=aod)
+    if n_multi and kernel is not None:
+        out['n_grid_error'] = kernel.error_estimate
+    return out
 
-        scattering_cross_eff = laydata * mie.scattering_crossection
 
-        pfe = (laydata * angular_scatt_func).sum(axis=1)  # sum of all angular_scattering_intensities
-        # pfe2 = pfe.copy()
-        # angular_scatt_func_effective[lc] =  pfe
-        # asymmetry_parameter_LS[i] = (pfe.values*np.cos(pfe.index.values)).sum()/pfe.values.sum()
-        x_2p = pfe.index.values
-        y_2p = pfe.values
-        # limit to [0,pi]
-        y_1p = y_2p[x_2p < np.pi]
-        x_1p = x_2p[x_2p < np.pi]
-        # integ = integrate.simps(y_1p*np.sin(x_1p),x_1p)
-        # y_phase_func = y_1p/integ
-        y_phase_func = y_1p * 4 * np.pi / scattering_cross_eff.sum()
-        asymmetry_parameter_LS[i] = .5 * integrate.simps(np.cos(x_1p) * y_phase_func * np.sin(x_1p), x_1p)
-        # return mie,phase_fct, laydata, scattering_cross_eff, phase_fct_effective[lc], y_phase_func, asymmetry_parameter_LS[i]
-        angular_scatt_func_effective[
-            lc] = pfe * 1e-12 * 1e6  # equivalent to extCoeffPerLayer # similar to  _get_coefficients (converts everthing to meter)
-        # return mie.extinction_crossection, angular_scatt_func, laydata, layerThickness # correct integrales match
-        # return extinction_coefficient, angular_scatt_func_effective
-        # return AOD_layer, pfe, angular_scatt_func_effective[lc]
+def _assemble_optical_properties(sdls, opt, angles, wavelength, n, aod=False):
+    """Creates the output dictionary of _calculate_optical_properties from the dense results of
+    optical_kernel.OpticalKernel.evaluate
 
+    Parameters
+    ----------
+    sdls: SizeDist instance in numberConcentration
+    opt: dict
+        output of OpticalKernel.evaluate
+    angles: array
+        scattering angles of the kernel
+    """
+    out = {}
+    out['n'] = n
+    out['wavelength'] = wavelength
+    index = sdls.index
 
-        #     print(mie.extinction_crossection)
+    extCoeffPerLayer = opt['extCoeff_perrow_perbin']
 
     if aod:
+        layerThickness = sdls.layerbounderies[:, 1] - sdls.layerbounderies[:, 0]
+        AOD_layer = (extCoeffPerLayer * layerThickness[:, np.newaxis]).sum(axis=1)
         out['AOD'] = AOD_layer[~ np.isnan(AOD_layer)].sum()
         out['AOD_layer'] = pd.DataFrame(AOD_layer, index=sdls.layercenters, columns=['AOD per Layer'])
         out['AOD_cum'] = out['AOD_layer'].iloc[::-1].cumsum().iloc[::-1]
@@ -260,14 +453,23 @@ def _calculate_optical_properties(sd, wavelength, n, aod=False, noOfAngles=100):
     else:
         out['extCoeff_perrow'] = extCoeff_perrow
 
-    out['asymmetry_param'] = pd.DataFrame(asymmetry_parameter_LS, index=index,
-                                          columns=['asymmetry_param'])
+    if 'scattCoeff_perrow' in opt:
+        out['scattCoeff_perrow'] = pd.DataFrame(opt['scattCoeff_perrow'], index=index, columns=['scatt_coeff'])
+    if 'absCoeff_perrow' in opt:
+        out['absCoeff_perrow'] = pd.DataFrame(opt['absCoeff_perrow'], index=index, columns=['abs_coeff'])
+    if 'asymmetry_param' in opt:
+        out['asymmetry_param'] = pd.DataFrame(opt['asymmetry_param'], index=index,
+                                              columns=['asymmetry_param'])
     # out['asymmetry_param_alt'] = pd.DataFrame(asymmetry_parameter_LS_alt, index=sdls.layercenters, columns = ['asymmetry_param_alt'])
     # out['OptPropInstance']= OpticalProperties(out, self.bins)
     out['wavelength'] = wavelength
     out['index_of_refraction'] = n
     out['bin_centers'] = sdls.bincenters
-    out['angular_scatt_func'] = angular_scatt_func_effective
+    if 'angular_scatt_func' in opt:
+        angular_scatt_func_effective = pd.DataFrame(opt['angular_scatt_func'], index=angles,
+                                                    columns=index)  # similar to  _get_coefficients (converts everthing to meter)
+        angular_scatt_func_effective.index.name = 'angle'
+        out['angular_scatt_func'] = angular_scatt_func_effective
     # opt_properties = OpticalProperties(out, self.bins)
     # opt_properties.wavelength = wavelength
     # opt_properties.index_of_refractio = n
@@ -312,8 +514,9 @@ class SizeDist(object):
                  # bincenters=False,
                  fixGaps=True):
 
+        self._frame = None
         if type(data).__name__ == 'NoneType':
-            self.data = pd.DataFrame()
+            self._set_values(np.empty((0, bins.shape[0] - 1)), pd.Index([]))
         else:
             self.data = data
 
@@ -331,35 +534,218 @@ class SizeDist(object):
         if fixGaps:
             self.fillGaps()
 
+    def __getstate__(self):
+        # the DataFrame is only a view on the values, no need to copy or pickle it
+        self._sync()
+        state = self.__dict__.copy()
+        state['_frame'] = None
+        state['_frame_base'] = None
+        return state
 
     @property
-    def bins(self):
-        return self.__bins
+    def data(self):
+        """pandas DataFrame (index: rows, columns: bins). The DataFrame is only created when accessed and shares its
+        memory with the values array, so changes made on it are visible in values. If the values are shared with
+        other instances (see copy) pandas copies them on the first change."""
+        values = self.values
+        if self._frame is None:
+            columns = self.binaxis.column_names if len(self.binaxis) == values.shape[1] else None
+            frame = pd.DataFrame(values, index=self._index, columns=columns, copy=False)
+            if not values.flags.writeable:
+                # a shallow copy of a DataFrame makes pandas copy the values before writing to them
+                self._frame_base = frame
+                frame = frame.copy(deep=False)
+            self._frame = frame
+            self._index = frame.index
+        return self._frame
+
+    @data.setter
+    def data(self, data):
+        self._set_values(data.values, data.index)
 
-    @bins.setter
-    def bins(self,array):
-        bins_st = array.astype(int).astype(str)
-        col_names = []
-        for e,i in enumerate(bins_st):
-            if e == len(bins_st) - 1:
-                break
-            col_names.append(bins_st[e] + '-' + bins_st[e+1])
-        self.data.columns = col_names
+    @property
+    def values(self):
+        """2-D array of shape (no_of_rows, no_of_bins) holding the data. Read-only while the array is shared with
+        other instances (see copy)."""
+        self._sync()
+        if self._scale is not None:
+            self._values = self._values * self._scale
+            self._scale = None
+            self._frame = None
+            self._frame_base = None
+        return self._values
 
+    @property
+    def index(self):
+        """Index of the rows (time stamps, altitudes, ...)"""
+        self._sync()
+        return self._index
 
-        self.__bins = array
-        self.__bincenters = (array[1:] + array[:-1]) / 2.
-        self.__binwidth = (array[1:] - array[:-1])
+    def _set_values(self, values, index=None, scale=None):
+        """Replaces the values (and the index) without copying if values is already a contiguous float array.
 
+        scale: array, optional
+            factor per bin the values are multiplied with. The multiplication is deferred until the values are needed.
+        """
+        values = np.asarray(values)
+        if scale is not None and not values.flags.c_contiguous:
+            # the values have to be copied anyway
+            values = values * scale
+            scale = None
+        values = np.ascontiguousarray(values, dtype=float)
+        if values.ndim != 2:
+            raise ValueError('values has to be 2-D (no_of_rows, no_of_bins), got shape %s' % (values.shape,))
+        if index is None:
+            index = self._index
+        index = pd.Index(index)
+        if index.shape[0] != values.shape[0]:
+            raise ValueError('Length mismatch: %i rows but an index of length %i' % (values.shape[0], index.shape[0]))
+        self._values = values
+        self._scale = scale
+        self._index = index
+        self._frame = None
+        self._frame_base = None
+
+    def _set_index(self, index):
+        self._sync()
+        self._set_values(self._values, index, scale=self._scale)
+
+    def _sync(self):
+        """Takes over changes made on the DataFrame returned by data which replaced its memory (e.g. added rows)"""
+        frame = self._frame
+        if frame is None:
+            return
+        if frame.index is self._index and frame.shape == self._values.shape:
+            if np.may_share_memory(frame.values, self._values):
+                return
+        self._frame = None
+        self._set_values(frame.values, frame.index)
+
+    def _share_values(self):
+        """Makes the values read-only, so they can be shared with other instances"""
+        self._sync()
+        if self._values.flags.writeable:
+            values = self._values.view()
+            values.flags.writeable = False
+            self._values = values
+            self._frame = None
+            self._frame_base = None
+        return self._values
+
+    def _copy_with(self, values=None, index=None, bins=None, rows=None, columns=None, scale=None):
+        """Shallow copy of self. Values and attributes are shared with self until one of the instances changes them
+        (see copy).
+
+        Parameters
+        ----------
+        values, index, bins: optional
+            replace the values, index, or bins of the copy
+        rows, columns: slice or array, optional
+            selection of rows and columns of the values (and index) of self
+        scale: array, optional
+            factor per bin the values of the copy are multiplied with. The multiplication is deferred until the values
+            are needed, so e.g. a chain of conversions does not create intermediate arrays.
+
+        data_std and data_count (see _set_statistics) get the same selection, data_std also the scale. If values are
+        given they are removed.
+        """
+        dist = shallow_copy(self)
+        for name, value in dist.__dict__.items():
+            if isinstance(value, (pd.DataFrame, pd.Series)):
+                dist.__dict__[name] = value.copy(deep=False)
+
+        values_replaced = values is not None
+        if values is None:
+            values = self._share_values()
+            pending = self._scale
+        else:
+            pending = None
+        if index is None:
+            index = self._index
+        if rows is not None:
+            values = values[rows]
+            index = index[rows]
+        if columns is not None:
+            values = values[:, columns]
+            if pending is not None:
+                pending = pending[columns]
+        if scale is not None:
+            pending = scale if pending is None else pending * scale
+        dist._set_values(values, index, scale=pending)
+        if bins is not None:
+            dist.bins = bins
+
+        # the statistics of an average (see _set_statistics) follow the selection and the conversion of the values;
+        # they do not describe replaced values
+        for name in ('data_std', 'data_count'):
+            statistic = dist.__dict__.get(name)
+            if statistic is None:
+                continue
+            if values_replaced:
+                del dist.__dict__[name]
+                continue
+            statistic = statistic.values
+            if rows is not None:
+                statistic = statistic[rows]
+            if columns is not None:
+                statistic = statistic[:, columns]
+            if scale is not None and name == 'data_std':
+                statistic = statistic * scale
+            names = dist.binaxis.column_names if len(dist.binaxis) == statistic.shape[1] else None
+            dist.__dict__[name] = pd.DataFrame(statistic, index=dist._index, columns=names)
+        return dist
+
+    def _arithmetic(self, other, operator):
+        if isinstance(other, SizeDist):
+            if other.distributionType != self.distributionType:
+                raise ValueError('Distribution types differ (%s, %s)' % (self.distributionType, other.distributionType))
+            if other.binaxis != self.binaxis:
+                raise ValueError('Bins differ')
+            other = other.values
+        return self._copy_with(values=operator(self.values, other))
+
+    def __add__(self, other):
+        return self._arithmetic(other, np.add)
+
+    def __sub__(self, other):
+        return self._arithmetic(other, np.subtract)
+
+    def __mul__(self, other):
+        return self._arithmetic(other, np.multiply)
+
+    def __truediv__(self, other):
+        return self._arithmetic(other, np.true_divide)
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+    @property
+    def bins(self):
+        return self.__binaxis.edges
+
+    @bins.setter
+    def bins(self,array):
+        binaxis = bin_axis.get(array)
+        self._sync()
+        if len(binaxis) != self._values.shape[1]:
+            txt = 'Length mismatch: data has %i columns, bins define %i' % (self._values.shape[1], len(binaxis))
+            raise ValueError(txt)
+        self.__binaxis = binaxis
+        self._frame = None
+        self._frame_base = None
 
+    @property
+    def binaxis(self):
+        """bin_axis.BinAxis instance, shared with all distributions which have the same bins"""
+        return self.__binaxis
 
     @property
     def bincenters(self):
-        return self.__bincenters
+        return self.__binaxis.centers
 
     @property
     def binwidth(self):
-        return self.__binwidth
+        return self.__binaxis.widths
 
     @property
     def index_of_refraction(self):
@@ -379,23 +765,40 @@ class SizeDist(object):
     def growth_factor(self):
         return self.__growth_factor
 
-    def apply_hygro_growth(self, kappa, RH, how = 'shift_bins'):
+    def apply_hygro_growth(self, kappa, RH, how = 'shift_bins', curvature=False, temperature=298.15):
         """
         how: string ['shift_bins', 'shift_data']
             If the shift_bins the growth factor has to be the same for all lines in
             data (important for timeseries and vertical profile.
             If gf changes (as probably the case in TS and LS) you want to use
             'shift_data'
+        curvature: bool, optional
+            If False the growth factor is independent of the particle diameter (hygroscopic_growth.kappa_simple). If
+            True the curvature (Kelvin) effect is taken into account (hygroscopic_growth.kappa_koehler), which
+            reduces the growth of small particles. The growth_factor and index_of_refraction are then the volume
+            weighted means of each line.
+        temperature: float or array, optional
+            temperature in K, only used if curvature is True
         """
 
         if not self.index_of_refraction:
             txt = '''The index_of_refraction attribute of this sizedistribution has not been set yet, please do so first!'''
             raise ValueError(txt)
         # out_I = {}
-        dist_g = self.copy()
-        dist_g.convert2numberconcentration()
-
-        gf,n_mix = hg.kappa_simple(kappa, RH, n = dist_g.index_of_refraction)
+        dist_g = self._copy_with()
+
+        if curvature:
+            # growth factor at each bin edge of each line, solved only once for repeated conditions
+            conditions = np.array(np.broadcast_arrays(*[np.atleast_1d(np.asarray(i, dtype=float))
+                                                        for i in (kappa, RH, temperature)]))
+            conditions, inverse = np.unique(conditions, axis=1, return_inverse=True)
+            kappa_u, RH_u, temperature_u = conditions[:, :, np.newaxis]
+            gf = hg.kappa_koehler(kappa_u, RH_u, dist_g.bins, T=temperature_u)[inverse.ravel()]
+            gf_mean = dist_g._get_volume_weighted_growth_factor(gf)
+            n_mix = hg.mix_index_of_refraction(dist_g.index_of_refraction, gf_mean)
+        else:
+            gf,n_mix = hg.kappa_simple(kappa, RH, n = dist_g.index_of_refraction)
+            gf_mean = gf
         # out_I['growth_factor'] = gf
         nat = ['int', 'float']
         if type(kappa).__name__ in nat or type(RH).__name__ in nat:
@@ -405,27 +808,25 @@ class SizeDist(object):
 
 
         if how == 'shift_bins':
-            if not isinstance(gf, (float,int)):
+            if not isinstance(gf_mean, (float,int)):
                 txt = '''If how is equal to 'shift_bins' RH has to be of type int or float.
                 It is %s'''%(type(RH).__name__)
                 raise TypeError(txt)
 
-            dist_g.bins = dist_g.bins * gf
+            if curvature:
+                # the bins are shifted by different factors, the number of particles in each bin is conserved
+                bins = dist_g.bins * gf[0]
+                scale = None
+                if dist_g.distributionType in bin_axis.dist_types:
+                    scale = (dist_g.binaxis.get_conversion_factor(dist_g.distributionType, 'numberConcentration')
+                             * bin_axis.get(bins).get_conversion_factor('numberConcentration', dist_g.distributionType))
+                dist_g = dist_g._copy_with(bins=bins, scale=scale)
+            else:
+                dist_g.bins = dist_g.bins * gf
             dist_g.__index_of_refraction = n_mix
         elif how == 'shift_data':
-            test = dist_g._hygro_growht_shift_data(dist_g.data.values[0],dist_g.bins,gf.max())
-            bin_num = test['data'].shape[0]
-            data_new = np.zeros((dist_g.data.shape[0],bin_num))
-            for e,i in enumerate(dist_g.data.values):
-                out = dist_g._hygro_growht_shift_data(i,dist_g.bins,gf[e])
-                dt = out['data']
-                diff = bin_num - dt.shape[0]
-                dt = np.append(dt, np.zeros(diff))
-                data_new[e] = dt
-            df = pd.DataFrame(data_new)
-            df.index = dist_g.data.index
-            # return df
-            dist_g = SizeDist(df, test['bins'], dist_g.distributionType)
+            data_new, bins = dist_g._hygro_growth_shift_data(np.asarray(gf, dtype=float))
+            dist_g = dist_g._copy_with(values=data_new, bins=bins)
             df = pd.DataFrame(n_mix, columns = ['index_of_refraction'])
             df.index = dist_g.data.index
             dist_g.index_of_refraction = df
@@ -433,66 +834,93 @@ class SizeDist(object):
             txt = '''How has to be either 'shift_bins' or 'shift_data'.'''
             raise ValueError(txt)
 
-        dist_g.__growth_factor = pd.DataFrame(gf, index = dist_g.data.index, columns = ['Growth_factor'])
+        dist_g.__growth_factor = pd.DataFrame(gf_mean, index = dist_g.data.index, columns = ['Growth_factor'])
         # out_I['size_distribution'] = dist_g
         return dist_g
 
 
-    def _hygro_growht_shift_data(self, data, bins, gf):
-        """data: 1D array
-        bins: 1D array
-        gf: float"""
-        bins = bins.copy()
-        if np.any(gf < 1):
-            txt = 'Growth factor must be equal or larger than 1. No shrinking!!'
-            raise ValueError(txt)
-
-        shifted = bins*gf
-        ml = array_tools.find_closest(bins, shifted, how='closest_low')
-        mh = array_tools.find_closest(bins, shifted, how='closest_high')
-
-        if np.any((mh - ml) > 1):
-            raise ValueError('shifted bins spans over more than two of the original bins, programming required ;-)')
-
-        no_extra_bins = bins[ml].shape[0] - np.unique(bins[ml]).shape[0] + 1
-
-        ######### Ad bins to shift data into
-
-        last_two = np.log10(bins[- (no_extra_bins + 1):])
-        step_width = last_two[-1] - last_two[-2]
-        new_bins = np.zeros(no_extra_bins)
-        for i in range(no_extra_bins):
-            new_bins[i] = np.log10(bins[-1]) + ((i + 1) * step_width)
-        newbins = 10**new_bins
-        bins = np.append(bins,newbins)
-        shifted = (bins * gf)[:-no_extra_bins]
-
-        ######## and again ########################
-
-        ml = array_tools.find_closest(bins, shifted, how='closest_low')
-        mh = array_tools.find_closest(bins, shifted, how='closest_high')
-
-        if np.any((mh - ml) > 1):
-            raise ValueError('shifted bins spans over more than two of the original bins, programming required ;-)')
-
+    def _hygro_growth_shift_data(self, gf):
+        """Moves the particles of each line into the bins their grown diameters fall into. The bins are extended at
+        the upper end (same logarithmic step width) to hold the largest grown particles.
 
-        ##### percentage of particles moved to next bin ...')
+        The redistribution for a growth factor is a sparse matrix (see bin_axis.get_overlap_matrix), which is computed
+        once for each distinct growth factor and applied to all lines with that growth factor at once. Size dependent
+        growth factors, and growth factors which are mostly distinct, are redistributed for all lines at once by
+        bin_axis.redistribute.
 
-        shifted_w = shifted[1:] - shifted[:-1]
-
-        fract_first = (bins[mh] - shifted)[:-1]/shifted_w
-        fract_last = (shifted - bins[ml])[1:]/shifted_w
+        Parameters
+        ----------
+        gf: array of shape (no_of_lines,) or (no_of_lines, no_of_bins + 1)
+            growth factor of each line, or of each bin edge of each line. nan gives a line of nan
 
-        data_new = np.zeros(data.shape[0]+ no_extra_bins)
-        data_new[no_extra_bins - 1:-1] += fract_first * data
-        data_new[no_extra_bins:] += fract_last * data
+        Returns
+        -------
+        values, bins
+        """
+        size_dependent = gf.ndim == 2
+        valid = np.all(np.isfinite(gf), axis=1) if size_dependent else np.isfinite(gf)
+        if np.any(gf[valid] < 1):
+            txt = 'Growth factor must be equal or larger than 1. No shrinking!!'
+            raise ValueError(txt)
 
-    #     data = np.append(data, np.zeros(no_extra_bins))
-        out = {}
-        out['bins'] = bins
-        out['data'] = data_new
-        out['num_extr_bins'] = no_extra_bins
-        return out
+        binaxis = self.binaxis
+        edges = binaxis.edges
+        step = np.log10(edges[-1] / edges[-2])
+        gf_max = gf[valid].max() if np.any(valid) else 1.
+        no_extra_bins = max(1, int(np.ceil(np.log10(gf_max) / step - 1e-10)))
+        bins = np.append(edges, edges[-1] * 10 ** (step * np.arange(1, no_extra_bins + 1)))
+        binaxis_new = bin_axis.get(bins)
+
+        # the number of particles is conserved, not the distribution
+        values = self.values
+        converted = self.distributionType in bin_axis.dist_types
+        if converted:
+            values = values * binaxis.get_conversion_factor(self.distributionType, 'numberConcentration')
+
+        data_new = np.full((values.shape[0], len(binaxis_new)), np.nan)
+        if not size_dependent:
+            gf_unique, inverse = np.unique(gf[valid], return_inverse=True)
+            if gf_unique.shape[0] > valid.sum() / 2:
+                # hardly any repeated growth factors (e.g. a continuous RH), a matrix per line does not pay off
+                size_dependent = True
+                gf = gf[:, np.newaxis]
+        if size_dependent:
+            data_new[valid] = bin_axis.redistribute(values[valid], edges * gf[valid], binaxis_new)
+        else:
+            lines = np.where(valid)[0][np.argsort(inverse, kind='stable')]
+            groups = np.split(lines, np.cumsum(np.bincount(inverse, minlength=gf_unique.shape[0]))[:-1])
+            for growth_factor, rows in zip(gf_unique, groups):
+                matrix = bin_axis.get_overlap_matrix(binaxis, binaxis_new, growth_factor)
+                data_new[rows] = matrix.dot(values[rows].transpose()).transpose()
+
+        if converted:
+            data_new *= binaxis_new.get_conversion_factor('numberConcentration', self.distributionType)
+        return data_new, bins
+
+    def _get_volume_weighted_growth_factor(self, gf):
+        """Mean growth factor of each line, weighted by the dry particle volume in each bin (the unweighted mean for
+        lines without particles).
+
+        gf: array of shape (no_of_lines, no_of_bins + 1) or (1, no_of_bins + 1)
+            growth factor at each bin edge. If the growth factor is the same for all lines the mean over all lines is
+            returned.
+        """
+        gf_bins = np.sqrt(gf[:, 1:] * gf[:, :-1])
+        if self.distributionType in bin_axis.dist_types:
+            volume = self.values * self.binaxis.get_conversion_factor(self.distributionType, 'numberConcentration')
+            volume = volume * self.binaxis.get_factor('dVdDp')
+        else:
+            volume = np.zeros(self.values.shape)
+        if gf.shape[0] == 1:
+            volume = volume.sum(axis=0, keepdims=True)
+        total = volume.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gf_mean = ((volume * gf_bins ** 3).sum(axis=1) / total) ** (1 / 3.)
+        no_weights = ~(total > 0)
+        gf_mean[no_weights] = gf_bins.mean(axis=1)[no_weights]
+        if gf.shape[0] == 1:
+            return float(gf_mean[0])
+        return gf_mean
 
 
     # def grow_particles(self, shift=1):
@@ -518,11 +946,41 @@ class SizeDist(object):
     #
     #     return dist_grow, (gf_mean, gf_std)
 
-    def calculate_optical_properties(self, wavelength, n):
-        out = _calculate_optical_properties(self, wavelength, n)
+    def calculate_optical_properties(self, wavelength, n, n_grid=None, products=optical_kernel.products_all,
+                                     angles=None, mixing_state='homogeneous', n_core=None, core_fraction=None):
+        out = _calculate_optical_properties(self, wavelength, n, n_grid=n_grid, products=products, angles=angles,
+                                            mixing_state=mixing_state, n_core=n_core, core_fraction=core_fraction)
         return out
 
 
+    def _find_gaps(self, scale):
+        """Returns the positions of the lines which are followed by a gap and the threshold defining a gap"""
+        index = self.index
+        if index.shape[0] < 3:
+            return np.array([], dtype=int), None
+        diff = index[1:].values - index[0:-1].values
+        threshold = np.median(diff) * scale
+        return np.where(diff > threshold)[0], threshold
+
+    def get_gap_mask(self, scale=1.1):
+        """
+        Finds gaps in dataset (e.g. when instrument was shut of) without changing the data. This is a light weight
+        alternative to fillGaps, e.g. to interrupt lines in a plot with np.ma.masked_where.
+
+        Parameters
+        ----------
+        scale:  float, optional
+                A gap is a difference between consecutive index values larger than scale times the median difference.
+
+        Returns
+        -------
+        bool array, True for each line which is followed by a gap
+        """
+        where, threshold = self._find_gaps(scale)
+        mask = np.zeros(self.index.shape[0], dtype=bool)
+        mask[where] = True
+        return mask
+
     def fillGaps(self, scale=1.1):
         """
         Finds gaps in dataset (e.g. when instrument was shut of) and fills them with zeros.
@@ -533,31 +991,38 @@ class SizeDist(object):
         Parameters
         ----------
         scale:  float, optional
-                This is a scale.
+                A gap is a difference between consecutive index values larger than scale times the median difference.
         """
-        diff = self.data.index[1:].values - self.data.index[0:-1].values
-        threshold = np.median(diff) * scale
-        where = np.where(diff > threshold)[0]
+        where, threshold = self._find_gaps(scale)
         if len(where) != 0:
             warnings.warn('The dataset provided had %s gaps' % len(where))
-            gap_start = self.data.index[where]
-            gap_end = self.data.index[where + 1]
-            for gap_s in gap_start:
-                self.data.loc[gap_s + threshold] = np.zeros(self.bincenters.shape)
-            for gap_e in gap_end:
-                self.data.loc[gap_e - threshold] = np.zeros(self.bincenters.shape)
-            self.data = self.data.sort_index()
+            index = self.index
+            gap_index = (index[where] + threshold).append(index[where + 1] - threshold).unique()
+            values = self.values
+            new_index = index.append(gap_index)
+            new_values = np.concatenate((values, np.zeros((gap_index.shape[0], values.shape[1]))))
+            order = np.argsort(new_index.values, kind='stable')
+            self._set_values(new_values[order], new_index[order])
         return
 
-    def fit_normal(self, log=True, p0=[10, 180, 0.2]):
-        """ Fits a single normal distribution to each line in the data frame.
+    def fit_normal(self, log=True, p0=None):
+        """ Fits a single normal distribution to each line in the data frame. All lines are fitted simultaneously (see
+        lognormal_fit.levenberg_marquardt), nan values are ignored.
+
+        Parameters
+        ----------
+        log: bool, optional.
+            If True the normal distribution is fitted on a logarithmic diameter axis (log normal distribution).
+        p0: list, optional.
+            Initial guess [amplitude, position (nm), sigma] used for all lines. If None (default) the guess is derived
+            from the moments of each line.
 
         Returns
         -------
-        pandas DataFrame instance (also added to namespace as data_fit_normal)
+        pandas DataFrame instance (also added to namespace as data_fit_normal). Lines which could not be fitted are nan.
 
         """
-        sd = self.copy()
+        sd = self
 
         if sd.distributionType != 'dNdlogDp':
             if sd.distributionType == 'calibration':
@@ -567,22 +1032,23 @@ class SizeDist(object):
                     "Size distribution is not in 'dNdlogDp'. I temporarily converted the distribution to conduct the fitting. If that is not what you want, change the code!")
                 sd = sd.convert2dNdlogDp()
 
-        n_lines = sd.data.shape[0]
-        amp = np.zeros(n_lines)
-        pos = np.zeros(n_lines)
-        sigma = np.zeros(n_lines)
-        sigma_high = np.zeros(n_lines)
-        sigma_low = np.zeros(n_lines)
-        for e, lay in enumerate(sd.data.values):
-            try:
-                fit_res = fit_normal_dist(sd.bincenters, lay, log=log, p0=p0)
-            except (ValueError, RuntimeError):
-                fit_res = [np.nan, np.nan, np.nan, np.nan, np.nan]
-            amp[e] = fit_res[0]
-            pos[e] = fit_res[1]
-            sigma[e] = fit_res[2]
-            sigma_high[e] = fit_res[3]
-            sigma_low[e] = fit_res[4]
+        x = sd.bincenters
+        if p0 is not None:
+            p0 = list(p0)
+        if log:
+            x = np.log10(x)
+            if p0 is not None:
+                p0[1] = np.log10(p0[1])
+
+        params, converged = lognormal_fit.fit_normal(x, sd.values, p0=p0)
+        amp, pos, sigma = params.transpose()
+        if log:
+            sigma_high = 10 ** (pos + sigma)
+            sigma_low = 10 ** (pos - sigma)
+            pos = 10 ** pos
+        else:
+            sigma_high = pos + sigma
+            sigma_low = pos - sigma
 
         df = pd.DataFrame()
         df['Amp'] = pd.Series(amp)
@@ -595,6 +1061,53 @@ class SizeDist(object):
         return self.data_fit_normal
 
 
+    def fit_modes(self, max_modes=4, log=True, criterion='bic', warm_start=True, workers=1, chunksize=5000):
+        """ Decomposes each line into 1 to max_modes normal distributions (e.g. Aitken, accumulation, and coarse mode).
+        The number of modes is selected for each line by an information criterion. See lognormal_fit.fit_modes for
+        details.
+
+        Parameters
+        ----------
+        max_modes: int, optional.
+        log: bool, optional.
+            If True the modes are fitted on a logarithmic diameter axis (log normal distributions).
+        criterion: str, optional.
+            'bic' or 'aic'
+        warm_start: bool, optional.
+            If True each line is also fitted starting from the result of the previous line.
+        workers: int, optional.
+            number of processes. None: number of CPUs.
+        chunksize: int, optional.
+            number of lines which are fitted simultaneously by one process.
+
+        Returns
+        -------
+        pandas DataFrame instance (also added to namespace as data_fit_modes) with the columns No_of_modes, IC
+        (information criterion), and Amp_i, Pos_i, Sigma_i for each mode i (sorted by position, nan if not used).
+        """
+        sd = self
+        if sd.distributionType not in ('dNdlogDp', 'calibration'):
+            warnings.warn(
+                "Size distribution is not in 'dNdlogDp'. I temporarily converted the distribution to conduct the fitting. If that is not what you want, change the code!")
+            sd = sd.convert2dNdlogDp()
+
+        x = sd.bincenters
+        if log:
+            x = np.log10(x)
+        params, no_of_modes, ic = lognormal_fit.fit_modes(x, sd.values, max_modes=max_modes, criterion=criterion,
+                                                          warm_start=warm_start, workers=workers, chunksize=chunksize)
+        if log:
+            params[:, 1::3] = 10 ** params[:, 1::3]
+
+        columns = []
+        for i in range(1, max_modes + 1):
+            columns += ['Amp_%i' % i, 'Pos_%i' % i, 'Sigma_%i' % i]
+        df = pd.DataFrame(params, index=self.index, columns=columns)
+        df.insert(0, 'No_of_modes', no_of_modes)
+        df.insert(1, 'IC', ic)
+        self.data_fit_modes = df
+        return self.data_fit_modes
+
     def get_particle_concentration(self):
         """ Returns the sum of particles per line in data
 
@@ -603,15 +1116,115 @@ class SizeDist(object):
         int: if data has only one line
         pandas.DataFrame: else """
         sd = self.convert2numberconcentration()
-        particles = np.zeros(sd.data.shape[0])
-        for e, line in enumerate(sd.data.values):
-            particles[e] = line.sum()
-        if sd.data.shape[0] == 1:
+        particles = sd.values.sum(axis=1)
+        if sd.values.shape[0] == 1:
             return particles[0]
         else:
-            df = pd.DataFrame(particles, index=sd.data.index, columns=['Count_rate'])
+            df = pd.DataFrame(particles, index=sd.index, columns=['Count_rate'])
             return df
 
+    def _set_statistics(self, std, count):
+        """Adds the standard deviation and number of values of an average to the namespace (data_std, data_count)"""
+        self.data_std = pd.DataFrame(std, index=self.index, columns=self.data.columns)
+        self.data_count = pd.DataFrame(count, index=self.index, columns=self.data.columns)
+
+    def _get_amount_factor(self, moment, binaxis=None):
+        """Factor which converts the values into the number, surface, or volume concentration in each bin of binaxis
+        (default: self.binaxis)"""
+        moments = {'number': 'numberConcentration', 'surface': 'dSdDp', 'volume': 'dVdDp'}
+        if moment not in moments:
+            raise ValueError("moment has to be one of %s, not %s" % (list(moments.keys()), moment))
+        if binaxis is None:
+            binaxis = self.binaxis
+        factor = binaxis.get_conversion_factor(self.distributionType, 'numberConcentration')
+        if moment != 'number':
+            factor = factor * binaxis.get_factor(moments[moment])
+        return factor
+
+    def _get_amount_per_bin(self, moment):
+        """Number, surface, or volume concentration in each bin (array of shape (no_of_lines, no_of_bins))"""
+        return self.values * self._get_amount_factor(moment)
+
+    def _get_percentile_diameters(self, amount, q):
+        """Diameters below which the fractions q (array) of amount (see _get_amount_per_bin) lie. Within the crossing
+        bin the diameter is interpolated logarithmically between the bin edges."""
+        edges = self.bins
+        cdf = np.cumsum(amount, axis=1)
+        total = cdf[:, -1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cdf /= total
+        diameters = np.full((amount.shape[0], q.shape[0]), np.nan)
+        valid = np.isfinite(total[:, 0]) & (total[:, 0] > 0)
+        cdf = cdf[valid]
+        for e, fraction in enumerate(q):
+            idx = np.minimum((cdf < fraction).sum(axis=1), cdf.shape[1] - 1)
+            upper = np.take_along_axis(cdf, idx[:, np.newaxis], axis=1)[:, 0]
+            lower = np.where(idx > 0, np.take_along_axis(cdf, np.maximum(idx - 1, 0)[:, np.newaxis], axis=1)[:, 0], 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                weight = np.clip(np.where(upper > lower, (fraction - lower) / (upper - lower), 0), 0, 1)
+            diameters[valid, e] = edges[idx] * (edges[idx + 1] / edges[idx]) ** weight
+        return diameters
+
+    def percentiles(self, q=(10, 50, 90), moment='number'):
+        """ Diameters below which q percent of the particle number, surface, or volume of each line lie (e.g. D10, D50,
+        D90). All lines are done at once on the cumulative sums; within a bin the diameter is interpolated
+        logarithmically.
+
+        Parameters
+        ----------
+        q: float or sequence of floats, optional.
+            percentiles between 0 and 100
+        moment: str, optional.
+            'number', 'surface', or 'volume'
+
+        Returns
+        -------
+        pandas DataFrame instance with the columns D10, D50, ... (nm). Lines without particles are nan.
+        """
+        q = np.atleast_1d(np.asarray(q, dtype=float))
+        if np.any(q < 0) or np.any(q > 100):
+            raise ValueError('q has to be between 0 and 100')
+        amount = self._get_amount_per_bin(moment)
+        diameters = self._get_percentile_diameters(amount, q / 100.)
+        return pd.DataFrame(diameters, index=self.index, columns=['D%g' % i for i in q])
+
+    def moments(self, density=None):
+        """ Bulk properties of each line, computed for all lines at once.
+
+        Parameters
+        ----------
+        density: float, optional.
+            particle density in g/cm^3. If given the mass concentration is added.
+
+        Returns
+        -------
+        pandas DataFrame instance with the columns
+            Number: particle number concentration (#/cc)
+            Surface: surface concentration (nm^2/cc)
+            Volume: volume concentration (nm^3/cc)
+            Mass: mass concentration (ug/m^3), only if density is given
+            Effective_diameter: 6 * Volume / Surface (nm)
+            CMD, VMD: count and volume median diameter (nm)
+        """
+        number = self._get_amount_per_bin('number')
+        binaxis = self.binaxis
+        surface = number * binaxis.get_factor('dSdDp')
+        volume = number * binaxis.get_factor('dVdDp')
+
+        df = pd.DataFrame(index=self.index)
+        df['Number'] = number.sum(axis=1)
+        df['Surface'] = surface.sum(axis=1)
+        df['Volume'] = volume.sum(axis=1)
+        if density is not None:
+            # nm^3/cc * g/cm^3 -> ug/m^3
+            df['Mass'] = df['Volume'].values * density * 1e-9
+        with np.errstate(divide='ignore', invalid='ignore'):
+            df['Effective_diameter'] = 6. * df['Volume'].values / df['Surface'].values
+        half = np.array([0.5])
+        df['CMD'] = self._get_percentile_diameters(number, half)[:, 0]
+        df['VMD'] = self._get_percentile_diameters(volume, half)[:, 0]
+        return df
+
     def plot(self,
              showMinorTickLabels=True,
              removeTickLabels=["700", "900"],
@@ -695,8 +1308,26 @@ class SizeDist(object):
         return self._convert2otherDistribution('numberConcentration')
 
     def copy(self):
+        """Independent (deep) copy of the instance.
+
+        Methods which return a new instance (e.g. the conversions, zoom_diameter, zoom_time, average_overTime,
+        apply_hygro_growth) do not copy. The new instance shares the values and all other attributes (fit results,
+        housekeeping, parents, ...) with this instance, until one of them changes them. Values are read-only while
+        they are shared, changes made through data are done on a copy (pandas copy on write). Attributes which are
+        pandas objects are shallow copies, other objects are shared; use copy if you want to change those in place.
+        """
         return deepcopy(self)
 
+    def lazy(self):
+        """Returns a LazySizeDist instance which records the operations (conversions, zoom_..., average_overTime)
+        and executes them in an optimized order when its compute method is called.
+
+        Example
+        -------
+        >>> dist.lazy().zoom_time(start, end).convert2dVdlogDp().zoom_diameter(100, 1000).compute()
+        """
+        return LazySizeDist(self)
+
     def save_csv(self, fname, header=True):
         if header:
             raus = open(fname, 'w')
@@ -752,115 +1383,66 @@ class SizeDist(object):
         return hdf
 
     def zoom_diameter(self, start=None, end=None):
-        sd = self.copy()
         if start:
-            startIdx = array_tools.find_closest(sd.bins, start)
+            startIdx = array_tools.find_closest(self.bins, start)
         else:
             startIdx = 0
         if end:
-            endIdx = array_tools.find_closest(sd.bins, end)
+            endIdx = array_tools.find_closest(self.bins, end)
         else:
             endIdx = len(self.bincenters)
-        # size_distr.binwidth = self.binwidth[startIdx:endIdx]
-        sd.data = self.data.iloc[:, startIdx:endIdx]
-        sd.bins = self.bins[startIdx:endIdx + 1]
-        # size_distr.bincenters = self.bincenters[startIdx:endIdx]
-
+        sd = self._copy_with(columns=slice(startIdx, endIdx), bins=self.bins[startIdx:endIdx + 1])
         return sd
 
+    def rebin(self, new_bins, conserve='number', log=True):
+        """ Redistributes the distribution onto new bins (e.g. to put data of different instruments onto a common
+        diameter grid). The content of each bin is split onto the new bins it overlaps with, assuming it is
+        distributed uniformly (in log diameter if log is True) within the bin. All lines are remapped with one sparse
+        product; the overlap matrix is cached for each pair of bins (see bin_axis.get_overlap_matrix).
+
+        Parameters
+        ----------
+        new_bins: array
+            bin edges in nm
+        conserve: str, optional.
+            'number', 'surface', or 'volume', the quantity which is conserved
+        log: bool, optional.
+
+        Returns
+        -------
+        Rebinned copy of self. New bins which do not overlap with the old bins are nan, new bins which overlap only
+        partially only contain the part which lies within the old bins.
+        """
+        binaxis = self.binaxis
+        binaxis_new = bin_axis.get(new_bins)
+        amount = self._get_amount_per_bin(conserve)
+        matrix = bin_axis.get_overlap_matrix(binaxis, binaxis_new, 1., log)
+        values = matrix.dot(amount.transpose()).transpose()
+        values /= self._get_amount_factor(conserve, binaxis_new)
+
+        outside = (binaxis_new.edges[1:] <= binaxis.edges[0]) | (binaxis_new.edges[:-1] >= binaxis.edges[-1])
+        values[:, outside] = np.nan
+        return self._copy_with(values=values, bins=binaxis_new.edges)
+
     def _normal2log(self):
-        trans = (self.bincenters * np.log(10.))
-        return trans
+        return self.binaxis.get_factor('dNdlogDp')
 
     def _2Surface(self):
-        trans = 4. * np.pi * (self.bincenters / 2.) ** 2
-        return trans
+        return self.binaxis.get_factor('dSdDp')
 
     def _2Volume(self):
-        trans = 4. / 3. * np.pi * (self.bincenters / 2.) ** 3
-        return trans
+        return self.binaxis.get_factor('dVdDp')
 
     def _convert2otherDistribution(self, distType, verbose=False):
 
-        dist = self.copy()
-        if dist.distributionType == distType:
+        if self.distributionType == distType:
             if verbose:
                 warnings.warn(
                     'Distribution type is already %s. Output is an unchanged copy of the distribution' % distType)
-            return dist
-
-        if dist.distributionType == 'numberConcentration':
-            pass
-        elif distType == 'numberConcentration':
-            pass
-        elif dist.distributionType in distTypes['log normal']:
-            if distType in distTypes['log normal']:
-                if verbose:
-                    print('both log normal')
-            else:
-                dist.data = dist.data / self._normal2log()
-
-        elif dist.distributionType in distTypes['natural']:
-            if distType in distTypes['natural']:
-                if verbose:
-                    print('both natural')
-            else:
-                dist.data = dist.data * self._normal2log()
-        else:
-            raise ValueError('%s is not an option' % distType)
-
-        if dist.distributionType == 'numberConcentration':
-            pass
-
-        elif distType == 'numberConcentration':
-            pass
-        elif dist.distributionType in distTypes['number']:
-            if distType in distTypes['number']:
-                if verbose:
-                    print('both number')
-            else:
-                if distType in distTypes['surface']:
-                    dist.data *= self._2Surface()
-                elif distType in distTypes['volume']:
-                    dist.data *= self._2Volume()
-                else:
-                    raise ValueError('%s is not an option' % distType)
-
-        elif dist.distributionType in distTypes['surface']:
-            if distType in distTypes['surface']:
-                if verbose:
-                    print('both surface')
-            else:
-                if distType in distTypes['number']:
-                    dist.data /= self._2Surface()
-                elif distType in distTypes['volume']:
-                    dist.data *= self._2Volume() / self._2Surface()
-                else:
-                    raise ValueError('%s is not an option' % distType)
-
-        elif dist.distributionType in distTypes['volume']:
-            if distType in distTypes['volume']:
-                if verbose:
-                    print('both volume')
-            else:
-                if distType in distTypes['number']:
-                    dist.data /= self._2Volume()
-                elif distType in distTypes['surface']:
-                    dist.data *= self._2Surface() / self._2Volume()
-                else:
-                    raise ValueError('%s is not an option' % distType)
-        else:
-            raise ValueError('%s is not an option' % distType)
-
-        if distType == 'numberConcentration':
-            dist = dist.convert2dNdDp()
-            dist.data *= self.binwidth
-
-        elif dist.distributionType == 'numberConcentration':
-            dist.data = dist.data / self.binwidth
-            dist.distributionType = 'dNdDp'
-            dist = dist._convert2otherDistribution(distType)
+            return self._copy_with()
 
+        trans = self.binaxis.get_conversion_factor(self.distributionType, distType)
+        dist = self._copy_with(scale=trans)
         dist.distributionType = distType
         if verbose:
             print('converted from %s to %s' % (self.distributionType, dist.distributionType))
@@ -886,7 +1468,7 @@ class SizeDist_TS(SizeDist):
          volume: 'dVdlogDp','dVdDp'
        """
 
-    def fit_normal(self, log=True, p0=[10, 180, 0.2]):
+    def fit_normal(self, log=True, p0=None):
         """ Fits a single normal distribution to each line in the data frame.
 
         Returns
@@ -1063,45 +1645,65 @@ class SizeDist_TS(SizeDist):
         """
         2014-11-24 16:02:30
         """
-        dist = self.copy()
-        dist.data = dist.data.truncate(before=start, after=end)
+        where = self.index.slice_indexer(start, end)
+        dist = self._copy_with(rows=where)
         return dist
 
 
-    def average_overTime(self, window='1S'):
+    def average_overTime(self, window='1s', how='mean'):
         """returns a copy of the sizedistribution_TS with reduced size by averaging over a given window
 
+        nan values are ignored, each bin is averaged over its valid values only. The standard deviation and the
+        number of valid values of each bin are computed in the same pass and added to the namespace of the result
+        as data_std and data_count.
+
         Arguments
         ---------
-        window: str ['1S']. Optional
+        window: str ['1s']. Optional
             window over which to average. For aliases see
             http://pandas.pydata.org/pandas-docs/stable/timeseries.html#offset-aliases
+        how: str ['mean']. Optional
+            'mean' or 'median'
 
         Returns
         -------
         SizeDistribution_TS instance
             copy of current instance with resampled data frame
         """
-
-        dist = self.copy()
-        window = window
-        dist.data = dist.data.resample(window, closed='right', label='right')
-        if dist.distributionType == 'calibration':
-            dist.data.values[np.where(np.isnan(self.data.values))] = 0
+        values = self.values
+        index = self.index
+        if not index.is_monotonic_increasing:
+            order = np.argsort(index.values, kind='stable')
+            values = values[order]
+            index = index[order]
+        # only the index is resampled to get the windows, the lines of each window are consecutive
+        lengths = pd.Series(np.ones(index.shape[0]), index=index).resample(window, closed='right',
+                                                                          label='right').count()
+        starts = np.cumsum(lengths.values) - lengths.values
+        average, std, count = _average(values, starts, how=how)
+        if self.distributionType == 'calibration':
+            average = np.where(np.isnan(average), 0, average)
+        dist = self._copy_with(values=average, index=lengths.index)
+        dist._set_statistics(std, count)
         return dist
 
-    def average_overAllTime(self):
+    def average_overAllTime(self, how='mean'):
         """
         averages over the entire dataFrame and returns a single sizedistribution (numpy.ndarray)
-        """
-        singleHist = np.zeros(self.data.shape[1])
 
-        for i in range(self.data.shape[1]):
-            line = self.data.values[:, i]
-            singleHist[i] = np.average(line[~np.isnan(line)])
+        nan values are ignored. The standard deviation and the number of valid values of each bin are added to the
+        namespace of the result as data_std and data_count.
 
-        data = pd.DataFrame(np.array([singleHist]), columns=self.data.columns)
-        avgDist = SizeDist(data, self.bins, self.distributionType)
+        Arguments
+        ---------
+        how: str ['mean']. Optional
+            'mean' or 'median'
+        """
+        singleHist, std, count = _average(self.values, how=how)
+
+        avgDist = SizeDist(None, self.bins, self.distributionType, fixGaps=False)
+        avgDist._set_values(singleHist, pd.RangeIndex(1))
+        avgDist._set_statistics(std, count)
 
         return avgDist
 
@@ -1113,42 +1715,113 @@ class SizeDist_TS(SizeDist):
         nan values are excluded when an average is taken over a the time that corresponds to the particular layer
         (altitude). If there are only nan values nan is returned and there is a gap in the Layerseries.
 
-        The the housekeeping instance has to have a column called "Altitude" and which is monotonicly in- or decreasing
+        The the housekeeping instance has to have a column called "Altitude" and which is monotonicly in- or decreasing.
+        Each layer is the average over the time between the first and the last time the altitude is within the layer.
+        All layers are averaged at once, the standard deviation and number of valid values of each layer are added to
+        the namespace of the layer series as data_std and data_count.
 
         Arguments
         ---------
         hk: housekeeping instance
-        layer_thickness (optional): [10] thickness of each generated layer in meter"""
+        layer_thickness (optional): [10] thickness of each generated layer in meter
+        force (optional): [False] if True a non monotonic altitude is accepted. Each line of the time series is then
+            assigned to the layer of the altitude interpolated to its time."""
         if any(np.isnan(hk.data.Altitude)):
             txt = """The Altitude contains nan values. Either fix this first, eg. with pandas interpolate function"""
             raise ValueError(txt)
 
-        if ((hk.data.Altitude.values[1:] - hk.data.Altitude.values[:-1]).min() < 0) and (
-                    (hk.data.Altitude.values[1:] - hk.data.Altitude.values[:-1]).max() > 0):
-            if force:
-                hk.data = hk.data.sort(columns='Altitude')
-            else:
-                txt = '''Given altitude data is not monotonic. This is not possible (yet). Use force if you
+        altitude = hk.data.Altitude.values
+        monotonic = not (((altitude[1:] - altitude[:-1]).min() < 0) and ((altitude[1:] - altitude[:-1]).max() > 0))
+        if not monotonic and not force:
+            txt = '''Given altitude data is not monotonic. This is not possible (yet). Use force if you
 know what you are doing'''
-                raise ValueError(txt)
+            raise ValueError(txt)
 
-        start_h = round(hk.data.Altitude.values.min() / layer_thickness) * layer_thickness
-        end_h = round(hk.data.Altitude.values.max() / layer_thickness) * layer_thickness
-
-        layer_edges = np.arange(start_h, end_h, layer_thickness)
-        empty_frame = pd.DataFrame(columns=self.data.columns)
-        lays = SizeDist_LS(empty_frame, self.bins, self.distributionType, None)
-
-        for e, end_h_l in enumerate(layer_edges[1:]):
-            start_h_l = layer_edges[e]
-            layer = hk.data.Altitude.iloc[
-                np.where(np.logical_and(start_h_l < hk.data.Altitude.values, hk.data.Altitude.values < end_h_l))]
-            start_t = layer.index.min()
-            end_t = layer.index.max()
-            dist_tmp = self.zoom_time(start=start_t, end=end_t)
-            avrg = dist_tmp.average_overAllTime()
-            # return avrg,lays
-            lays.add_layer(avrg, (start_h_l, end_h_l))
+        layer_edges = _get_layer_edges(altitude, layer_thickness)
+        no_of_layers = max(layer_edges.shape[0] - 1, 0)
+        if monotonic:
+            # each layer gets the lines between the first and the last time it is visited
+            first, last = _get_layer_time_ranges(_get_time_stamps(hk.data.index), altitude, layer_edges)
+            average, std, count = self._average_time_ranges(first, last)
+        else:
+            # layer of each line of the distribution from the altitude interpolated to its time
+            dist_altitude = np.interp(_get_time_stamps(self.index).astype(float),
+                                      _get_time_stamps(hk.data.index).astype(float), altitude)
+            layer = _get_layer(dist_altitude, layer_edges)
+            rows = np.where(layer >= 0)[0]
+            rows = rows[np.argsort(layer[rows], kind='stable')]
+            lengths = np.bincount(layer[rows], minlength=no_of_layers)
+            average, std, count = _average(self.values[rows], np.cumsum(lengths) - lengths)
+
+        return self._make_layerseries(hk, layer_edges, average, std, count)
+
+    def convert2layerseries_profiles(self, hk, layer_thickness=10, hysteresis=50):
+        """Detects the ascents and descents in the housekeeping (see atmos.timeseries.TimeSeries.get_profiles) and
+        converts each of them to a layer series (see convert2layerseries). The layers of all profiles are averaged in
+        one pass over the data.
+
+        Arguments
+        ---------
+        hk: housekeeping instance with the column "Altitude"
+        layer_thickness (optional): [10] thickness of each generated layer in meter
+        hysteresis (optional): [50] minimum change of altitude in meter which counts as a change of direction
+
+        Returns
+        -------
+        list of SizeDist_LS instances, one for each row of hk.get_profiles(hysteresis). The row is added to the
+        namespace of each layer series as profile.
+        """
+        if any(np.isnan(hk.data.Altitude)):
+            txt = """The Altitude contains nan values. Either fix this first, eg. with pandas interpolate function"""
+            raise ValueError(txt)
+
+        profiles = hk.get_profiles(hysteresis=hysteresis)
+        altitude = hk.data.Altitude.values
+        times = _get_time_stamps(hk.data.index)
+        turning_points = timeseries.get_turning_points(altitude, hysteresis)
+
+        layer_edges = []
+        first = []
+        last = []
+        for start, end in zip(turning_points[:-1], turning_points[1:]):
+            edges = _get_layer_edges(altitude[start:end + 1], layer_thickness)
+            first_p, last_p = _get_layer_time_ranges(times[start:end + 1], altitude[start:end + 1], edges)
+            layer_edges.append(edges)
+            first.append(first_p)
+            last.append(last_p)
+        if not layer_edges:
+            return []
+
+        average, std, count = self._average_time_ranges(np.concatenate(first), np.concatenate(last))
+        out = []
+        position = 0
+        for e, edges in enumerate(layer_edges):
+            lines = slice(position, position + first[e].shape[0])
+            position = lines.stop
+            hk_profile = hk.copy()
+            hk_profile.data = hk.data.iloc[turning_points[e]:turning_points[e + 1] + 1]
+            lays = self._make_layerseries(hk_profile, edges, average[lines], std[lines], count[lines])
+            lays.profile = profiles.iloc[e]
+            out.append(lays)
+        return out
+
+    def _average_time_ranges(self, first, last):
+        """Average, standard deviation, and count (see _average) of the lines between first and last (int64
+        nanoseconds) for each pair of first and last. Ranges may overlap."""
+        dist_times = _get_time_stamps(self.index)
+        starts = np.searchsorted(dist_times, first, side='left')
+        ends = np.maximum(np.searchsorted(dist_times, last, side='right'), starts)
+        lengths = ends - starts
+        offsets = np.cumsum(lengths) - lengths
+        rows = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        return _average(self.values[rows], offsets)
+
+    def _make_layerseries(self, hk, layer_edges, average, std, count):
+        """SizeDist_LS from the averages of each layer"""
+        lays = SizeDist_LS(None, self.bins, self.distributionType, None)
+        lays._set_values(average, np.arange(average.shape[0]))
+        lays.layerbounderies = np.array([layer_edges[:-1], layer_edges[1:]]).transpose()
+        lays._set_statistics(std, count)
         lays.parent_dist_TS = self
         lays.parent_timeseries = hk
 
@@ -1214,21 +1887,26 @@ class SizeDist_LS(SizeDist):
         # newlb = np.unique(self.layerbounderies.flatten()) # the unique is sorting the data, which is not reallyt what we want!
         # self.__layercenters = (newlb[1:] + newlb[:-1]) / 2.
         self.__layercenters = (self.layerbounderies[:,0] + self.layerbounderies[:,1]) / 2.
-        self.data.index = self.layercenters
+        self._set_index(self.layercenters)
 
-    def apply_hygro_growth(self, kappa, RH = None, how='shift_data'):
+    def apply_hygro_growth(self, kappa, RH = None, how='shift_data', curvature=False, temperature=298.15):
         """ see docstring of atmPy.sizedistribution.SizeDist for more information
         Parameters
         ----------
         kappa: float
         RH: bool, float, or array.
-            If None, RH from self.housekeeping will be taken"""
+            If None, RH from self.housekeeping will be taken
+        curvature: bool, optional
+            If True the curvature (Kelvin) effect is taken into account (hygroscopic_growth.kappa_koehler)
+        temperature: float or array, optional
+            temperature in K, only used if curvature is True"""
 
         if not np.any(RH):
             pandas_tools.ensure_column_exists(self.housekeeping.data, 'Relative_humidity')
             RH = self.housekeeping.data.Relative_humidity.values
         # return kappa,RH,how
-        sd = super(SizeDist_LS,self).apply_hygro_growth(kappa,RH,how = how)
+        sd = super(SizeDist_LS,self).apply_hygro_growth(kappa,RH,how = how, curvature=curvature,
+                                                       temperature=temperature)
         # size_distr = out['size_distribution']
         # gf = out['growth_factor']
         sd_LS = SizeDist_LS(sd.data, sd.bins, sd.distributionType, self.layerbounderies, fixGaps=False)
@@ -1237,7 +1915,7 @@ class SizeDist_LS(SizeDist):
         # out['size_distribution'] = sd_LS
         return sd_LS
 
-    def calculate_angstromex(self, wavelengths=[460.3, 550.4, 671.2, 860.7], n=1.455):
+    def calculate_angstromex(self, wavelengths=[460.3, 550.4, 671.2, 860.7], n=1.455, workers=1, chunksize=None):
         """Calculates the Anstrome coefficience (overall, layerdependent)
 
         Parameters
@@ -1246,6 +1924,10 @@ class SizeDist_LS(SizeDist):
             the angstrom coefficient will be calculated based on the AOD of these wavelength values (in nm)
         n:              float, optional.
             index of refraction used in the underlying mie calculation.
+        workers:        int, optional.
+            number of processes used for the mie calculation. None: number of CPUs.
+        chunksize:      int, optional.
+            number of particles per process pool job.
 
         Returns
         -------
@@ -1262,38 +1944,23 @@ class SizeDist_LS(SizeDist):
             angstrom exponent as a function of altitude
         """
 
-        AOD_list = []
-        AOD_dict = {}
-        for w in wavelengths:
-            AOD = self.calculate_optical_properties(w, n)  # calculate_AOD(wavelength=w, n=n)
-            #     opt= sizedistribution.OpticalProperties(AOD, dist_LS.bins)
-            AOD_list.append({'wavelength': w, 'opt_inst': AOD})
-            AOD_dict['%.1f' % w] = AOD
-
-        eg = AOD_dict[list(AOD_dict.keys())[0]]
-
-        wls = AOD_dict.keys()
-        wls_a = np.array(list(AOD_dict.keys())).astype(float)
-        ang_exp = []
-        ang_exp_std = []
-        ang_exp_r_value = []
-        for e, el in enumerate(eg.layercenters):
-            AODs = np.array([AOD_dict[wl].data_orig['AOD_layer'].values[e][0] for wl in wls])
-            slope, intercept, r_value, p_value, std_err = stats.linregress(np.log10(wls_a), np.log10(AODs))
-            ang_exp.append(-slope)
-            ang_exp_std.append(std_err)
-            ang_exp_r_value.append(r_value)
-        # break
-        ang_exp = np.array(ang_exp)
-        ang_exp_std = np.array(ang_exp_std)
-        ang_exp_r_value = np.array(ang_exp_r_value)
+        # only the AOD is needed, skip the angular scattering function
+        AOD_dict = self.calculate_spectral_optical_properties(wavelengths, n, workers=workers, chunksize=chunksize,
+                                                              products=('ext',))
+
+        wls = list(AOD_dict.keys())
+        wls_a = np.array(wls).astype(float)
+        AODs = np.array([AOD_dict[wl].data_orig['AOD_layer'].values[:, 0] for wl in wls]).transpose()
+        ang_exp, intercept, ang_exp_r_value, ang_exp_std = optical_kernel.fit_angstrom_exponent(wls_a, AODs)
 
         tmp = np.array([[float(i), AOD_dict[i].AOD] for i in AOD_dict.keys()])
         wavelength, AOD = tmp[np.argsort(tmp[:, 0])].transpose()
-        slope, intercept, r_value, p_value, std_err = stats.linregress(np.log10(wavelength), np.log10(AOD))
+        ang_exp_all, intercept, r_value, std_err = optical_kernel.fit_angstrom_exponent(wavelength, AOD)
+        slope = - ang_exp_all[0]
+        intercept = intercept[0]
 
         self.angstromexp = -slope
-        aod_fit = np.log10(wavelengths) * slope + intercept
+        aod_fit = np.log10(wavelength) * slope + intercept
         self.angstromexp_fit = pd.DataFrame(np.array([AOD, 10 ** aod_fit]).transpose(), index=wavelength,
                                             columns=['data', 'fit'])
 
@@ -1304,20 +1971,71 @@ class SizeDist_LS(SizeDist):
 
         return -slope, AOD_dict
 
-    def calculate_optical_properties(self, wavelength, n = None, noOfAngles=100):
-        if not n:
+    def calculate_optical_properties(self, wavelength, n = None, noOfAngles=100, n_grid=None,
+                                     products=optical_kernel.products_all, angles=None, mixing_state='homogeneous',
+                                     n_core=None, core_fraction=None):
+        if n is None:
             n = self.index_of_refraction
-        if not n:
+        if n is None:
             txt = 'Refractive index is not specified. Either set self.index_of_refraction or set optional parameter n.'
             raise ValueError(txt)
-        out = _calculate_optical_properties(self, wavelength, n, aod = True, noOfAngles=noOfAngles)
+        out = _calculate_optical_properties(self, wavelength, n, aod = True, noOfAngles=noOfAngles, n_grid=n_grid,
+                                            products=products, angles=angles, mixing_state=mixing_state,
+                                            n_core=n_core, core_fraction=core_fraction)
+        return self._make_optical_properties(out, wavelength, n)
+
+    def _make_optical_properties(self, out, wavelength, n):
         opt_properties = OpticalProperties(out, self.bins)
         opt_properties.wavelength = wavelength
         opt_properties.index_of_refractio = n
-        opt_properties.angular_scatt_func = out['angular_scatt_func']  # This is the formaer phase_fct, but since it is the angular scattering intensity, i changed the name
+        opt_properties.angular_scatt_func = out.get('angular_scatt_func')  # This is the formaer phase_fct, but since it is the angular scattering intensity, i changed the name
         opt_properties.parent_dist_LS = self
         return opt_properties
 
+    def calculate_spectral_optical_properties(self, wavelengths, n=None, noOfAngles=100, workers=1, chunksize=None,
+                                              products=optical_kernel.products_all, angles=None):
+        """Calculates the optical properties for multiple wavelengths in a single pass. The number concentration is
+        converted only once and the Mie calculation for all wavelengths is done in one batch.
+
+        Parameters
+        ----------
+        wavelengths: array-like
+            wavelengths in nm
+        n: float, optional.
+            index of refraction. If None self.index_of_refraction is used.
+        noOfAngles: int, optional.
+        workers: int, optional.
+            number of processes used for the mie calculation (see mie_parallel.MieExecutor). None: number of CPUs.
+        chunksize: int, optional.
+            number of particles per process pool job.
+        products, angles: optional.
+            see calculate_optical_properties
+
+        Returns
+        -------
+        dict: OpticalProperties instances with the wavelength ('%.1f') as keys
+        """
+        if n is None:
+            n = self.index_of_refraction
+        if n is None:
+            txt = 'Refractive index is not specified. Either set self.index_of_refraction or set optional parameter n.'
+            raise ValueError(txt)
+        if isinstance(n, pd.DataFrame):
+            txt = 'Row dependent index of refraction is not supported, use calculate_optical_properties.'
+            raise TypeError(txt)
+
+        sdls = self.convert2numberconcentration()
+        kernel = optical_kernel.SpectralOpticalKernel(sdls.bincenters, wavelengths, n, noOfAngles=noOfAngles,
+                                                      workers=workers, chunksize=chunksize, products=products,
+                                                      angles=angles)
+        opts = kernel.evaluate(sdls.values)
+
+        out = {}
+        for w, k, opt in zip(wavelengths, kernel.kernels, opts):
+            res = _assemble_optical_properties(sdls, opt, k.angles, w, n, aod=True)
+            out['%.1f' % w] = self._make_optical_properties(res, w, n)
+        return out
+
 
 
     def add_layer(self, sd, layerboundery):
@@ -1342,7 +2060,7 @@ class SizeDist_LS(SizeDist):
         if (np.where(layerbounderiesU == layerboundery[1])[0] - np.where(layerbounderiesU == layerboundery[0])[0])[
             0] != 1:
             raise ValueError('The new layer is overlapping with an existing layer!')
-        self.data = self.data.append(sd.data)
+        self._set_values(np.append(self.values, sd.values, axis=0), np.append(self.index, sd.index))
         self.layerbounderies = layerbounderies
         # self.layerbounderies.sort(axis=0)
         #
@@ -1600,9 +2318,8 @@ class SizeDist_LS(SizeDist):
 
     def zoom_altitude(self, bottom, top):
         """'2014-11-24 16:02:30'"""
-        dist = self.copy()
-        dist.data = dist.data.truncate(before=bottom, after=top)
-        where = np.where(np.logical_and(dist.layercenters < top, dist.layercenters > bottom))
+        where = self.index.slice_indexer(bottom, top)
+        dist = self._copy_with(rows=where)
         # dist.layercenters = dist.layercenters[where]
         dist.layerbounderies = dist.layerbounderies[where]
         if 'data_fit_normal' in dir(dist):
@@ -1628,10 +2345,22 @@ class SizeDist_LS(SizeDist):
 
 
 
-    def average_overAllAltitudes(self):
-        dataII = self.data.mean(axis=0)
-        out = pd.DataFrame(dataII).T
-        return SizeDist(out, self.bins, self.distributionType)
+    def average_overAllAltitudes(self, how='mean'):
+        """
+        averages over all layers and returns a single sizedistribution. nan values are ignored. The standard deviation
+        and the number of valid values of each bin are added to the namespace of the result as data_std and
+        data_count.
+
+        Arguments
+        ---------
+        how: str ['mean']. Optional
+            'mean' or 'median'
+        """
+        average, std, count = _average(self.values, how=how)
+        avgDist = SizeDist(None, self.bins, self.distributionType, fixGaps=False)
+        avgDist._set_values(average, pd.RangeIndex(1))
+        avgDist._set_statistics(std, count)
+        return avgDist
 
 
     def fit_normal(self):
@@ -1654,6 +2383,123 @@ class SizeDist_LS(SizeDist):
 #        return singleHist
 
 
+class LazySizeDist(object):
+    """ Lazy version of a SizeDist, SizeDist_TS, or SizeDist_LS instance (see SizeDist.lazy).
+
+    Operations are only recorded. compute executes them all at once after the recorded pipeline was optimized:
+    selections of rows (zoom_time, zoom_altitude) and columns (zoom_diameter) are moved in front of the conversions, so
+    only the selected part of the data is converted; rows are selected first, zoom_diameter is also moved in front of
+    average_overTime.
+    Consecutive conversions are fused into a single conversion (one multiplication by a per bin factor). Conversions
+    are not moved over averages. The composed factors round differently than the separate conversions, so the result
+    agrees with the one of the eager execution within floating-point tolerance only.
+
+    Every operation returns a new LazySizeDist instance, the recorded pipelines can therefore be branched.
+
+    Example
+    -------
+    >>> dist_avg = dist.lazy().zoom_time(start, end).convert2dVdlogDp().zoom_diameter(100, 1000).average_overTime('60s').compute()
+    """
+
+    def __init__(self, dist, operations=()):
+        self._dist = dist
+        self._operations = tuple(operations)
+
+    def __repr__(self):
+        return 'LazySizeDist(%s, %s)' % (type(self._dist).__name__, [i[0] for i in self._operations])
+
+    def _record(self, name, *args, **kwargs):
+        if name != 'convert' and not hasattr(self._dist, name):
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self._dist).__name__, name))
+        return LazySizeDist(self._dist, self._operations + ((name, args, kwargs),))
+
+    def convert2dNdDp(self):
+        return self._record('convert', 'dNdDp')
+
+    def convert2dNdlogDp(self):
+        return self._record('convert', 'dNdlogDp')
+
+    def convert2dSdDp(self):
+        return self._record('convert', 'dSdDp')
+
+    def convert2dSdlogDp(self):
+        return self._record('convert', 'dSdlogDp')
+
+    def convert2dVdDp(self):
+        return self._record('convert', 'dVdDp')
+
+    def convert2dVdlogDp(self):
+        return self._record('convert', 'dVdlogDp')
+
+    def convert2numberconcentration(self):
+        return self._record('convert', 'numberConcentration')
+
+    def zoom_diameter(self, start=None, end=None):
+        return self._record('zoom_diameter', start=start, end=end)
+
+    def zoom_time(self, start=None, end=None):
+        return self._record('zoom_time', start=start, end=end)
+
+    def zoom_altitude(self, bottom, top):
+        return self._record('zoom_altitude', bottom, top)
+
+    def average_overTime(self, window='1s', how='mean'):
+        return self._record('average_overTime', window=window, how=how)
+
+    def get_plan(self):
+        """The optimized list of operations (name, args, kwargs) which is executed by compute. Its result agrees with
+        the one of the recorded operations within floating-point tolerance (fused conversions round differently)."""
+        plan = []
+        for operation in self._operations:
+            name = operation[0]
+            # operations the selection can be moved in front of
+            if name in ('zoom_time', 'zoom_altitude'):
+                passes = ('convert', 'zoom_diameter')
+            elif name == 'zoom_diameter':
+                passes = ('convert', 'average_overTime')
+            else:
+                passes = ()
+            position = len(plan)
+            while position > 0 and plan[position - 1][0] in passes:
+                position -= 1
+            plan.insert(position, operation)
+
+        # consecutive conversions -> only the last one
+        fused = []
+        for operation in plan:
+            if operation[0] == 'convert' and fused and fused[-1][0] == 'convert':
+                fused[-1] = operation
+            else:
+                fused.append(operation)
+
+        # drop conversions into the current distribution type
+        plan = []
+        dist_type = self._dist.distributionType
+        for operation in fused:
+            if operation[0] == 'convert':
+                if operation[1][0] == dist_type:
+                    continue
+                dist_type = operation[1][0]
+            plan.append(operation)
+        return plan
+
+    def compute(self):
+        """Executes the recorded operations.
+
+        Returns
+        -------
+        Instance of the same class as the underlying size distribution. If no operation was recorded, this is a
+        shallow (copy on write) copy of it.
+        """
+        dist = self._dist._copy_with()
+        for name, args, kwargs in self.get_plan():
+            if name == 'convert':
+                dist = dist._convert2otherDistribution(*args, **kwargs)
+            else:
+                dist = getattr(dist, name)(*args, **kwargs)
+        return dist
+
+
 #Todo: bins are redundand
 # Todo: some functions should be switched of
 class OpticalProperties(object):
@@ -1664,7 +2510,7 @@ class OpticalProperties(object):
         self.AOD = data['AOD']
         self.bins = bins
         self.layercenters = self.data.index.values
-        self.asymmetry_parameter_LS = data['asymmetry_param']
+        self.asymmetry_parameter_LS = data.get('asymmetry_param')
         # self.asymmetry_parameter_LS_alt = data['asymmetry_param_alt']
 
         # ToDo: to define a distribution type does not really make sence ... just to make the stolen plot function happy
@@ -1918,52 +2764,22 @@ def _perform_Miecalculations(diam, wavelength, n, noOfAngles=100.):
 
     diam = np.asarray(diam)
 
-    extinction_efficiency = np.zeros(diam.shape)
-    scattering_efficiency = np.zeros(diam.shape)
-    absorption_efficiency = np.zeros(diam.shape)
-
-    extinction_crossection = np.zeros(diam.shape)
-    scattering_crossection = np.zeros(diam.shape)
-    absorption_crossection = np.zeros(diam.shape)
-
-    # phase_function_natural = pd.DataFrame()
-    angular_scattering_natural = pd.DataFrame()
-    # extinction_coefficient = np.zeros(diam.shape)
-    # scattering_coefficient = np.zeros(diam.shape)
-    # absorption_coefficient = np.zeros(diam.shape)
-
-
-
     # Function for calculating the size parameter for wavelength l and radius r
     sp = lambda r, l: 2. * np.pi * r / l
-    for e, d in enumerate(diam):
-        radius = d / 2.
-
-        # print('sp(radius, wavelength)', sp(radius, wavelength))
-        # print('n', n)
-        # print('d', d)
-
-        mie = bhmie.bhmie_hagen(sp(radius, wavelength), n, noOfAngles, diameter=d)
-        values = mie.return_Values_as_dict()
-        extinction_efficiency[e] = values['extinction_efficiency']
-
-        # print("values['extinction_crosssection']",values['extinction_crosssection'])
-
-
-        scattering_efficiency[e] = values['scattering_efficiency']
-        absorption_efficiency[e] = values['extinction_efficiency'] - values['scattering_efficiency']
-
-        extinction_crossection[e] = values['extinction_crosssection']
-        scattering_crossection[e] = values['scattering_crosssection']
-        absorption_crossection[e] = values['extinction_crosssection'] - values['scattering_crosssection']
+    # uses the persistent lookup table if it was switched on with mie_cache.enable()
+    mie = mie_cache.mie(sp(diam / 2., wavelength), n, noOfAngles, diameter=diam)
 
-        # phase_function_natural[d] = values['phaseFct_natural']['Phase_function_natural'].values
-        angular_scattering_natural[d] = mie.get_angular_scatt_func().natural.values
+    extinction_efficiency = mie.qext
+    scattering_efficiency = mie.qsca
+    absorption_efficiency = mie.qext - mie.qsca
 
-        # print('\n')
+    extinction_crossection = mie.cext
+    scattering_crossection = mie.csca
+    absorption_crossection = mie.cext - mie.csca
 
-    # phase_function_natural.index = values['phaseFct_natural'].index
-    angular_scattering_natural.index = mie.get_angular_scatt_func().index
+    angles, angular_scatt = mie.get_angular_scatt_func()
+    angular_scattering_natural = pd.DataFrame(angular_scatt.transpose(), index=angles, columns=diam)
+    angular_scattering_natural.index.name = 'angle'
 
     out = pd.DataFrame(index=diam)
     out['extinction_efficiency'] = pd.Series(extinction_efficiency, index=diam)
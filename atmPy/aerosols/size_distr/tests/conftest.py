@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from atmPy.aerosols.size_distr import sizedistribution
+
+
+@pytest.fixture
+def dist(request):
+    """SizeDist_TS with 30 bins and random values at one line per second. The number of lines defaults to 20 and can
+    be changed by indirect parametrization, e.g. @pytest.mark.parametrize('dist', [120], indirect=True)."""
+    rows = getattr(request, 'param', 20)
+    bins = np.logspace(2, np.log10(3000), 31)
+    index = pd.date_range('2015-01-01', periods=rows, freq='s')
+    data = pd.DataFrame(np.random.RandomState(0).rand(rows, 30) * 10, index=index)
+    return sizedistribution.SizeDist_TS(data, bins, 'dNdlogDp')
@@ -0,0 +1,72 @@
+import copy
+import gc
+import pickle
+
+import numpy as np
+
+from atmPy.aerosols.size_distr import bin_axis
+
+
+def test_shared_instances():
+    """
+    Equal bins give the same instance, also after copying and pickling.
+    """
+    bins = np.logspace(2, np.log10(3000), 31)
+    axis = bin_axis.get(bins)
+    assert bin_axis.get(bins.copy()) is axis
+    assert copy.deepcopy(axis) is axis
+    assert pickle.loads(pickle.dumps(axis)) is axis
+    assert axis != bin_axis.get(bins[1:])
+    assert hash(axis) == hash(bin_axis.BinAxis(bins))
+    assert not axis.edges.flags.writeable
+
+
+def test_conversion_factors():
+    """
+    Conversion factors are consistent with the definitions of the distribution types and are cached.
+    """
+    axis = bin_axis.get(np.logspace(2, np.log10(3000), 31))
+    dc = axis.centers
+
+    factor = axis.get_conversion_factor('dNdlogDp', 'dVdDp')
+    assert np.allclose(factor, np.pi / 6 * dc ** 3 / (dc * np.log(10)))
+    assert axis.get_conversion_factor('dNdlogDp', 'dVdDp') is factor
+    assert np.allclose(axis.get_conversion_factor('numberConcentration', 'dSdlogDp'),
+                       np.pi * dc ** 2 * dc * np.log(10) / axis.widths)
+    assert np.allclose(axis.get_conversion_factor('dSdDp', 'dVdlogDp') * axis.get_conversion_factor('dVdlogDp', 'dSdDp'),
+                       1)
+
+
+def test_overlap_matrix():
+    """
+    The content of each bin is distributed onto the bins it overlaps with, also over many bins.
+    """
+    axis_from = bin_axis.get([1., 2., 3.])
+    axis_to = bin_axis.get(np.arange(0., 11.))
+
+    matrix = bin_axis.get_overlap_matrix(axis_from, axis_to, 2.5)
+    assert matrix.shape == (10, 2)
+    assert np.allclose(matrix.toarray()[:, 0], [0, 0, 0.2, 0.4, 0.4, 0, 0, 0, 0, 0])
+    assert np.allclose(matrix.toarray()[:, 1], [0, 0, 0, 0, 0, 0.4, 0.4, 0.2, 0, 0])
+    assert bin_axis.get_overlap_matrix(axis_from, axis_to, 2.5) is matrix
+    assert np.allclose(bin_axis.get_overlap_matrix(axis_from, axis_to, 4.).toarray().sum(axis=0), [1, 0.5])
+
+
+def test_overlap_matrix_cache():
+    """
+    Cached matrices do not keep the axes alive, the cache is bounded, and scales which differ by rounding only share
+    the matrix.
+    """
+    axis_to = bin_axis.get(np.arange(0., 11.))
+    axis_from = bin_axis.get([1.5, 2.5, 3.5])
+    matrix = bin_axis.get_overlap_matrix(axis_from, axis_to, 1.1)
+    assert bin_axis.get_overlap_matrix(axis_from, axis_to, 1.1 + 1e-14) is matrix
+
+    for scale in np.linspace(1, 2, 2 * bin_axis.overlap_cache_size):
+        bin_axis.get_overlap_matrix(axis_from, axis_to, scale)
+    assert len(axis_from._overlap_matrices) == bin_axis.overlap_cache_size
+
+    key = axis_from._key
+    del axis_from, matrix
+    gc.collect()
+    assert key not in bin_axis._axes
@@ -0,0 +1,117 @@
+import warnings
+
+import numpy as np
+import scipy.optimize as optimization
+
+from atmPy.aerosols.size_distr import lognormal_fit
+from atmPy.tools import math_functions
+
+
+def _rows(no_of_rows=50):
+    rs = np.random.RandomState(0)
+    x = np.log10(np.logspace(2, np.log10(3000), 30))
+    truth = np.array([rs.uniform(5, 50, no_of_rows), rs.uniform(2.2, 2.8, no_of_rows),
+                      rs.uniform(0.08, 0.25, no_of_rows)]).transpose()
+    y = lognormal_fit.multi_gauss(x, truth) * (1 + 0.02 * rs.randn(no_of_rows, x.shape[0]))
+    return x, y, truth
+
+
+def test_fit_normal():
+    """
+    The batched fit has to give the same result as scipy's curve_fit, nan values are ignored and rows without data
+    give nan.
+    """
+    x, y, truth = _rows()
+    y[3, 5:9] = np.nan
+    y[4] = 0
+    y[5] = np.nan
+
+    params, converged = lognormal_fit.fit_normal(x, y)
+    assert not converged[4] and not converged[5]
+    assert np.all(np.isnan(params[[4, 5]]))
+    assert converged.sum() == y.shape[0] - 2
+
+    for row in (0, 3, 10):
+        valid = np.isfinite(y[row])
+        reference = optimization.curve_fit(math_functions.gauss, x[valid], y[row][valid], p0=truth[row])[0]
+        assert np.allclose(params[row], reference, rtol=1e-5)
+
+
+def test_moment_guess():
+    """
+    For a noise free normal distribution the moments are close to the parameters.
+    """
+    x, y, truth = _rows()
+    truth[:, 1] = 2.75
+    truth[:, 2] = np.linspace(0.05, 0.15, truth.shape[0])
+    y = lognormal_fit.multi_gauss(x, truth)
+    guess = lognormal_fit.get_moment_guess(x, y)
+    assert np.allclose(guess[:, 1], truth[:, 1], rtol=1e-2)
+    assert np.allclose(guess[:, 2], truth[:, 2], rtol=0.05)
+
+
+def test_fit_modes():
+    """
+    The number of well separated modes is found and the modes are sorted by position.
+    """
+    x = np.log10(np.logspace(1, 4, 60))
+    truth = np.full((3, 9), np.nan)
+    truth[0, :3] = [20, 2.2, 0.15]
+    truth[1, :6] = [10, 3.2, 0.12, 30, 1.7, 0.1]
+    truth[2] = [10, 3.3, 0.1, 30, 2.2, 0.12, 5, 1.4, 0.1]
+    # absent modes get no amplitude
+    y = lognormal_fit.multi_gauss(x, np.where(np.isnan(truth), np.tile([0., 0., 1.], 3), truth))
+    y += 0.1 * np.random.RandomState(0).randn(*y.shape)
+
+    params, no_of_modes, ic = lognormal_fit.fit_modes(x, y, max_modes=3, warm_start=False)
+    assert np.array_equal(no_of_modes, [1, 2, 3])
+    for row in range(3):
+        expected = truth[row].reshape(-1, 3)
+        expected = expected[np.argsort(expected[:, 1])].ravel()
+        valid = np.isfinite(expected)
+        assert np.array_equal(np.isfinite(params[row]), valid)
+        assert np.allclose(params[row][valid], expected[valid], rtol=0.05)
+    assert np.all(np.isfinite(ic))
+
+
+def test_add_mode_unfit_rows():
+    """
+    Rows whose fit failed get a nan guess without warnings, the others get a new mode at the largest residual.
+    """
+    x = np.log10(np.logspace(1, 4, 60))
+    params = np.array([[20, 2.2, 0.15], [np.nan, np.nan, np.nan]])
+    y = lognormal_fit.multi_gauss(x, np.array([[20, 2.2, 0.15, 10, 3.2, 0.12]] * 2))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        p0 = lognormal_fit._add_mode(x, y, params)
+    assert np.all(np.isnan(p0[1]))
+    assert np.allclose(p0[0, :3], params[0])
+    assert abs(p0[0, 4] - 3.2) < 0.1
+
+
+def test_fit_modes_bimodal():
+    """
+    Noisy, well separated bimodal rows are fitted with two modes with the default settings; chunks and workers do not
+    change the result.
+    """
+    rs = np.random.RandomState(0)
+    no_of_rows = 200
+    x = np.log10(np.logspace(1, 4, 60))
+    truth = np.array([rs.uniform(5, 20, no_of_rows), rs.uniform(1.4, 1.9, no_of_rows),
+                      rs.uniform(0.08, 0.15, no_of_rows), rs.uniform(5, 20, no_of_rows),
+                      rs.uniform(2.5, 3.2, no_of_rows), rs.uniform(0.08, 0.15, no_of_rows)]).transpose()
+    y = lognormal_fit.multi_gauss(x, truth) + 0.05 * rs.randn(no_of_rows, x.shape[0])
+
+    params, no_of_modes, ic = lognormal_fit.fit_modes(x, y, max_modes=2, min_modes=2)
+    assert np.all(no_of_modes == 2)
+    assert np.allclose(params[:, [1, 4]], truth[:, [1, 4]], atol=0.02)
+
+    params, no_of_modes, ic = lognormal_fit.fit_modes(x, y, max_modes=3)
+    assert np.all(no_of_modes >= 2)
+    assert np.mean(no_of_modes == 2) > 0.9
+
+    params_chunked, no_of_modes_chunked, ic_chunked = lognormal_fit.fit_modes(x, y, max_modes=3, chunksize=30,
+                                                                              workers=2)
+    assert np.array_equal(no_of_modes_chunked, no_of_modes)
+    assert np.array_equal(params_chunked, params, equal_nan=True)
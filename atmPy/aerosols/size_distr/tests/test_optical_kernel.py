@@ -0,0 +1,63 @@
+import numpy as np
+from scipy import integrate
+
+from atmPy.aerosols.size_distr import optical_kernel
+
+
+def _rows():
+    bincenters = np.logspace(2, np.log10(2000), 30)
+    numberconcentration = np.random.RandomState(0).rand(12, 30)
+    n = 1.35 + 0.1 * np.random.RandomState(1).rand(12) + 0.001j
+    n[::3] = 1.45 + 0.001j
+    return bincenters, numberconcentration, n
+
+
+def test_row_dependent_n_grouped():
+    """
+    Grouping rows with the same index of refraction has to give the same result as one kernel per row.
+    """
+    bincenters, cn, n = _rows()
+    out, angles, kernel = optical_kernel.evaluate_row_dependent_n(bincenters, 550., n, cn, noOfAngles=20)
+    assert kernel is None
+    for i in range(cn.shape[0]):
+        row = optical_kernel.OpticalKernel(bincenters, 550., n[i], noOfAngles=20).evaluate(cn[i:i + 1])
+        for key in ('extCoeff_perrow', 'scattCoeff_perrow', 'absCoeff_perrow', 'asymmetry_param'):
+            assert np.allclose(out[key][i], row[key][0], rtol=1e-12, atol=0)
+        assert np.allclose(out['angular_scatt_func'][:, i], row['angular_scatt_func'][:, 0], rtol=1e-12, atol=0)
+
+
+def test_row_dependent_n_grid():
+    """
+    The interpolated optical properties have to be within the estimated error bound.
+    """
+    bincenters, cn, n = _rows()
+    out, angles, kernel = optical_kernel.evaluate_row_dependent_n(bincenters, 550., n, cn, noOfAngles=20, n_grid=15)
+    exact, angles, _ = optical_kernel.evaluate_row_dependent_n(bincenters, 550., n, cn, noOfAngles=20)
+    error = kernel.error_estimate
+    assert error['extinction'] < 0.05
+    rel = np.abs(out['extCoeff_perrow'] - exact['extCoeff_perrow']) / exact['extCoeff_perrow']
+    assert rel.max() < error['extinction']
+    rel = np.abs(out['scattCoeff_perrow'] - exact['scattCoeff_perrow']) / exact['scattCoeff_perrow']
+    assert rel.max() < error['scattering']
+
+
+def test_products():
+    """
+    Leaving out the angular scattering function must not change the other optical properties. The asymmetry parameter
+    has to agree with the angular quadrature of the angular scattering function (trapezoidal rule, 200 angles between 0
+    and pi, error < 1e-3).
+    """
+    bincenters, cn, n = _rows()
+    full = optical_kernel.OpticalKernel(bincenters, 550., n[1], noOfAngles=200)
+    full_out = full.evaluate(cn)
+    fast = optical_kernel.OpticalKernel(bincenters, 550., n[1], products=('ext', 'g')).evaluate(cn)
+    assert 'angular_scatt_func' not in fast
+    assert 'scattCoeff_perrow' not in fast
+    assert np.allclose(full_out['extCoeff_perrow'], fast['extCoeff_perrow'], rtol=1e-12, atol=0)
+
+    forward = full.angles <= np.pi
+    angles = full.angles[forward]
+    weighted = full_out['angular_scatt_func'][forward] * np.sin(angles)[:, np.newaxis]
+    g = (integrate.trapezoid(weighted * np.cos(angles)[:, np.newaxis], angles, axis=0)
+         / integrate.trapezoid(weighted, angles, axis=0))
+    np.testing.assert_allclose(fast['asymmetry_param'], g, rtol=1e-3)
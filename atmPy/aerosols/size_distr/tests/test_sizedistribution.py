@@ -0,0 +1,343 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from atmPy.aerosols.size_distr import sizedistribution
+
+
+def test_lazy_data_view(dist):
+    """
+    The DataFrame is a view on the values array; changes in either direction have to be visible in the other.
+    """
+    assert dist._frame is None
+    assert dist.data.columns[0] == '100-112'
+    assert np.shares_memory(dist.data.values, dist.values)
+
+    dist.data.iloc[0, 0] = -1.
+    assert dist.values[0, 0] == -1.
+
+    dist.data.loc[dist.index[-1] + pd.Timedelta(1, 's')] = np.zeros(30)
+    assert dist.values.shape == (21, 30)
+    assert dist.index.shape == (21,)
+
+
+def test_conversion(dist):
+    """
+    Conversions are done on the arrays and have to be consistent with the definitions of the distribution types.
+    """
+    dc = dist.bincenters
+    dNdDp = dist.values / (dc * np.log(10))
+
+    assert np.allclose(dist.convert2dNdDp().values, dNdDp)
+    assert np.allclose(dist.convert2dVdlogDp().values, dist.values * np.pi / 6 * dc ** 3)
+    assert np.allclose(dist.convert2numberconcentration().values, dNdDp * dist.binwidth)
+    assert np.allclose(dist.convert2dSdDp().convert2numberconcentration().convert2dNdlogDp().values, dist.values)
+
+    zoomed = dist.zoom_diameter(200, 1000).zoom_time(dist.index[3], dist.index[10])
+    assert zoomed.values.shape == (8, zoomed.bins.shape[0] - 1)
+    assert np.array_equal(zoomed.data.values, dist.data.loc[dist.index[3]:dist.index[10], zoomed.data.columns].values)
+
+    assert np.allclose((dist * 2 - dist).values, dist.values)
+
+
+def test_copy_on_write(dist):
+    """
+    Derived instances share the values with their parent until one of them changes them.
+    """
+    dist.data_fit_normal = pd.DataFrame({'Pos': np.arange(20.)})
+    reference = dist.values.copy()
+
+    zoomed = dist.zoom_time(dist.index[2], dist.index[9])
+    converted = dist.convert2dNdDp().convert2dVdlogDp()
+    assert np.shares_memory(zoomed.values, dist.values)
+    assert converted._values is dist._values
+    assert converted.binaxis is dist.binaxis
+    assert dist.copy().binaxis is dist.binaxis
+
+    zoomed.data.iloc[0, 0] = -1.
+    zoomed.data_fit_normal.iloc[0, 0] = -1.
+    assert zoomed.values[0, 0] == -1.
+    assert np.array_equal(dist.values, reference)
+    assert dist.data_fit_normal.iloc[0, 0] == 0
+
+    dist.data.iloc[0, 0] = -1.
+    assert dist.values[0, 0] == -1.
+    assert np.allclose(converted.values, reference * np.pi / 6 * dist.bincenters ** 3)
+    assert dist.copy().values.flags.writeable
+
+
+@pytest.mark.parametrize('dist', [120], indirect=True)
+def test_lazy(dist):
+    """
+    The lazy pipeline is reordered and fused but has to agree with the eager execution within floating-point
+    tolerance.
+    """
+    start, end = dist.index[10], dist.index[100]
+
+    eager = dist.convert2dNdDp().convert2dVdDp().zoom_time(start, end).zoom_diameter(200, 1000).average_overTime('10s')
+    eager = eager.convert2dVdlogDp()
+    lazy = dist.lazy().convert2dNdDp().convert2dVdDp().zoom_time(start, end).zoom_diameter(200, 1000)
+    lazy = lazy.average_overTime('10s').convert2dVdlogDp()
+
+    assert [i[0] for i in lazy.get_plan()] == ['zoom_time', 'zoom_diameter', 'convert', 'average_overTime', 'convert']
+    result = lazy.compute()
+    assert type(result) is type(dist)
+    assert result.distributionType == 'dVdlogDp'
+    assert np.array_equal(result.bins, eager.bins)
+    assert np.array_equal(result.index, eager.index)
+    np.testing.assert_allclose(result.values, eager.values, rtol=1e-12)
+
+    assert dist.lazy().convert2dVdDp().convert2dNdlogDp().get_plan() == []
+
+
+def test_fill_gaps():
+    """
+    Each gap gets a line of zeros after its start and before its end; the gap mask marks the lines before the gaps.
+    """
+    bins = np.logspace(2, np.log10(3000), 31)
+    index = pd.date_range('2015-01-01', periods=20, freq='s').delete([5, 6, 12])
+    data = pd.DataFrame(np.ones((17, 30)), index=index)
+
+    dist = sizedistribution.SizeDist_TS(data, bins, 'dNdlogDp', fixGaps=False)
+    assert np.array_equal(np.where(dist.get_gap_mask())[0], [4, 9])
+
+    with pytest.warns(UserWarning):
+        dist.fillGaps()
+    assert dist.values.shape == (21, 30)
+    assert dist.index.is_monotonic_increasing
+    zeros = dist.index[dist.values.sum(axis=1) == 0]
+    assert zeros.equals(pd.DatetimeIndex(['2015-01-01 00:00:05.100', '2015-01-01 00:00:05.900',
+                                          '2015-01-01 00:00:11.900', '2015-01-01 00:00:12.100']))
+
+
+def test_moments():
+    """
+    Median diameters of a log normal distribution agree with the analytic values (Hatch-Choate).
+    """
+    bins = np.logspace(0, 5, 501)
+    centers = np.log10((bins[1:] + bins[:-1]) / 2)
+    sigma = 0.2
+    data = pd.DataFrame([np.exp(-(centers - np.log10(200)) ** 2 / (2 * sigma ** 2)), np.zeros(500)])
+    dist = sizedistribution.SizeDist(data, bins, 'dNdlogDp', fixGaps=False)
+
+    moments = dist.moments(density=2.)
+    assert np.isclose(moments['Number'][0], dist.get_particle_concentration().iloc[0, 0])
+    assert np.isclose(moments['CMD'][0], 200, rtol=1e-3)
+    assert np.isclose(moments['VMD'][0], 10 ** (np.log10(200) + 3 * np.log(10) * sigma ** 2), rtol=1e-3)
+    assert np.isclose(moments['Mass'][0], moments['Volume'][0] * 2e-9)
+    assert np.isnan(moments['CMD'][1])
+
+    percentiles = dist.percentiles(q=(16, 50, 84))
+    assert list(percentiles.columns) == ['D16', 'D50', 'D84']
+    assert np.isclose(percentiles['D50'][0], moments['CMD'][0])
+    assert np.allclose(np.log10(percentiles.iloc[0, [0, 2]].values), np.log10(200) + np.array([-sigma, sigma]),
+                       atol=2e-3)
+
+
+@pytest.mark.parametrize('dist', [4], indirect=True)
+def test_hygro_growth_shift_data(dist):
+    """
+    Growing the particles by more than a bin moves them into the right bins and conserves their number.
+    """
+    dist.index_of_refraction = 1.5
+    rh = np.array([0., 50., 90., 50.])
+    grown = dist.apply_hygro_growth(np.full(4, 1.), rh, how='shift_data')
+    gf = grown.growth_factor.values[:, 0]
+    assert gf[2] > (dist.bins[1] / dist.bins[0]) ** 5
+
+    assert np.allclose(grown.values[0, :30], dist.values[0])
+    assert np.allclose(grown.convert2numberconcentration().values.sum(axis=1),
+                       dist.convert2numberconcentration().values.sum(axis=1))
+    mean = (grown.convert2numberconcentration().values * grown.bincenters).sum(axis=1)
+    mean_dry = (dist.convert2numberconcentration().values * dist.bincenters).sum(axis=1)
+    assert np.allclose(mean, mean_dry * gf, rtol=1e-2)
+
+    # repeated growth factors are redistributed by one matrix each, with the same result as line by line
+    gf = np.array([1.1, 1.2, 1.1, 1.2])
+    values, bins = dist._hygro_growth_shift_data(gf)
+    values_lines, bins_lines = dist._hygro_growth_shift_data(gf[:, np.newaxis] * np.ones(dist.bins.shape))
+    assert np.array_equal(bins, bins_lines)
+    assert np.allclose(values, values_lines)
+
+
+@pytest.mark.parametrize('dist', [3], indirect=True)
+def test_hygro_growth_curvature(dist):
+    """
+    With the curvature effect small particles grow less than large ones; the number of particles is conserved.
+    """
+    dist.index_of_refraction = 1.5
+    kappa = np.full(3, 0.5)
+    rh = np.array([50., 85., 85.])
+    simple = dist.apply_hygro_growth(kappa, rh, how='shift_data')
+    grown = dist.apply_hygro_growth(kappa, rh, how='shift_data', curvature=True)
+
+    number = dist.convert2numberconcentration().values.sum(axis=1)
+    assert np.allclose(grown.convert2numberconcentration().values.sum(axis=1), number)
+    assert np.all(grown.growth_factor.values < simple.growth_factor.values)
+    assert grown.growth_factor.values[0, 0] < grown.growth_factor.values[1, 0]
+
+    grown = dist.apply_hygro_growth(0.5, 85., curvature=True)
+    assert np.all(np.diff(grown.bins / dist.bins) > 0)
+    assert np.allclose(grown.convert2numberconcentration().values.sum(axis=1), number)
+
+
+@pytest.mark.parametrize('dist', [3], indirect=True)
+def test_hygro_growth_curvature_layerseries(dist):
+    """
+    Layer series take the curvature effect into account too and stay layer series.
+    """
+    layers = sizedistribution.SizeDist_LS(dist.data, dist.bins, 'dNdlogDp', np.array([[0, 10], [10, 20], [20, 30]]))
+    layers.index_of_refraction = 1.5
+    kappa = np.full(3, 0.5)
+    rh = np.array([50., 85., 85.])
+    simple = layers.apply_hygro_growth(kappa, rh)
+    grown = layers.apply_hygro_growth(kappa, rh, curvature=True, temperature=288.15)
+
+    assert type(grown) is sizedistribution.SizeDist_LS
+    assert np.array_equal(grown.layerbounderies, layers.layerbounderies)
+    assert np.all(grown.growth_factor.values < simple.growth_factor.values)
+    assert np.allclose(grown.convert2numberconcentration().values.sum(axis=1),
+                       layers.convert2numberconcentration().values.sum(axis=1))
+
+
+def test_rebin(dist):
+    """
+    Rebinning conserves the chosen quantity within the common range; new bins outside of the old ones are nan.
+    """
+    number = dist.convert2numberconcentration().values.sum(axis=1)
+
+    rebinned = dist.rebin(np.logspace(2, np.log10(3000), 13))
+    assert rebinned.values.shape == (20, 12)
+    assert rebinned.distributionType == 'dNdlogDp'
+    assert np.allclose(rebinned.convert2numberconcentration().values.sum(axis=1), number)
+
+    volume = dist.moments()['Volume'].values
+    rebinned = dist.rebin(np.append(50, np.linspace(100, 3000, 40)), conserve='volume', log=False)
+    assert np.all(np.isnan(rebinned.values[:, 0]))
+    assert np.allclose(rebinned.zoom_diameter(100, 3000).moments()['Volume'].values, volume)
+
+    assert np.allclose(dist.rebin(dist.bins).values, dist.values)
+
+
+def test_merge():
+    """
+    Instruments with overlapping size ranges and different time resolutions are blended onto one grid.
+    """
+    def instrument(bins, freq, periods, value):
+        index = pd.date_range('2015-01-01', periods=periods, freq=freq)
+        return sizedistribution.SizeDist_TS(pd.DataFrame(np.full((periods, bins.shape[0] - 1), value), index=index),
+                                            bins, 'dNdlogDp', fixGaps=False)
+
+    small = instrument(np.logspace(1, 3, 21), '10s', 6, 10.)
+    large = instrument(np.logspace(2, 4, 11), '1s', 60, 20.)
+    large.data.iloc[30, 5] = np.nan
+    bins = np.logspace(1, 4, 31)
+    merged = sizedistribution.merge([small, large], bins=bins, weights=[1., 3.], chunksize=7)
+
+    assert type(merged) is sizedistribution.SizeDist_TS
+    assert merged.index.equals(large.index)
+    # the number conversion of dNdlogDp uses the arithmetic bin centers, hence the tolerance
+    assert np.allclose(merged.values[:, :10], 10., rtol=0.02)
+    assert np.allclose(merged.values[:, 20:][~np.isnan(merged.values[:, 20:])], 20., rtol=0.02)
+    assert np.isnan(merged.values[30, 20:]).sum() == 2
+    assert np.allclose(merged.values[:, 10:20], (10. + 3 * 20.) / 4, rtol=0.02)
+
+
+@pytest.mark.parametrize('dist', [120], indirect=True)
+def test_average(dist):
+    """
+    Averages ignore nan values and agree with pandas, also for the standard deviation and the number of values.
+    """
+    dist.data.iloc[::7, 3] = np.nan
+    dist.data.iloc[40:60, 5] = np.nan
+    resampled = dist.data.resample('20s', closed='right', label='right')
+
+    average = dist.average_overTime('20s')
+    assert np.allclose(average.values, resampled.mean().values, equal_nan=True)
+    assert np.allclose(average.data_std.values, resampled.std().values, equal_nan=True)
+    assert np.array_equal(average.data_count.values, resampled.count().values)
+    assert np.allclose(dist.average_overTime('20s', how='median').values, resampled.median().values, equal_nan=True)
+
+    average = dist.average_overAllTime()
+    assert np.allclose(average.values[0], dist.data.mean().values)
+    assert np.allclose(average.data_std.values[0], dist.data.std().values)
+    assert np.array_equal(average.data_count.values[0], dist.data.count().values)
+
+
+@pytest.mark.parametrize('dist', [120], indirect=True)
+def test_average_statistics_follow(dist):
+    """
+    Conversions and selections of an average are applied to its standard deviation and number of values too, also
+    in the lazy pipeline.
+    """
+    average = dist.average_overTime('20s')
+    start, end = average.index[1], average.index[4]
+
+    converted = average.convert2dVdlogDp()
+    factor = converted.values / average.values
+    assert np.allclose(converted.data_std.values, average.data_std.values * factor, equal_nan=True)
+    assert np.array_equal(converted.data_count.values, average.data_count.values)
+
+    zoomed = converted.zoom_diameter(200, 1000).zoom_time(start, end)
+    assert zoomed.data_std.shape == zoomed.data.shape == zoomed.data_count.shape
+    assert zoomed.data_std.columns.equals(zoomed.data.columns)
+    assert zoomed.data_std.index.equals(zoomed.data.index)
+    columns = average.data.columns.get_indexer(zoomed.data.columns)
+    assert np.allclose(zoomed.data_std.values, converted.data_std.loc[start:end].values[:, columns], equal_nan=True)
+
+    lazy = dist.lazy().average_overTime('20s').convert2dVdlogDp().zoom_diameter(200, 1000).zoom_time(start, end)
+    result = lazy.compute()
+    np.testing.assert_allclose(result.data_std.values, zoomed.data_std.values, rtol=1e-12)
+    assert np.array_equal(result.data_count.values, zoomed.data_count.values)
+
+    assert not hasattr(average + average, 'data_std')
+
+
+@pytest.mark.parametrize('dist', [120], indirect=True)
+def test_convert2layerseries(dist):
+    """
+    Each layer is the average of the lines between the first and the last time the altitude is within the layer.
+    """
+    from atmPy.atmos import timeseries
+
+    dist.data.iloc[::5, 2] = np.nan
+    altitude = np.linspace(1, 119, 120)
+    hk = timeseries.TimeSeries(pd.DataFrame({'Altitude': altitude}, index=dist.index))
+
+    layers = dist.convert2layerseries(hk, layer_thickness=20)
+    assert type(layers) is sizedistribution.SizeDist_LS
+    assert np.array_equal(layers.layerbounderies, [[0, 20], [20, 40], [40, 60], [60, 80], [80, 100]])
+    for e, (bottom, top) in enumerate(layers.layerbounderies):
+        lines = dist.data[(altitude > bottom) & (altitude < top)]
+        assert np.allclose(layers.values[e], lines.mean().values)
+        assert np.allclose(layers.data_std.values[e], lines.std().values)
+        assert np.array_equal(layers.data_count.values[e], lines.count().values)
+
+
+@pytest.mark.parametrize('dist', [300], indirect=True)
+def test_convert2layerseries_profiles(dist):
+    """
+    Ascents and descents are found despite noise smaller than the hysteresis, and each profile gives the same layer
+    series as convert2layerseries on the profile alone.
+    """
+    from atmPy.atmos import timeseries
+
+    altitude = np.concatenate((np.linspace(0, 500, 100), np.linspace(500, 100, 120), np.linspace(100, 400, 80)))
+    noisy = altitude + np.random.RandomState(1).uniform(-10, 10, altitude.shape)
+    assert np.array_equal(timeseries.get_turning_points(noisy, 50), [0, 99, 219, 299])
+    assert timeseries.get_turning_points(noisy, 600).shape[0] == 0
+
+    hk = timeseries.TimeSeries(pd.DataFrame({'Altitude': altitude}, index=dist.index))
+    profiles = hk.get_profiles()
+    assert list(profiles.Direction) == ['ascent', 'descent', 'ascent']
+
+    points = timeseries.get_turning_points(altitude, 50)
+    layer_series = dist.convert2layerseries_profiles(hk, layer_thickness=50)
+    assert len(layer_series) == 3
+    for layers, start, end in zip(layer_series, points[:-1], points[1:]):
+        hk_profile = timeseries.TimeSeries(hk.data.iloc[start:end + 1])
+        single = dist.convert2layerseries(hk_profile, layer_thickness=50)
+        assert np.array_equal(layers.layerbounderies, single.layerbounderies)
+        assert np.allclose(layers.values, single.values)
+        assert np.array_equal(layers.data_count.values, single.data_count.values)
+        assert layers.profile.Start == hk.data.index[start]
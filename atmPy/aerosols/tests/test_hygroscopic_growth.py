@@ -0,0 +1,29 @@
+import numpy as np
+
+from atmPy.aerosols import hygroscopic_growth as hg
+
+
+def test_kappa_koehler():
+    """
+    The growth factors solve the kappa-Koehler equation, approach kappa_simple for large particles, and the
+    tabulated solution agrees with the direct one.
+    """
+    kappa = 0.6
+    RH = np.array([0., 30., 80., 95., 99.5])[:, np.newaxis]
+    d_dry = np.logspace(0.5, 4, 2000)
+
+    gf = hg.kappa_koehler(kappa, RH, d_dry, T=290., tabulated=False)
+    assert gf.shape == (5, 2000)
+    assert np.all(gf[0] == 1)
+
+    d_wet = gf * d_dry
+    saturation = ((d_wet ** 3 - d_dry ** 3) / (d_wet ** 3 - d_dry ** 3 * (1 - kappa))
+                  * np.exp(hg._kelvin_diameter(290.) / d_wet))
+    assert np.allclose(saturation[1:], RH[1:] / 100., rtol=1e-10)
+    assert np.all(np.diff(gf[1:], axis=1) > 0)
+    assert np.allclose(gf[:, -1], hg.kappa_simple(kappa, RH[:, 0]), rtol=5e-3)
+
+    assert np.allclose(hg.kappa_koehler(kappa, RH, d_dry, T=290.), gf, rtol=1e-4)
+    gf, n_mix = hg.kappa_koehler(np.array([0, kappa]), 90., 100., n=1.5)
+    assert gf[0] == 1 and gf[1] > 1
+    assert n_mix[0] == 1.5 and 1.33 < n_mix[1] < 1.5
@@ -3,9 +3,6 @@ from copy import deepcopy
 import numpy as np
 import pandas as pd
 import pylab as plt
-from geopy.distance import vincenty
-from mpl_toolkits.basemap import Basemap
-from mpl_toolkits.mplot3d import Axes3D
 
 from atmPy.radiation import solar
 from atmPy.tools import time_tools
@@ -49,6 +46,54 @@ def load_csv(fname):
     return TimeSeries(data)
 
 
+def get_turning_points(altitude, hysteresis):
+    """Positions at which the altitude changes from ascending to descending or vice versa. Changes of direction smaller
+    than hysteresis are ignored (e.g. noise or a short dip during an ascent).
+
+    Arguments
+    ---------
+    altitude: array-like.
+    hysteresis: float.
+        Minimum change of altitude between two turning points.
+
+    Returns
+    -------
+    array of int. Positions of the turning points including the first and the last position, so each pair of
+    consecutive positions is the start and the end of a profile. Empty if the altitude changes by less than
+    hysteresis.
+    """
+    altitude = np.asarray(altitude, dtype=float)
+    empty = np.array([], dtype=int)
+    if altitude.shape[0] < 2:
+        return empty
+    direction = np.sign(np.diff(altitude))
+    changing = np.where(direction != 0)[0]
+    if changing.shape[0] == 0:
+        return empty
+    # flat parts continue in the last direction
+    last_change = np.maximum.accumulate(np.where(direction != 0, np.arange(direction.shape[0]), changing[0]))
+    direction = direction[last_change]
+    points = np.concatenate(([0], np.where(np.diff(direction) != 0)[0] + 1, [altitude.shape[0] - 1]))
+
+    while True:
+        change = np.abs(np.diff(altitude[points]))
+        small = change < hysteresis
+        if not small.any():
+            return points
+        if points.shape[0] == 2:
+            return empty
+        # remove the smallest segments first; segments within two of each other are not removed at the same time,
+        # so the segment between them survives
+        padded = np.concatenate(([np.inf, np.inf], change, [np.inf, np.inf]))
+        remove = (small & (change <= padded[:-4]) & (change <= padded[1:-3])
+                  & (change < padded[3:-1]) & (change < padded[4:]))
+        segments = np.where(remove)[0]
+        # an inner segment is merged with both its neighbours, the first and the last segment with their neighbour
+        drop = np.concatenate((segments[(segments > 0)], segments[segments < change.shape[0] - 1] + 1))
+        drop = drop[(drop > 0) & (drop < points.shape[0] - 1)]
+        points = np.delete(points, drop)
+
+
 class TimeSeries(object):
     """
     This class simplifies the handling of housekeeping information from measurements.
@@ -141,6 +186,10 @@ class TimeSeries(object):
         three_d: bool.
             If flight path is plotted in 3D. unfortunately this does not work very well (only costlines)
         """
+        # optional dependencies, only needed for plotting maps
+        from geopy.distance import vincenty
+        from mpl_toolkits.basemap import Basemap
+        from mpl_toolkits.mplot3d import Axes3D
 
         data = self.data.copy()
         data = data.loc[:, ['Lon', 'Lat']]
@@ -250,6 +299,31 @@ class TimeSeries(object):
         else:
             return
 
+    def get_profiles(self, hysteresis=50):
+        """ Finds the ascents and descents in the column "Altitude", see get_turning_points.
+
+        Arguments
+        ---------
+        hysteresis (optional):  float - minimum change of altitude in meter which counts as a change of direction
+
+        Returns
+        -------
+        pandas DataFrame with one row for each profile and the columns Start, End (timestamps), Direction ('ascent' or
+        'descent'), Altitude_start, and Altitude_end
+        """
+        altitude = self.data.Altitude.values
+        if np.any(np.isnan(altitude)):
+            raise ValueError('The Altitude contains nan values. Fix this first, eg. with pandas interpolate function')
+        points = get_turning_points(altitude, hysteresis)
+        start = points[:-1]
+        end = points[1:]
+        profiles = pd.DataFrame({'Start': self.data.index[start],
+                                 'End': self.data.index[end],
+                                 'Direction': np.where(altitude[end] > altitude[start], 'ascent', 'descent'),
+                                 'Altitude_start': altitude[start],
+                                 'Altitude_end': altitude[end]})
+        return profiles
+
     def plot_versus_pressure_sep_axes(self, what):
         what = self.data[what]
 
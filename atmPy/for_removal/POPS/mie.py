@@ -25,7 +25,11 @@ import pylab as plt
 from scipy.interpolate import interp1d
 
 from atmPy.for_removal.POPS import tools
-from atmPy.for_removal.mie import bhmie
+from atmPy.for_removal.mie import bhmie, mie_aux, mie_batch, mie_cache
+
+# detection weights per geometry and response curves per geometry, material and wavelength spectrum
+_detection_weights = {}
+_response_curves = mie_aux.Cache(size=64)
 
 
 ###########################
@@ -40,7 +44,9 @@ def makeMie_diameter(radiusRangeInMikroMeter = [0.05,1.5],
             mirrorJetDist = 10.,
             scale = 'log',
             #below: added 20141030
-            broadened = False
+            broadened = False,
+            workers = 1,
+            chunksize = None
             ):
     """
     Performs mie calculations as a function of particle radius
@@ -56,6 +62,11 @@ def makeMie_diameter(radiusRangeInMikroMeter = [0.05,1.5],
                {'style': 'custom',
                  'spectrum': (wl,intens),
                  'interpolate': 100}
+    workers: int
+        number of processes used for the mie calculations of all wavelengths and diameters (see
+        atmPy.for_removal.mie.mie_parallel). None: number of CPUs.
+    chunksize: int
+        number of particles per process pool job.
 
     Returns
     -------
@@ -73,15 +84,11 @@ def makeMie_diameter(radiusRangeInMikroMeter = [0.05,1.5],
     elif scale == 'log_20':
         dRange = np.logspace(np.log10(radiusRangeInMikroMeter[0]),np.log10(radiusRangeInMikroMeter[1]),noOfdiameters,base = 100) #radius range 
         
-    event = Mie(silent = True, design = POPSdesign, indexOfRef = IOR, diameter = 'dynamic') # Ref. for indexOfRef.  Patterson 2004
-    event.set_nang(noOfAngles)
-    event.POPSdimensions['mirror(top)-jet distance (mm)'] = float(mirrorJetDist)
-    
     singleLine = False
     
     if isinstance(WavelengthInUm,float):
         exWavelengthInUm=np.array([WavelengthInUm])
-    elif isinstance(WavelengthInUm,types.ListType):
+    elif isinstance(WavelengthInUm,list):
         exWavelengthInUm=np.array(WavelengthInUm)
     else:
         exWavelengthInUm = WavelengthInUm
@@ -113,16 +120,15 @@ def makeMie_diameter(radiusRangeInMikroMeter = [0.05,1.5],
     if len(exWavelengthInUm) == 1:
         singleLine = True
         
+    # all wavelengths and diameters in one (parallel) batch
+    intensities = get_response_curves(2 * dRange, exWavelengthInUm, IOR = IOR, design = POPSdesign,  # Ref. for indexOfRef.  Patterson 2004
+                                      mirrorJetDist = mirrorJetDist, noOfAngles = noOfAngles,
+                                      polarization = geometry, workers = workers, chunksize = chunksize)
+
     output = np.zeros((exWavelengthInUm.shape[0]+1,dRange.shape[0]))
     for e,i in enumerate(exWavelengthInUm):
-        event.set_wavelength(i)
-        perpInt = []
-        for i in dRange:
-            event.set_r(i)
-            intensity =  event.get_detectableIntensity(geometry)
-            perpInt.append(intensity)
         diameter = np.array(2 * np.array(dRange))
-        scatteringEfficiency = np.array(perpInt)
+        scatteringEfficiency = intensities[e]
 #         if broadened:     
         output[0]+= normalizer[e] * scatteringEfficiency/normalizer.sum()
         if len(exWavelengthInUm) == 1:
@@ -137,6 +143,79 @@ def makeMie_diameter(radiusRangeInMikroMeter = [0.05,1.5],
     else:
         return diameter, output
     
+def get_detection_weights(design = 'POPS 2', mirrorJetDist = None, noOfAngles = 100, polarization = "perpendicular"):
+    """ The mirror geometry reduced to weights of |S1|^2 and |S2|^2 at the scattering angles seen by the mirror (see
+    Mie.get_detection_weights). This depends only on the design, the mirror-jet distance and the angles, therefore the
+    result is calculated only once.
+
+    Returns
+    -------
+    angles: array
+        scattering angles (in the range 0 to pi) at which S1 and S2 are needed
+    w1, w2: arrays
+        weights, the detected intensity is |S1|^2 . w1 + |S2|^2 . w2
+    """
+    key = (design, mirrorJetDist, noOfAngles, polarization)
+    if key not in _detection_weights:
+        event = Mie(silent = True, design = design, indexOfRef = 1., diameter = 'dynamic')
+        event.set_nang(noOfAngles)
+        if mirrorJetDist is not None:
+            event.POPSdimensions['mirror(top)-jet distance (mm)'] = float(mirrorJetDist)
+        event.set_xAxis()
+        event.update_geometry()
+        w1, w2 = event.get_detection_weights(polarization)
+
+        # same as do_bhmie_hagen: the amplitudes between pi and 2pi are the mirrored ones between 0 and pi
+        noOfAngles_pi = 2 * noOfAngles - 1
+        idx = np.arange(event.angleIndexArray[0], event.angleIndexArray[-1] + 1)
+        idx = np.where(idx < noOfAngles_pi, idx, 2 * noOfAngles_pi - 1 - idx)
+        idx, inverse = np.unique(idx, return_inverse = True)
+        angles = mie_batch.get_angles(noOfAngles)[idx]
+        w1 = np.bincount(inverse, weights = w1, minlength = idx.shape[0])
+        w2 = np.bincount(inverse, weights = w2, minlength = idx.shape[0])
+        _detection_weights[key] = (angles, w1, w2)
+    return _detection_weights[key]
+
+
+def get_response_curves(diameters, wavelengths, IOR = 1.45, design = 'POPS 2', mirrorJetDist = None, noOfAngles = 100,
+                        polarization = "perpendicular", workers = 1, chunksize = None):
+    """ Intensity scattered onto the detector as a function of particle diameter for each wavelength. Same result as
+    calling Mie.get_detectableIntensity for each diameter and wavelength, but the Mie calculation for all particles
+    is done in one batch (optionally parallel, see atmPy.for_removal.mie.mie_parallel) and only at the angles seen by
+    the mirror. Results are cached by (design, mirror distance, n, wavelength spectrum, diameters).
+
+    Parameters
+    ----------
+    diameters: array-like
+        particle diameters in um
+    wavelengths: float or array-like
+        wavelengths in um
+    IOR: complex
+        index of refraction
+    design, mirrorJetDist, noOfAngles, polarization:
+        see Mie
+    workers, chunksize: int
+        see atmPy.for_removal.mie.mie_parallel.MieExecutor
+
+    Returns
+    -------
+    read-only array of shape (no_of_wavelengths, no_of_diameters), shared with the cache
+    """
+    diameters = np.atleast_1d(np.asarray(diameters, dtype = float))
+    wavelengths = np.atleast_1d(np.asarray(wavelengths, dtype = float))
+    key = (design, mirrorJetDist, noOfAngles, polarization, complex(IOR), wavelengths.tobytes(), diameters.tobytes())
+    if key not in _response_curves:
+        angles, w1, w2 = get_detection_weights(design = design, mirrorJetDist = mirrorJetDist, noOfAngles = noOfAngles,
+                                               polarization = polarization)
+        sizeParameter = np.pi * diameters[np.newaxis, :] / wavelengths[:, np.newaxis]
+        mie = mie_cache.mie(sizeParameter.ravel(), IOR, noOfAngles, workers = workers, chunksize = chunksize,
+                            angles = angles)
+        intensities = (np.abs(mie.s1) ** 2).dot(w1) + (np.abs(mie.s2) ** 2).dot(w2)
+        intensities = intensities.reshape(sizeParameter.shape)
+        intensities.flags.writeable = False
+        _response_curves[key] = intensities
+    return _response_curves[key]
+
 ###########################################################    
 class Mie():
     """ Creates a Mie object
@@ -362,7 +441,7 @@ class Mie():
             print(i, ' , ', self.YNatural[i])
             
     def get_mirror_grid(self):
-        np.set_printoptions(threshold=np.nan)
+        np.set_printoptions(threshold=sys.maxsize)
         np.set_printoptions(precision=2)
         
         
@@ -386,7 +465,7 @@ class Mie():
         
 #         
 #         offAngleMatrix = np.empty((nn,nn))
-#         offAngleMatrix[:] = 0 #np.NAN
+#         offAngleMatrix[:] = 0 #np.nan
 #         
         yArcLenghtMatrix = np.empty((nn,nn))
         yArcLenghtMatrix[:] = 0
@@ -408,7 +487,7 @@ class Mie():
 #         print "ss"
 #         raw_input(ss.astype(int))
         
-        ArcLengthMatrix[ArcLengthMatrix > ss/2.] = np.NAN
+        ArcLengthMatrix[ArcLengthMatrix > ss/2.] = np.nan
 #         print "ArcLengthMatrix"
 #         raw_input(ArcLengthMatrix.astype(int))
         
@@ -483,6 +562,32 @@ class Mie():
 
         return integratedIntensity# * stepWidth**2
 
+    def get_detection_weights(self, polarization = "perpendicular"):
+        """ Weights of |S1|^2 and |S2|^2 at the scattering angles seen by the mirror (self.angleIndexArray). This is
+        the sum over the columns of the mirror grid used in get_detectableIntensity, which therefore equals
+        sum(w1 * |S1|^2 + w2 * |S2|^2).
+
+        Returns
+        -------
+        w1, w2: arrays
+        """
+        self.update_geometry()
+        whatList = ('natural', 'parallel', 'perpendicular')
+        if polarization not in whatList:
+            raise ValueError('Geometry has to be one of the following: "%s", "%s", or "%s"? %s is not an option' % (
+            whatList[0], whatList[1], whatList[2], polarization))
+
+        valid = ~np.isnan(self.offAngleMatrix)
+        cos2 = np.where(valid, np.cos(self.offAngleMatrix) ** 2, 0).sum(axis=0)
+        sin2 = np.where(valid, np.sin(self.offAngleMatrix) ** 2, 0).sum(axis=0)
+        if polarization == "parallel":
+            return sin2, cos2
+        elif polarization == "perpendicular":
+            return cos2, sin2
+        else:
+            natural = .5 * valid.sum(axis=0)
+            return natural, natural
+
 def plot_polar(dataList, log = False):
 
 
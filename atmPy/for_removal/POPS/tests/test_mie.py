@@ -0,0 +1,31 @@
+import numpy as np
+
+from atmPy.for_removal.POPS import mie
+
+
+def test_response_curves_vs_mie():
+    """
+    The batched response curves have to reproduce Mie.get_detectableIntensity of each particle.
+    """
+    diameters = np.array([0.1, 0.3, 0.8, 2.])
+    wavelengths = np.array([0.405, 0.5])
+    for polarization in ('perpendicular', 'parallel', 'natural'):
+        curves = mie.get_response_curves(diameters, wavelengths, IOR=1.45, polarization=polarization)
+        assert curves.shape == (2, 4)
+        for e, wavelength in enumerate(wavelengths):
+            for i, diameter in enumerate(diameters):
+                event = mie.Mie(diameter=diameter, wavelength=wavelength, indexOfRef=1.45, design='POPS 2', nang=100)
+                single = event.get_detectableIntensity(polarization)
+                assert abs(curves[e, i] - single) / single < 1e-12
+
+
+def test_response_curves_cached():
+    """
+    Repeated calls return the cached objects.
+    """
+    weights = mie.get_detection_weights(noOfAngles=100)
+    assert mie.get_detection_weights(noOfAngles=100) is weights
+
+    curves = mie.get_response_curves([0.2, 0.5], 0.405, noOfAngles=100)
+    assert mie.get_response_curves(np.array([0.2, 0.5]), 0.405, noOfAngles=100) is curves
+    assert not curves.flags.writeable
@@ -36,7 +36,7 @@ def read_csv(fname, norm2time = True, norm2flow = True):
                     hk = hkt.copy()
                     first = False
                 else:
-                    if not np.array_equal(sd.bincenters, sdt.bincenters):
+                    if sd.binaxis != sdt.binaxis:
                         txt = 'the bincenters changed between files! No good!'
                         raise ValueError(txt)
 
@@ -0,0 +1,471 @@
+import numpy as np
+from scipy.special import jv, yv
+
+
+def _noOfTerms(x, refrel):
+    """Number of series terms (nstop) and start of the downward recurrence of the logarithmic derivative (nmx) for
+    each particle. Same criteria as bhmie.bhmie_hagen.calc_noOfTerms."""
+    xstop = x + 4. * x ** 0.3333 + 2.0
+    ymod = np.abs(x * refrel)
+    nmx = np.fix(np.maximum(xstop, ymod) + 15.0)
+    nstop = xstop.astype(int)
+
+    nmxx = 150000
+    if np.any(nmx > nmxx):
+        raise ValueError("error: nmx > nmxx=%f for |m|x=%f" % (nmxx, ymod.max()))
+    return nstop, nmx.astype(int)
+
+
+def get_logDeriv(x, refrel, nmx, nstop_max):
+    """ Logarithmic derivative D_n(m*x) calculated by downward recurrence for all particles at once.
+
+    The recurrence is run from the largest nmx down. For each particle the value is held at zero until its own nmx is
+    reached, so the result is identical to the one of the single particle calculation.
+
+    Returns
+    -------
+    complex array of shape (no_of_particles, nstop_max). Column n corresponds to D_{n+1}
+    """
+    y = x * refrel
+    nmx_max = nmx.max()
+    d = np.zeros((x.shape[0], nstop_max), dtype=np.complex128)
+    dn = np.zeros(x.shape[0], dtype=np.complex128)
+    for en in range(nmx_max, 1, -1):
+        # dn is D_en at this point, after the step it is D_(en-1)
+        dn = np.where(en <= nmx, (en / y) - (1. / (dn + en / y)), 0)
+        if en - 2 < nstop_max:
+            d[:, en - 2] = dn
+    return d
+
+
+def mie_coefficients(x, refrel):
+    """ Mie coefficients an and bn for an array of homogeneous spheres.
+
+    Parameters
+    ----------
+    x: array-like
+        size parameters
+    refrel: complex or array-like
+        refractive index relative to the surrounding medium, either one value for all particles or one per particle
+
+    Returns
+    -------
+    an, bn: complex arrays of shape (no_of_particles, nstop_max). The coefficients are padded with zeros beyond the
+        number of terms needed for each particular particle.
+    nstop: int array containing the number of terms for each particle
+    """
+    x = np.atleast_1d(np.asarray(x, dtype=float))
+    refrel = np.broadcast_to(np.asarray(refrel, dtype=np.complex128), x.shape)
+
+    nstop, nmx = _noOfTerms(x, refrel)
+    nstop_max = nstop.max()
+    logDeriv = get_logDeriv(x, refrel, nmx, nstop_max)
+
+    an = np.zeros((x.shape[0], nstop_max), dtype=np.complex128)
+    bn = np.zeros((x.shape[0], nstop_max), dtype=np.complex128)
+
+    # Riccati-Bessel functions with real argument X calculated by upward recurrence
+    psi0 = np.cos(x)
+    psi1 = np.sin(x)
+    chi0 = -np.sin(x)
+    chi1 = np.cos(x)
+    xi1 = psi1 - chi1 * 1j
+
+    # beyond nstop the upward recurrence of chi of small particles overflows; those terms are discarded anyway
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        for n in range(nstop_max):
+            en = n + 1.
+            psi = (2. * en - 1.) * psi1 / x - psi0
+            chi = (2. * en - 1.) * chi1 / x - chi0
+            xi = psi - chi * 1j
+
+            valid = n < nstop
+            da = logDeriv[:, n] / refrel + en / x
+            db = refrel * logDeriv[:, n] + en / x
+            an[:, n] = np.where(valid, (da * psi - psi1) / (da * xi - xi1), 0)
+            bn[:, n] = np.where(valid, (db * psi - psi1) / (db * xi - xi1), 0)
+
+            psi0 = psi1
+            psi1 = psi
+            chi0 = chi1
+            chi1 = chi
+            xi1 = psi1 - chi1 * 1j
+    return an, bn, nstop
+
+
+def coated_mie_coefficients(x, y, m1, m2):
+    """ Mie coefficients an and bn for an array of coated spheres (core and shell). This is the batched version of
+    mie_coeffs.coated_mie_coeff. Particles with a core of size zero, no shell, or the same refractive index in core
+    and shell are calculated as homogeneous spheres (mie_coefficients).
+
+    Parameters
+    ----------
+    x: array-like
+        size parameters of the core
+    y: array-like
+        size parameters of the shell (entire particle), y >= x
+    m1, m2: complex or array-like
+        refractive index of the core and the shell
+
+    Returns
+    -------
+    an, bn, nstop: see mie_coefficients
+    """
+    y = np.atleast_1d(np.asarray(y, dtype=float))
+    x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+    m1 = np.broadcast_to(np.asarray(m1, dtype=np.complex128), y.shape)
+    m2 = np.broadcast_to(np.asarray(m2, dtype=np.complex128), y.shape)
+    if np.any(x > y):
+        raise ValueError('The size parameter of the core (x) can not be larger than the one of the shell (y).')
+
+    nstop, nmx = _noOfTerms(y, m2)
+    nmx = np.maximum(nmx, _noOfTerms(y, m1)[1])
+    nstop_max = nstop.max()
+    an = np.zeros((y.shape[0], nstop_max), dtype=np.complex128)
+    bn = np.zeros((y.shape[0], nstop_max), dtype=np.complex128)
+
+    homogeneous = (x == 0) | (x == y) | (m1 == m2)
+    if np.any(homogeneous):
+        # the core is either not there or the entire particle
+        m_hom = np.where(x == 0, m2, m1)[homogeneous]
+        an_h, bn_h, nstop_h = mie_coefficients(y[homogeneous], m_hom)
+        an[homogeneous, :an_h.shape[1]] = an_h
+        bn[homogeneous, :bn_h.shape[1]] = bn_h
+    coated = ~homogeneous
+    if not np.any(coated):
+        return an, bn, nstop
+
+    x = x[coated]
+    y_c = y[coated]
+    m1 = m1[coated]
+    m2 = m2[coated]
+    nstop_c = nstop[coated]
+    nmax = nstop_c.max()
+
+    dnu = get_logDeriv(x, m1, nmx[coated], nmax)
+    dnv = get_logDeriv(x, m2, nmx[coated], nmax)
+    dnw = get_logDeriv(y_c, m2, nmx[coated], nmax)
+
+    n = np.arange(nmax)
+    nu = n + 1.5
+    v = (m2 * x)[:, np.newaxis]
+    w = (m2 * y_c)[:, np.newaxis]
+    yy = y_c[:, np.newaxis]
+    m = (m2 / m1)[:, np.newaxis]
+    m2 = m2[:, np.newaxis]
+
+    # the Bessel functions are only evaluated for the terms needed by the particular particle
+    valid = n[np.newaxis, :] < nstop_c[:, np.newaxis]
+    nu_valid = np.broadcast_to(nu, valid.shape)[valid]
+
+    def riccati_bessel(z):
+        z_valid = np.broadcast_to(z, valid.shape)[valid]
+        psi = np.zeros(valid.shape, dtype=z_valid.dtype)
+        chi = np.zeros(valid.shape, dtype=z_valid.dtype)
+        sz = np.sqrt(0.5 * np.pi * z_valid)
+        psi[valid] = sz * jv(nu_valid, z_valid)
+        chi[valid] = -sz * yv(nu_valid, z_valid)
+        return psi, chi
+
+    # outside the valid terms the results are nan; those terms are discarded anyway
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore', under='ignore'):
+        pv, chv = riccati_bessel(v)
+        pw, chw = riccati_bessel(w)
+        py, chy = riccati_bessel(yy)
+        p1y = np.concatenate((np.sin(yy), py[:, :-1]), axis=1)
+        ch1y = np.concatenate((np.cos(yy), chy[:, :-1]), axis=1)
+        gsy = py - 1j * chy
+        gs1y = p1y - 1j * ch1y
+
+        uu = m * dnu - dnv
+        vv = dnu / m - dnv
+        fv = pv / chv
+        ku1 = uu * fv / pw
+        kv1 = vv * fv / pw
+        pt = pw - chw * fv
+        prat = pw / pv / chv
+        ku2 = uu * pt + prat
+        kv2 = vv * pt + prat
+        dns = ku1 / ku2 + dnw
+        gns = kv1 / kv2 + dnw
+        nrat = (n + 1) / yy
+        a1 = dns / m2 + nrat
+        b1 = m2 * gns + nrat
+        an_c = (py * a1 - p1y) / (gsy * a1 - gs1y)
+        bn_c = (py * b1 - p1y) / (gsy * b1 - gs1y)
+
+    an[coated, :nmax] = np.where(valid, an_c, 0)
+    bn[coated, :nmax] = np.where(valid, bn_c, 0)
+    return an, bn, nstop
+
+
+def _get_noOfAngles(noOfAngles):
+    if not noOfAngles:
+        return 0
+    # Require NANG>1 in order to calculate scattering intensities
+    return max(int(noOfAngles), 2)
+
+
+def get_angles(noOfAngles):
+    """Scattering angles in the range 0 to pi for which S1 and S2 are calculated (noOfAngles between 0 and pi/2)"""
+    noOfAngles = _get_noOfAngles(noOfAngles)
+    if not noOfAngles:
+        return np.zeros(0)
+    dang = .5 * np.pi / (noOfAngles - 1)
+    return np.arange(2 * noOfAngles - 1) * dang
+
+
+def get_pi_tau(mu, nstop_max):
+    """ Angular functions pi_n and tau_n (Bohren and Huffman) for all orders up to nstop_max.
+
+    Parameters
+    ----------
+    mu: array
+        cosine of the scattering angles
+    nstop_max: int
+
+    Returns
+    -------
+    pi, tau: arrays of shape (nstop_max, no_of_angles)
+    """
+    mu = np.asarray(mu, dtype=float)
+    pi = np.zeros((nstop_max, mu.shape[0]))
+    tau = np.zeros((nstop_max, mu.shape[0]))
+    pi0 = np.zeros(mu.shape)
+    pi1 = np.ones(mu.shape)
+    for n in range(nstop_max):
+        en = n + 1.
+        pi[n] = pi1
+        tau[n] = en * mu * pi1 - (en + 1.) * pi0
+        pi0, pi1 = pi1, ((2. * en + 1.) * mu * pi1 - (en + 1.) * pi0) / en
+    return pi, tau
+
+
+class MieBatch(object):
+    """ Mie calculation for many homogeneous spheres at once.
+
+    This does the same calculation as bhmie.bhmie_hagen, but for arrays of size parameters (and optionally refractive
+    indices). All particles are evaluated together in NumPy; the series are padded to the largest number of terms
+    needed. The scattering amplitudes are obtained as matrix products of the Mie coefficients with the angular
+    functions.
+
+    Parameters
+    ----------
+    x: array-like
+        size parameters = k*radius = 2pi/lambda * radius
+    refrel: complex or array-like
+        refraction index (n in complex form for example:  1.5+0.02*i), either one for all particles or one per
+        particle
+    noOfAngles: int
+        number of angles for S1 and S2 function in range from 0 to pi/2. The returned S1, S2 are in the range from
+        0 to pi (2*noOfAngles - 1 values), just like in bhmie_hagen. If 0 the amplitudes are not calculated (s1 and s2
+        are empty), which is much faster if only efficiencies and cross sections are needed.
+    diameter: array-like, optional
+        to calculate the crosssections this value is needed (same units as the desired cross sections ... squared)
+    angles: array-like, optional
+        scattering angles (rad) at which S1 and S2 are calculated. If given, noOfAngles is ignored (and set to None).
+
+    Attributes
+    ----------
+    angles: array
+        scattering angles of s1 and s2
+    s1, s2: complex arrays of shape (no_of_particles, no_of_angles)
+    qext, qsca, qback, gsca: arrays of shape (no_of_particles,)
+    csca, cext: arrays of shape (no_of_particles,), zero if diameter is not given
+    """
+
+    def __init__(self, x, refrel, noOfAngles=100, diameter=None, angles=None):
+        self.sizeParameter = np.atleast_1d(np.asarray(x, dtype=float))
+        self.indOfRefraction = np.broadcast_to(np.asarray(refrel, dtype=np.complex128), self.sizeParameter.shape)
+        if diameter is None:
+            self.diameter = None
+        else:
+            self.diameter = np.broadcast_to(np.asarray(diameter, dtype=float), self.sizeParameter.shape)
+
+        if angles is not None:
+            self.noOfAngles = None
+            self.angles = np.atleast_1d(np.asarray(angles, dtype=float))
+        else:
+            if noOfAngles > 1000:
+                raise ValueError('noOfAngles > 1000')
+            self.noOfAngles = _get_noOfAngles(noOfAngles)
+            self.angles = get_angles(self.noOfAngles)
+
+        self.an, self.bn, self.nstop = self.calc_coefficients()
+
+        self.calc_efficiencies()
+        self.calc_amplitudes()
+        self.calc_crossections()
+
+    @classmethod
+    def from_values(cls, x, refrel, noOfAngles, values, diameter=None):
+        """Creates an instance from previously calculated values (e.g. from the mie_cache) without redoing the
+        calculation.
+
+        Parameters
+        ----------
+        values: dict
+            has to contain 'qext', 'qsca', 'qback', 'gsca', 's1', 's2', and 'angles'
+        """
+        mie = cls.__new__(cls)
+        mie.sizeParameter = np.atleast_1d(np.asarray(x, dtype=float))
+        mie.indOfRefraction = np.broadcast_to(np.asarray(refrel, dtype=np.complex128), mie.sizeParameter.shape)
+        if diameter is None:
+            mie.diameter = None
+        else:
+            mie.diameter = np.broadcast_to(np.asarray(diameter, dtype=float), mie.sizeParameter.shape)
+        if noOfAngles is None:
+            mie.noOfAngles = None
+        else:
+            mie.noOfAngles = _get_noOfAngles(noOfAngles)
+        mie.an = mie.bn = mie.nstop = None
+        for key in ('qext', 'qsca', 'qback', 'gsca', 's1', 's2', 'angles'):
+            setattr(mie, key, values[key])
+        mie.calc_crossections()
+        return mie
+
+    def calc_coefficients(self):
+        return mie_coefficients(self.sizeParameter, self.indOfRefraction)
+
+    def calc_efficiencies(self):
+        """Extinction, scattering and backscattering efficiency and asymmetry parameter from the series"""
+        x = self.sizeParameter
+        an = self.an
+        bn = self.bn
+        en = np.arange(1, an.shape[1] + 1, dtype=float)
+
+        self.qext = (2. / x ** 2) * ((2. * en + 1.) * (an + bn).real).sum(axis=1)
+        qsca = ((2. * en + 1.) * (np.abs(an) ** 2 + np.abs(bn) ** 2)).sum(axis=1)
+
+        gsca = ((2. * en + 1.) / (en * (en + 1.)) * (an.real * bn.real + an.imag * bn.imag)).sum(axis=1)
+        an1 = an[:, :-1]
+        bn1 = bn[:, :-1]
+        an2 = an[:, 1:]
+        bn2 = bn[:, 1:]
+        en2 = en[1:]
+        gsca += (((en2 - 1.) * (en2 + 1.) / en2) *
+                 (an1.real * an2.real + an1.imag * an2.imag + bn1.real * bn2.real + bn1.imag * bn2.imag)).sum(axis=1)
+        self.gsca = 2. * gsca / qsca
+        self.qsca = (2. / x ** 2) * qsca
+
+        # S1 at 180 deg
+        sign = (-1.) ** (en - 1)
+        s1_back = 0.5 * ((2. * en + 1.) * sign * (an - bn)).sum(axis=1)
+        self.qback = 4 * (np.abs(s1_back) / x) ** 2
+
+    def calc_crossections(self):
+        """scattering and extinction crosssections, zero if no diameter is given"""
+        if self.diameter is not None:
+            self.csca = self.qsca * self.diameter ** 2 * np.pi * 0.5 ** 2
+            self.cext = self.qext * self.diameter ** 2 * np.pi * 0.5 ** 2
+        else:
+            self.csca = np.zeros(self.sizeParameter.shape)
+            self.cext = np.zeros(self.sizeParameter.shape)
+
+    def calc_amplitudes(self):
+        """S1 and S2 at self.angles"""
+        if not self.angles.shape[0]:
+            self.s1 = np.zeros((self.sizeParameter.shape[0], 0), dtype=np.complex128)
+            self.s2 = self.s1.copy()
+            return
+        pi, tau = get_pi_tau(np.cos(self.angles), self.an.shape[1])
+        en = np.arange(1, self.an.shape[1] + 1, dtype=float)
+        fn = (2. * en + 1.) / (en * (en + 1.))
+        fan = self.an * fn
+        fbn = self.bn * fn
+        self.s1 = fan.dot(pi) + fbn.dot(tau)
+        self.s2 = fan.dot(tau) + fbn.dot(pi)
+
+    def select(self, where):
+        """Returns a MieBatch instance which contains only a subset of the particles.
+
+        Parameters
+        ----------
+        where: slice, index array, or boolean array
+        """
+        values = {'angles': self.angles}
+        for key in ('qext', 'qsca', 'qback', 'gsca', 's1', 's2'):
+            values[key] = getattr(self, key)[where]
+        if self.diameter is None:
+            diameter = None
+        else:
+            diameter = self.diameter[where]
+        return MieBatch.from_values(self.sizeParameter[where], self.indOfRefraction[where], self.noOfAngles, values,
+                                    diameter=diameter)
+
+    def get_natural(self):
+        return np.abs(self.s1) ** 2 + np.abs(self.s2) ** 2
+
+    def get_perpendicular(self):
+        return np.abs(self.s1) ** 2
+
+    def get_parallel(self):
+        return np.abs(self.s2) ** 2
+
+    def get_angular_scatt_func(self, polarization='natural'):
+        """
+        Returns the angular scattering function in the interval [0,2*pi), same normalization as
+        bhmie.bhmie_hagen.get_angular_scatt_func (the integral over the entire sphere is the scattering crossection).
+        If the instance was created with explicit angles the function is returned at those angles.
+
+        Returns
+        -------
+        angles: array
+        intensities: array of shape (no_of_particles, no_of_angles)
+        """
+        if polarization == 'natural':
+            ss = (np.abs(self.s1) ** 2 + np.abs(self.s2) ** 2) / 2.
+        elif polarization == 'perpendicular':
+            ss = np.abs(self.s1) ** 2
+        elif polarization == 'parallel':
+            ss = np.abs(self.s2) ** 2
+        else:
+            raise ValueError('polarization has to be "natural", "perpendicular", or "parallel"')
+
+        if self.noOfAngles is None:
+            ang = self.angles.copy()
+        else:
+            ss = np.append(ss, ss[:, -2::-1], axis=1)
+            ang = np.linspace(0, np.pi * 2, ss.shape[1])
+        # phase function * csca / 4pi
+        ss *= (self.csca / (np.pi * self.sizeParameter ** 2 * self.qsca))[:, np.newaxis]
+        return ang, ss
+
+    def return_Values_as_dict(self):
+        return {'extinction_efficiency': self.qext,
+                'scattering_efficiency': self.qsca,
+                'backscatter_efficiency': self.qback,
+                'asymmetry_parameter': self.gsca,
+                'scattering_crosssection': self.csca,
+                'extinction_crosssection': self.cext}
+
+    def return_Values(self):
+        return self.s1, self.s2, self.qext, self.qsca, self.qback, self.gsca
+
+
+class CoatedMieBatch(MieBatch):
+    """ Mie calculation for many coated spheres (core and shell) at once, e.g. black carbon with a coating. The
+    batched counterpart of mie_coated.Mie. Everything but the Mie coefficients (see coated_mie_coefficients) is shared
+    with MieBatch, sizeParameter and indOfRefraction refer to the entire particle and the shell, respectively.
+
+    Parameters
+    ----------
+    x: array-like
+        size parameters of the core
+    y: array-like
+        size parameters of the entire particle (shell), y >= x
+    m1, m2: complex or array-like
+        refractive index of the core and the shell
+    noOfAngles, diameter, angles:
+        see MieBatch. diameter is the diameter of the entire particle.
+    """
+
+    def __init__(self, x, y, m1, m2, noOfAngles=100, diameter=None, angles=None):
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        self.coreSizeParameter = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+        self.indOfRefraction_core = np.broadcast_to(np.asarray(m1, dtype=np.complex128), y.shape)
+        super(CoatedMieBatch, self).__init__(y, m2, noOfAngles=noOfAngles, diameter=diameter, angles=angles)
+
+    def calc_coefficients(self):
+        return coated_mie_coefficients(self.coreSizeParameter, self.sizeParameter, self.indOfRefraction_core,
+                                       self.indOfRefraction)
@@ -0,0 +1,231 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from atmPy.for_removal.mie import mie_aux, mie_batch, mie_parallel
+
+_cached_values = ('qext', 'qsca', 'qback', 'gsca', 's1', 's2', 'angles')
+
+_default_cache = None
+
+# results of coated sphere calculations are kept in memory only
+_coated_cache = mie_aux.Cache(size=32)
+
+
+class MieCache(object):
+    """ Persistent on-disk lookup table for Mie calculations.
+
+    Results of mie_batch.MieBatch are stored as .npy files in a directory per entry. Entries are keyed by a hash of the
+    size parameter grid, the refractive index and the number of angles (or the angles), so the cross sections (which
+    also depend on the diameter) are not part of the key and are recalculated on load. Arrays are loaded memory-mapped.
+
+    Since everything lives in the file system the cache is shared between processes. New entries are written to a
+    temporary directory which is then renamed, so concurrent readers never see a half written entry. The modification
+    time of an entry directory is updated on every hit and serves as the time of last use; when the total size
+    exceeds max_size the least recently used entries are removed.
+
+    Parameters
+    ----------
+    path: str, optional
+        cache directory. Default: ~/.atmPy/mie_cache
+    max_size: float, optional
+        maximum size of the cache in bytes
+
+    Example
+    -------
+    >>> cache = MieCache(max_size=1e9)
+    >>> mie = cache.mie(x, 1.455, 100, diameter=d)
+    """
+
+    def __init__(self, path=None, max_size=500e6):
+        if not path:
+            path = os.path.join(os.path.expanduser('~'), '.atmPy', 'mie_cache')
+        self.path = path
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    @staticmethod
+    def get_key(x, refrel, noOfAngles, angles=None):
+        """Hash of (x grid, refractive index, noOfAngles or angles)"""
+        x = np.ascontiguousarray(np.atleast_1d(x), dtype=float)
+        refrel = np.ascontiguousarray(np.broadcast_to(np.asarray(refrel, dtype=np.complex128), x.shape))
+        if np.all(refrel == refrel[0]):
+            refrel = refrel[:1]
+        h = hashlib.sha1()
+        h.update(x.tobytes())
+        h.update(refrel.tobytes())
+        if angles is None:
+            h.update(str(int(noOfAngles)).encode())
+        else:
+            h.update(b'angles')
+            h.update(np.ascontiguousarray(np.atleast_1d(angles), dtype=float).tobytes())
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        """Returns a dict of memory-mapped arrays or None if the key is not in the cache"""
+        entry = self._entry_path(key)
+        if not os.path.isdir(entry):
+            return None
+        try:
+            values = {}
+            for name in _cached_values:
+                values[name] = np.load(os.path.join(entry, name + '.npy'), mmap_mode='r')
+            os.utime(entry, None)
+        except (IOError, OSError, ValueError):
+            # the entry was evicted by another process in the meantime
+            return None
+        return values
+
+    def put(self, key, values):
+        entry = self._entry_path(key)
+        if os.path.isdir(entry):
+            return
+        tmp = tempfile.mkdtemp(dir=self.path, prefix='.tmp_')
+        try:
+            for name in _cached_values:
+                np.save(os.path.join(tmp, name + '.npy'), np.asarray(values[name]))
+            os.rename(tmp, entry)
+        except OSError:
+            # another process was faster
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def get_size(self):
+        """Total size of all entries in bytes"""
+        return sum([i[2] for i in self._entries()])
+
+    def _entries(self):
+        """list of (path, time of last use, size) of all entries"""
+        entries = []
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if name.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum([os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry)])
+                entries.append((entry, os.path.getmtime(entry), size))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is smaller than max_size"""
+        entries = sorted(self._entries(), key=lambda i: i[1])
+        total = sum([i[2] for i in entries])
+        for entry, atime, size in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for entry, atime, size in self._entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def mie(self, x, refrel, noOfAngles=100, diameter=None, workers=1, chunksize=None, angles=None):
+        """Same as mie_batch.MieBatch, but results are taken from the cache if available.
+
+        Parameters
+        ----------
+        workers, chunksize: int, optional
+            if workers is not 1 missing results are calculated in parallel (see mie_parallel.MieExecutor)
+        angles: array-like, optional
+            scattering angles at which S1 and S2 are calculated instead of the noOfAngles grid
+
+        Returns
+        -------
+        mie_batch.MieBatch instance
+        """
+        key = self.get_key(x, refrel, noOfAngles, angles=angles)
+        values = self.get(key)
+        if values is None:
+            mie = _calculate(x, refrel, noOfAngles, diameter, workers, chunksize, angles)
+            self.put(key, dict([(name, getattr(mie, name)) for name in _cached_values]))
+            return mie
+        if angles is not None:
+            noOfAngles = None
+        return mie_batch.MieBatch.from_values(x, refrel, noOfAngles, values, diameter=diameter)
+
+
+def enable(path=None, max_size=500e6):
+    """Switches on the default cache which is used by the optical property calculations of the sizedistribution
+    module.
+
+    Returns
+    -------
+    MieCache instance
+    """
+    global _default_cache
+    _default_cache = MieCache(path=path, max_size=max_size)
+    return _default_cache
+
+
+def disable():
+    global _default_cache
+    _default_cache = None
+
+
+def get_default_cache():
+    return _default_cache
+
+
+def _calculate(x, refrel, noOfAngles, diameter, workers, chunksize, angles):
+    if workers == 1:
+        return mie_batch.MieBatch(x, refrel, noOfAngles, diameter=diameter, angles=angles)
+    return mie_parallel.mie(x, refrel, noOfAngles, diameter=diameter, workers=workers, chunksize=chunksize,
+                            angles=angles)
+
+
+def mie(x, refrel, noOfAngles=100, diameter=None, workers=1, chunksize=None, angles=None):
+    """Mie calculation using the default cache if it is enabled (see enable), else the calculation is simply
+    performed.
+
+    Parameters
+    ----------
+    workers: int, optional
+        number of processes used for the calculation (see mie_parallel.MieExecutor). None: number of CPUs.
+    chunksize: int, optional
+        number of particles per process pool job
+    angles: array-like, optional
+        scattering angles (rad) at which S1 and S2 are calculated instead of the noOfAngles grid
+
+    Returns
+    -------
+    mie_batch.MieBatch instance
+    """
+    if _default_cache is None:
+        return _calculate(x, refrel, noOfAngles, diameter, workers, chunksize, angles)
+    return _default_cache.mie(x, refrel, noOfAngles, diameter=diameter, workers=workers, chunksize=chunksize,
+                              angles=angles)
+
+
+def coated_mie(x, y, m1, m2, noOfAngles=100, diameter=None, angles=None):
+    """Coated sphere Mie calculation (mie_batch.CoatedMieBatch). The results of the most recent calculations are kept
+    in a bounded in-memory LRU cache.
+
+    Returns
+    -------
+    mie_batch.MieBatch instance
+    """
+    y = np.ascontiguousarray(np.atleast_1d(y), dtype=float)
+    h = hashlib.sha1()
+    h.update(MieCache.get_key(y, m2, noOfAngles, angles=angles).encode())
+    h.update(MieCache.get_key(np.broadcast_to(np.asarray(x, dtype=float), y.shape), m1, 0).encode())
+    key = h.hexdigest()
+    if key in _coated_cache:
+        values = _coated_cache[key]
+    else:
+        mie = mie_batch.CoatedMieBatch(x, y, m1, m2, noOfAngles, angles=angles)
+        values = dict([(name, getattr(mie, name)) for name in _cached_values])
+        _coated_cache[key] = values
+    if angles is not None:
+        noOfAngles = None
+    return mie_batch.MieBatch.from_values(y, m2, noOfAngles, values, diameter=diameter)
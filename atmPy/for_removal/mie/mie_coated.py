@@ -19,8 +19,8 @@ IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-from atmPy.mie.mie_coeffs import MieCoeffs
-from atmPy.mie.mie_props import mie_props, mie_S12
+from atmPy.for_removal.mie.mie_coeffs import MieCoeffs
+from atmPy.for_removal.mie.mie_props import mie_props, mie_S12
 from numpy import sqrt
 
 from atmPy.for_removal.mie.mie_aux import Cache
@@ -31,13 +31,14 @@ class MieScatterProps(object):
     """
     def __init__(self, params):
         par = dict(zip(("eps","mu","x","y","eps2"),params[:5]))
+        self._coeffs = None
+        self._props = None
         if par["x"]==0 and par["y"] is None:
             #give valid output for x==0
-            self._coeffs = {"qext":0.0, "qsca":0.0, "qabs":0.0, "qb":0.0,
-                            "0.0":asy, "0.0":qratio}
+            self._props = {"qext":0.0, "qsca":0.0, "qabs":0.0, "qb":0.0,
+                           "asy":0.0, "qratio":0.0}
         else:
             self._coeffs = MieCoeffs(par)
-        self._props = None
         self._S12 = None
         self.size = par["x"] if par["y"]==None else par["y"]
 
@@ -190,7 +191,7 @@ class Mie(object):
 
 
     def _get_m2(self):
-        return sqrt(self.m2)
+        return sqrt(self.eps2)
 
     def _set_m2(self, m2):
         self.eps2 = m2**2
@@ -0,0 +1,152 @@
+import os
+from concurrent import futures
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from atmPy.for_removal.mie import mie_batch
+
+# name, dtype, True if the array has an angle axis
+_results = (('qext', np.float64, False),
+            ('qsca', np.float64, False),
+            ('qback', np.float64, False),
+            ('gsca', np.float64, False),
+            ('s1', np.complex128, True),
+            ('s2', np.complex128, True))
+
+
+def _attach(buffers, noOfParticles, noOfAngles_full):
+    """Returns the opened SharedMemory instances and numpy views on them"""
+    shms = []
+    arrays = {}
+    for name, dtype, angular in _results:
+        shm = shared_memory.SharedMemory(name=buffers[name])
+        shape = (noOfParticles, noOfAngles_full) if angular else (noOfParticles,)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        shms.append(shm)
+    return shms, arrays
+
+
+def _worker(buffers, noOfParticles, index, x, refrel, noOfAngles, angles):
+    """Performs the Mie calculation for one chunk and writes the results into the shared buffers"""
+    mie = mie_batch.MieBatch(x, refrel, noOfAngles, angles=angles)
+    shms, arrays = _attach(buffers, noOfParticles, mie.angles.shape[0])
+    try:
+        for name, dtype, angular in _results:
+            arrays[name][index] = getattr(mie, name)
+    finally:
+        del arrays
+        for shm in shms:
+            shm.close()
+    return index.shape[0]
+
+
+class MieExecutor(object):
+    """ Parallel Mie calculations on a process pool.
+
+    The particles are sorted by size parameter and partitioned into chunks, so that each chunk contains particles with
+    a similar number of terms (the batched calculation of a chunk is padded to its largest particle). The chunks are
+    calculated by a concurrent.futures.ProcessPoolExecutor. The workers write their results directly into shared
+    memory buffers, so the large amplitude arrays (s1, s2) are never pickled.
+
+    The pool is kept alive between calls; use the instance as a context manager or call shutdown when done.
+
+    Parameters
+    ----------
+    workers: int, optional
+        number of processes. Default is the number of CPUs.
+    chunksize: int, optional
+        number of particles per chunk. Default: the particles are split into 4 chunks per worker.
+
+    Example
+    -------
+    >>> with MieExecutor(workers=32) as executor:
+    ...     mie = executor.mie(x, 1.455, 100, diameter=d)
+    """
+
+    def __init__(self, workers=None, chunksize=None):
+        if not workers:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.chunksize = chunksize
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def get_pool(self):
+        if self._pool is None:
+            self._pool = futures.ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def get_chunks(self, x):
+        """List of index arrays, one per chunk, sorted by size parameter"""
+        order = np.argsort(x, kind='mergesort')
+        chunksize = self.chunksize
+        if not chunksize:
+            chunksize = int(np.ceil(x.shape[0] / float(4 * self.workers)))
+        chunksize = max(int(chunksize), 1)
+        return [order[i:i + chunksize] for i in range(0, x.shape[0], chunksize)]
+
+    def mie(self, x, refrel, noOfAngles=100, diameter=None, angles=None):
+        """Same as mie_batch.MieBatch but the calculation is distributed over the process pool.
+
+        Returns
+        -------
+        mie_batch.MieBatch instance
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        refrel = np.broadcast_to(np.asarray(refrel, dtype=np.complex128), x.shape)
+        chunks = self.get_chunks(x)
+        if self.workers == 1 or len(chunks) == 1:
+            return mie_batch.MieBatch(x, refrel, noOfAngles, diameter=diameter, angles=angles)
+
+        if angles is None:
+            angles_full = mie_batch.get_angles(noOfAngles)
+        else:
+            noOfAngles = None
+            angles_full = np.atleast_1d(np.asarray(angles, dtype=float))
+        noOfParticles = x.shape[0]
+        shms = {}
+        try:
+            for name, dtype, angular in _results:
+                size = noOfParticles * np.dtype(dtype).itemsize
+                if angular:
+                    size *= angles_full.shape[0]
+                shms[name] = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            buffers = dict([(name, shm.name) for name, shm in shms.items()])
+
+            pool = self.get_pool()
+            jobs = [pool.submit(_worker, buffers, noOfParticles, index, x[index], refrel[index], noOfAngles, angles)
+                    for index in chunks]
+            for job in futures.as_completed(jobs):
+                job.result()
+
+            values = {'angles': angles_full}
+            for name, dtype, angular in _results:
+                shape = (noOfParticles, angles_full.shape[0]) if angular else (noOfParticles,)
+                values[name] = np.ndarray(shape, dtype=dtype, buffer=shms[name].buf).copy()
+        finally:
+            for shm in shms.values():
+                shm.close()
+                shm.unlink()
+        return mie_batch.MieBatch.from_values(x, refrel, noOfAngles, values, diameter=diameter)
+
+
+def mie(x, refrel, noOfAngles=100, diameter=None, workers=None, chunksize=None, angles=None):
+    """Parallel Mie calculation on a temporary process pool, see MieExecutor.
+
+    Returns
+    -------
+    mie_batch.MieBatch instance
+    """
+    with MieExecutor(workers=workers, chunksize=chunksize) as executor:
+        return executor.mie(x, refrel, noOfAngles, diameter=diameter, angles=angles)
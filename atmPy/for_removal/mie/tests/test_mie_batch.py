@@ -0,0 +1,121 @@
+import numpy as np
+
+from atmPy.for_removal.mie import bhmie, mie_batch
+
+
+def test_batch_vs_bhmie_hagen():
+    """
+    The batched Mie calculation has to reproduce the single particle calculation of bhmie_hagen.
+    """
+    x = np.array([0.01, 0.3, 1.5, 5., 20., 60.])
+    n = 1.5 + 0.01j
+    batch = mie_batch.MieBatch(x, n, 50, diameter=x)
+    ang, asf = batch.get_angular_scatt_func()
+
+    for e, xi in enumerate(x):
+        single = bhmie.bhmie_hagen(xi, n, 50, diameter=xi)
+        for is_val, should_val in ((batch.qext[e], single.qext),
+                                   (batch.qsca[e], single.qsca),
+                                   (batch.qback[e], single.qback),
+                                   (batch.gsca[e], single.gsca)):
+            assert abs(is_val - should_val) / abs(should_val) < 1e-8
+
+        assert np.allclose(batch.s1[e], single.s1, rtol=1e-8, atol=0)
+        assert np.allclose(batch.s2[e], single.s2, rtol=1e-8, atol=0)
+        asf_single = single.get_angular_scatt_func()
+        assert np.allclose(ang, asf_single.index.values)
+        assert np.allclose(asf[e], asf_single.natural.values, rtol=1e-8)
+
+
+def test_batch_refractive_index_per_particle():
+    x = np.array([0.5, 2., 8.])
+    n = np.array([1.33, 1.5 + 0.1j, 1.75 + 0.44j])
+    batch = mie_batch.MieBatch(x, n, 10)
+    for e in range(x.shape[0]):
+        single = bhmie.bhmie_hagen(x[e], n[e], 10)
+        assert abs(batch.qext[e] - single.qext) / single.qext < 1e-8
+        assert abs(batch.qsca[e] - single.qsca) / single.qsca < 1e-8
+
+
+def test_mie_cache():
+    import shutil
+    import tempfile
+    from atmPy.for_removal.mie import mie_cache
+
+    path = tempfile.mkdtemp()
+    cache = mie_cache.MieCache(path=path, max_size=1e9)
+    d = np.logspace(-1, 0, 20)
+    x = np.pi * d / 0.55
+    first = cache.mie(x, 1.455, 20, diameter=d)
+    second = cache.mie(x, 1.455, 20, diameter=d)
+    assert second.an is None  # loaded from the cache
+    assert np.allclose(first.csca, second.csca)
+    assert np.allclose(first.s1, second.s1)
+
+    cache.max_size = 0
+    cache.evict()
+    assert cache.get_size() == 0
+    shutil.rmtree(path)
+
+
+def test_mie_parallel():
+    from atmPy.for_removal.mie import mie_parallel
+
+    x = np.logspace(-1, 1.5, 200)[::-1]
+    n = 1.5 + 0.01j
+    serial = mie_batch.MieBatch(x, n, 20)
+    with mie_parallel.MieExecutor(workers=2, chunksize=30) as executor:
+        parallel = executor.mie(x, n, 20)
+    assert np.allclose(serial.qext, parallel.qext, rtol=1e-12)
+    assert np.allclose(serial.gsca, parallel.gsca, rtol=1e-12)
+    assert np.allclose(serial.s1, parallel.s1, rtol=1e-10)
+    assert np.allclose(serial.s2, parallel.s2, rtol=1e-10)
+
+
+def test_batch_explicit_angles():
+    """
+    S1 and S2 calculated at explicit angles have to agree with the equally spaced grid.
+    """
+    x = np.array([0.5, 3., 12.])
+    grid = mie_batch.MieBatch(x, 1.5 + 0.01j, 30)
+    sel = np.array([0, 7, 29, 50])
+    batch = mie_batch.MieBatch(x, 1.5 + 0.01j, angles=grid.angles[sel])
+    assert batch.noOfAngles is None
+    assert np.allclose(batch.s1, grid.s1[:, sel], rtol=1e-12)
+    assert np.allclose(batch.s2, grid.s2[:, sel], rtol=1e-12)
+
+
+def test_coated_batch_vs_mie_coated():
+    """
+    The batched coated sphere calculation has to reproduce mie_coated.Mie.
+    """
+    from atmPy.for_removal.mie import mie_coated
+
+    x = np.array([0.1, 0.5, 2., 4., 10.])
+    y = np.array([0.2, 1., 3., 8., 20.])
+    m1 = 1.95 + 0.79j
+    m2 = 1.5 + 0.001j
+    batch = mie_batch.CoatedMieBatch(x, y, m1, m2, 10)
+    for e in range(x.shape[0]):
+        single = mie_coated.Mie(x=x[e], m=m1, y=y[e], m2=m2)
+        assert abs(batch.qext[e] - single.qext()) / single.qext() < 1e-8
+        assert abs(batch.qsca[e] - single.qsca()) / single.qsca() < 1e-8
+        assert abs(batch.gsca[e] - single.asy()) < 1e-8
+        s1, s2 = single.S12(np.cos(batch.angles[5]))
+        assert abs(batch.s1[e, 5] - s1) / abs(s1) < 1e-6
+        assert abs(batch.s2[e, 5] - s2) / abs(s2) < 1e-6
+
+    # without core the particles are homogeneous spheres made of the shell material
+    homogeneous = mie_batch.MieBatch(y, m2, 10)
+    assert np.allclose(mie_batch.CoatedMieBatch(0 * y, y, m1, m2, 10).qext, homogeneous.qext, rtol=1e-12)
+
+
+def test_cache_lru():
+    from atmPy.for_removal.mie import mie_aux
+
+    cache = mie_aux.Cache(size=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    cache['a']
+    cache['c'] = 3
+    assert list(cache.keys()) == ['a', 'c']
@@ -117,10 +117,11 @@ def simulate_from_size_dist_LS(dist_LS, airmassfct=True, rotations=2, sun_azimut
         AODs
         skyBrs
     """
+    # the angular scattering function is calculated in simulate_from_size_dist_opt at the exact angles needed
+    optPs_spectral = dist_LS.calculate_spectral_optical_properties(miniSASP_channels, 1.455, products=('ext',))
     optPs = {}
     for wl in miniSASP_channels:
-        optP = dist_LS.calculate_optical_properties(wl, 1.455)
-        optPs[wl] = optP
+        optPs[wl] = optPs_spectral['%.1f' % wl]
 
     skyBrs = {}
     aods = {}
@@ -135,7 +136,8 @@ def simulate_from_size_dist_LS(dist_LS, airmassfct=True, rotations=2, sun_azimut
 
 
 # ToDo: include actual TEMP and pressure
-def simulate_from_size_dist_opt(opt_prop, airmassfct=True, rotations=2, sun_azimuth=True, pressure=True, temp=True):
+def simulate_from_size_dist_opt(opt_prop, airmassfct=True, rotations=2, sun_azimuth=True, pressure=True, temp=True,
+                                no_angles=None):
     """ Simulates miniSASP signal from a size distribution layer series (in particular from the optical property class
     derived from the layer series.
     The simulation calculates the position of the sun at the instruments position during the experiment. Slant angles
@@ -162,6 +164,10 @@ def simulate_from_size_dist_opt(opt_prop, airmassfct=True, rotations=2, sun_azim
         If True the opt_prop.paretn_timeseries.Temperature timeseries.
         If False standard atmosphere is used.
         If array-like the this array is used.
+    no_angles: int, optional.
+        Number of mSASP positions (over all rotations) to be simulated. Default: half the number of angles in
+        opt_prop.angular_scatt_func times rotations (198 * rotations if opt_prop has no angular scattering function).
+        The scattered intensities are calculated exactly at the angles between the mSASP positions and the sun.
 
     Returns
     -------
@@ -184,55 +190,47 @@ def simulate_from_size_dist_opt(opt_prop, airmassfct=True, rotations=2, sun_azim
     what_mSASP_sees_aerosols = pd.DataFrame()
     what_mSASP_sees_AOD_aerosols = np.zeros(alts.shape)
 
+    if not no_angles:
+        if opt_prop.angular_scatt_func is not None:
+            # pretty arbitrary number ... this is just to get a reasonal number of angles
+            no_angles = int(opt_prop.angular_scatt_func.shape[0] / 2) * rotations
+        else:
+            no_angles = (2 * 100 - 2) * rotations
+
+    # angles between mSASP positions and sun for each layer (sun position at the time when the plane was at the
+    # particular altitude).
+    mSASP2Sunangles_LS = []
     for altitude in range(dist_ls.layercenters.shape[0]):
-        # get the sun position at the time when the plane was at the particular altitude,
         sol_el = solar_elev[altitude]
         sol_az = solar_az[altitude]
-
-
-        # angles between mSASP positions and sun. This is used to pick the angle in the phase functions
         if sun_azimuth:
             sun_azimuth = sol_az
         else:
             sun_azimuth = 0
-        mSASP2Sunangles = angle_MSASP_sun(sol_el,
-                                          sun_azimuth=sun_azimuth,
-                                          no_angles=int(opt_prop.angular_scatt_func.shape[0] / 2) * rotations,
-                                          # pretty arbitrary number ... this is just to get a reasonal number of angles
-                                          no_rotations=rotations)
-
-        # pick relevant angles in phase function for each layer, this includes selecting the relavant layers (selected altitude to top).
-        closest_phase2sun_azi = array_tools.find_closest(opt_prop.angular_scatt_func.index.values,
-                                                         mSASP2Sunangles.mSASP_sun_angle.values)
-        # minimize so values are calculated only once
-        closest_phase2sun_azi = np.unique(closest_phase2sun_azi)
-        phase_fct_rel = opt_prop.angular_scatt_func.iloc[closest_phase2sun_azi, altitude:]
-        # Integrate ofer selected intensities in phase function along vertical line (from selected height to top)
-        # x = phase_fct_rel.columns.values
-        # do_integ = lambda y: integrate.simps(y, x)
-        # phase_fct_rel_integ = pd.DataFrame(phase_fct_rel.apply(do_integ, axis=1),
-        #                                    columns=[alts[altitude]],
-        #                                    # columns=[dist_ls.layercenters[altitude]]
-        #                                    )  # these are the integrated intensities of scattered light into the relavant angles. Integration is from current (arbitrary) to top layer
-        # print(phase_fct_rel.shape, layerthickness[altitude:].shape)
-        phth = phase_fct_rel * layerthickness[altitude:]
-        phase_fct_rel_integ = pd.DataFrame(phth.apply(np.sum, 1))
-        # return phase_fct_rel, phase_fct_rel_integ
-
+        mSASP2Sunangles_LS.append(angle_MSASP_sun(sol_el,
+                                                  sun_azimuth=sun_azimuth,
+                                                  no_angles=no_angles,
+                                                  no_rotations=rotations))
+
+    # The angular scattering function is calculated exactly at all angles needed (each only once)
+    angles_needed = np.unique(np.concatenate([i.mSASP_sun_angle.values for i in mSASP2Sunangles_LS]))
+    opt_prop_angles = dist_ls.calculate_optical_properties(opt_prop.wavelength, opt_prop.index_of_refractio,
+                                                           products=('asf',), angles=angles_needed)
+    phase_fct = opt_prop_angles.angular_scatt_func.values
+    # Integrate the scattered intensities along vertical line (from each layer to top)
+    phth = phase_fct * layerthickness
+    phth[np.isnan(phth)] = 0
+    phase_fct_integ = phth[:, ::-1].cumsum(axis=1)[:, ::-1]
+
+    for altitude, mSASP2Sunangles in enumerate(mSASP2Sunangles_LS):
         if airmassfct:
             slant_adjust = 1. / np.sin(solar_elev[altitude])
         else:
             slant_adjust = 1.
-        # similar to above this selects the different angels of mSASP to the sun. However, it keeps all of them (no unique)
-        closest_phase2sun_azi = array_tools.find_closest(phase_fct_rel_integ.index.values,
-                                                         mSASP2Sunangles.mSASP_sun_angle.values)
-
+        idx = np.searchsorted(angles_needed, mSASP2Sunangles.mSASP_sun_angle.values)
         what_mSASP_sees_aerosols[dist_ls.layercenters[altitude]] = pd.Series(
-            phase_fct_rel_integ.iloc[closest_phase2sun_azi].values.transpose()[0] * slant_adjust)
-        # what_mSASP_sees_aerosols[dist_ls.layercenters[altitude]] = pd.Series(
-        #     phase_fct_rel_integ.iloc[closest_phase2sun_azi].values.transpose()[0] * slant_adjust)
+            phase_fct_integ[idx, altitude] * slant_adjust)
 
-        # what_mSASP_sees_AOD_aerosols[altitude] = opt_prop.data_orig['AOD_layer'][altitude:].sum().values[0] * slant_adjust
         what_mSASP_sees_AOD_aerosols[altitude] = opt_prop.data_orig['AOD_cum'].values[altitude][0] * slant_adjust
     what_mSASP_sees_aerosols.index = mSASP2Sunangles.index
     # what_mSASP_sees_AOD_aerosols = pd.DataFrame(what_mSASP_sees_AOD_aerosols, index = alts, columns = ['AOD_aerosols'])